@@ -1,3 +1,73 @@
 from django.contrib import admin
 
 # Register your models here.
+from .models import (
+    BackgroundJob,
+    BackgroundJobAttempt,
+    CachedSummary,
+    CachedTranscript,
+    CompactTranscript,
+    OpenAIAssistant,
+    TranscriptionBatch,
+    TranscriptionJob,
+    TranscriptSummary,
+)
+
+
+@admin.register(TranscriptionJob)
+class TranscriptionJobAdmin(admin.ModelAdmin):
+    list_display = ['job_name', 'job_type', 'status', 'created_at', 'updated_at']
+    list_filter = ['job_type', 'status']
+    search_fields = ['job_name', 's3_url']
+
+
+@admin.register(TranscriptionBatch)
+class TranscriptionBatchAdmin(admin.ModelAdmin):
+    list_display = ['id', 'job_type', 'created_at']
+    raw_id_fields = ['jobs']
+
+
+@admin.register(CachedTranscript)
+class CachedTranscriptAdmin(admin.ModelAdmin):
+    list_display = ['key', 'size', 'created_at', 'last_accessed']
+    search_fields = ['key']
+    exclude = ['content']
+
+
+@admin.register(CompactTranscript)
+class CompactTranscriptAdmin(admin.ModelAdmin):
+    list_display = ['job', 'duration', 'source_size', 'created_at']
+    search_fields = ['job__job_name']
+    raw_id_fields = ['job']
+    exclude = ['text']
+
+
+@admin.register(TranscriptSummary)
+class TranscriptSummaryAdmin(admin.ModelAdmin):
+    list_display = ['job', 'model', 'prompt_version', 'created_at']
+    search_fields = ['job__job_name']
+    raw_id_fields = ['job']
+
+
+@admin.register(CachedSummary)
+class CachedSummaryAdmin(admin.ModelAdmin):
+    list_display = ['key', 'size', 'created_at', 'last_accessed']
+    search_fields = ['key']
+
+
+@admin.register(OpenAIAssistant)
+class OpenAIAssistantAdmin(admin.ModelAdmin):
+    list_display = ['key', 'assistant_id', 'created_at']
+
+
+class BackgroundJobAttemptInline(admin.TabularInline):
+    model = BackgroundJobAttempt
+    extra = 0
+    readonly_fields = ['number', 'worker', 'started_at', 'finished_at', 'duration_ms', 'error']
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'attempts', 'run_after', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status']
+    inlines = [BackgroundJobAttemptInline]
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from openai import NotFoundError
+
+from .models import OpenAIAssistant
+from .utils import (
+        ASSISTANT_INSTRUCTIONS,
+        OPENAI_MODEL,
+        SUMMARY_PROMPT_VERSION,
+        cancel_run,
+        create_assistant,
+        create_message,
+        create_thread,
+        delete_assistant,
+        delete_thread,
+        delete_txt_file_from_openai,
+        delete_vector_store,
+        get_list_messages,
+        retrieve_assistant,
+        retrieve_run,
+        run_thread,
+        upload_txt_file_to_openai,
+    )
+
+logger = logging.getLogger(__name__)
+
+# Run statuses after which the run will not change any more
+FAILED_RUN_STATUSES = ['failed', 'cancelled', 'expired', 'incomplete']
+# Polling starts fast, most short summaries are done within a few seconds
+RUN_POLL_INTERVAL = 0.5
+RUN_POLL_MAX_INTERVAL = 5
+# Name of the file plain text is uploaded as
+UPLOAD_FILE_NAME = 'transcript.txt'
+
+
+class AssistantRunError(Exception):
+    pass
+
+_assistant_ids = {}
+_assistant_lock = threading.Lock()
+
+# Per-request OpenAI resources are deleted off the request path
+cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='openai-cleanup')
+
+
+def assistant_key():
+    return f"{OPENAI_MODEL}:v{SUMMARY_PROMPT_VERSION}"
+
+
+def get_assistant_id():
+    # Created on first use, persisted so other processes and restarts reuse it, validated once per process
+    key = assistant_key()
+    with _assistant_lock:
+        if key in _assistant_ids:
+            return _assistant_ids[key]
+        record = OpenAIAssistant.objects.filter(key=key).first()
+        if record is not None:
+            try:
+                retrieve_assistant(record.assistant_id)
+            except NotFoundError:
+                logger.warning("Assistant %s no longer exists, creating a new one", record.assistant_id)
+                record.delete()
+                record = None
+        if record is None:
+            record = _create_assistant_record(key)
+        _assistant_ids[key] = record.assistant_id
+        return record.assistant_id
+
+
+def forget_assistant():
+    # Drop the validated id so the next request checks the stored assistant again
+    with _assistant_lock:
+        _assistant_ids.pop(assistant_key(), None)
+
+
+def _create_assistant_record(key):
+    assistant = create_assistant()
+    record, created = OpenAIAssistant.objects.get_or_create(key=key, defaults={'assistant_id': assistant.id})
+    if not created:
+        # Another process stored its assistant first, use that one
+        delete_assistant(assistant_id=assistant.id)
+    return record
+
+
+def summarize_with_assistant(content, name=UPLOAD_FILE_NAME):
+    # content is the text as UTF-8 bytes or a binary file object, uploaded to OpenAI from memory.
+    # file_search goes by the extension, so name must end in .txt
+    file = upload_txt_file_to_openai(name, content)
+    thread = None
+    try:
+        thread = create_thread(file_id=file.id)
+        create_message(thread_id=thread.id, message=ASSISTANT_INSTRUCTIONS)
+        try:
+            run = run_thread(thread_id=thread.id, assistant_id=get_assistant_id())
+        except NotFoundError:
+            # The assistant was deleted behind our back
+            forget_assistant()
+            OpenAIAssistant.objects.filter(key=assistant_key()).delete()
+            run = run_thread(thread_id=thread.id, assistant_id=get_assistant_id())
+        wait_for_run(thread.id, run)
+        list_messages = get_list_messages(thread_id=thread.id)
+        return list_messages.data[0].content[0].text.value
+    finally:
+        cleanup_executor.submit(cleanup_request_resources, file.id, thread)
+
+
+def wait_for_run(thread_id, run):
+    # Returns once the run completed, raises AssistantRunError if it ended any other way or
+    # did not finish within OPENAI_RUN_TIMEOUT seconds
+    deadline = time.monotonic() + settings.OPENAI_RUN_TIMEOUT
+    interval = RUN_POLL_INTERVAL
+    while run.status != 'completed':
+        if run.status in FAILED_RUN_STATUSES:
+            error = getattr(run, 'last_error', None)
+            raise AssistantRunError(f"Run {run.id} {run.status}" + (f": {error.message}" if error else ''))
+        if run.status == 'requires_action' or time.monotonic() >= deadline:
+            # No tools of ours need an answer, so the run would only wait until it expires
+            cancel_run(thread_id=thread_id, run_id=run.id)
+            raise AssistantRunError(f"Run {run.id} cancelled while {run.status}")
+        time.sleep(interval)
+        interval = min(interval * 2, RUN_POLL_MAX_INTERVAL)
+        run = retrieve_run(thread_id=thread_id, run_id=run.id)
+    return run
+
+
+def cleanup_request_resources(file_id, thread):
+    # Each deletion on its own, one that fails does not leave the others behind
+    if thread is not None:
+        file_search = getattr(thread.tool_resources, 'file_search', None)
+        for vector_store_id in getattr(file_search, 'vector_store_ids', None) or []:
+            _delete('vector store', vector_store_id, delete_vector_store, vector_store_id)
+        _delete('thread', thread.id, delete_thread, thread_id=thread.id)
+    _delete('file', file_id, delete_txt_file_from_openai, file_id=file_id)
+
+
+def _delete(kind, resource_id, func, *args, **kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception("Deleting OpenAI %s %s failed", kind, resource_id)
@@ -0,0 +1,124 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework.authtoken.models import Token
+
+from .cache import asummarize_once, get_summary, summary_key
+from .streaming import summary_stream_response, wants_stream
+from .summarize import AsyncMapReduceSummarizer
+from .views import S3FileListView, TranscribeAudioView, TranscribeAudioViewMedical, TranscriptionJobStatusView, openai_error_response
+
+logger = logging.getLogger(__name__)
+
+# boto3 has no asyncio API: AWS calls run on a bounded pool so a burst of requests queues on the
+# event loop instead of starting a thread each
+blocking_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_BLOCKING_WORKERS, thread_name_prefix='async-blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    # The context is copied like sync_to_async does, so calls in the pool count towards the request's metrics
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        blocking_executor, functools.partial(context.run, _call_with_connections, func, *args, **kwargs))
+
+
+def _call_with_connections(func, *args, **kwargs):
+    # Pool threads outlive requests, so their database connections are handled like a request's
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def authenticate_token(request):
+    # TokenAuthentication for plain Django views: `Authorization: Token <key>`
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0].lower() != 'token':
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=header[1])
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+def token_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await authenticate_token(request)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def offload(view_class):
+    """Serves a DRF view from the blocking pool, so it can be mounted on the ASGI path.
+
+    The view keeps its own authentication, validation and rendering; only the thread it runs on changes.
+    """
+    sync_view = view_class.as_view()
+
+    def render(request, *args, **kwargs):
+        response = sync_view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        return await run_blocking(render, request, *args, **kwargs)
+    return view
+
+
+async_transcribe = offload(TranscribeAudioView)
+async_transcribe_medical = offload(TranscribeAudioViewMedical)
+async_transcription_job_status = offload(TranscriptionJobStatusView)
+async_s3_file_list = offload(S3FileListView)
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+@token_required
+async def async_summarize(request):
+    try:
+        text = request_data(request).get('text')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not text:
+        return JsonResponse({'error': 'Missing text'}, status=400)
+
+    cache_key = summary_key(text)
+    if wants_stream(request):
+        return summary_stream_response(text, cache_key, run_blocking)
+    summary = await sync_to_async(get_summary)(cache_key)
+    if summary is not None:
+        return JsonResponse({'summary': summary})
+
+    try:
+        # Identical texts summarized at the same time share one summary. SUMMARY_ENGINE=assistant
+        # only applies to api/summarize/, the async path always maps and reduces
+        summary = await asummarize_once(cache_key, lambda: AsyncMapReduceSummarizer().summarize(text))
+    except Exception as e:
+        logger.exception("Summarizing failed")
+        return openai_error_response(e, JsonResponse) or JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({'summary': summary})
@@ -0,0 +1,49 @@
+import threading
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+from .metrics import instrument_boto_client
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name):
+    # boto3 clients are thread safe, so one per service is shared by every request in the process.
+    # Building a client resolves credentials and loads the service model, which is slow,
+    # and each client owns its own connection pool.
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                client = _create_client(service_name)
+                _clients[service_name] = client
+    return client
+
+
+def reset_clients():
+    # Needed after settings change (tests) or in a forked child that must not share sockets
+    with _lock:
+        _clients.clear()
+
+
+def _create_client(service_name):
+    # Sessions are not thread safe, each client gets its own and is created under the lock
+    session = boto3.session.Session(
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME,
+    )
+    config = Config(
+        max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=settings.AWS_CONNECT_TIMEOUT,
+        read_timeout=settings.AWS_READ_TIMEOUT,
+        retries={'max_attempts': settings.AWS_MAX_ATTEMPTS, 'mode': 'standard'},
+    )
+    client = session.client(service_name, config=config)
+    instrument_boto_client(client)
+    return client
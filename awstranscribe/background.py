@@ -0,0 +1,190 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BackgroundJob, BackgroundJobAttempt
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def register(kind):
+    """Registers ``handler(payload) -> result`` for jobs of ``kind``; the result must be JSON serializable."""
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def get_handler(kind):
+    # The handlers import the OpenAI and AWS helpers, so they are loaded on first use
+    from . import tasks  # noqa: F401
+    return _handlers.get(kind)
+
+
+def enqueue(kind, payload=None, max_attempts=None, delay=0, unique_key=None):
+    # With a unique_key, the queued or running job with that key is returned instead of queueing
+    # a second one. The unique constraint decides, so concurrent callers in any process agree
+    fields = {
+        'kind': kind,
+        'payload': payload or {},
+        'max_attempts': max_attempts or settings.BACKGROUND_JOB_MAX_ATTEMPTS,
+        'run_after': timezone.now() + timedelta(seconds=delay),
+    }
+    if unique_key is None:
+        return BackgroundJob.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return BackgroundJob.objects.create(unique_key=unique_key, **fields)
+    except IntegrityError:
+        pending = BackgroundJob.objects.filter(
+            unique_key=unique_key, status__in=[BackgroundJob.QUEUED, BackgroundJob.RUNNING],
+        ).first()
+        # Finished in between, this one is queued after all
+        return pending or enqueue(kind, payload, max_attempts, delay, unique_key)
+
+
+def retry_delay(attempt):
+    # Exponential backoff with full jitter, so failing jobs do not retry in lockstep
+    delay = min(settings.BACKGROUND_JOB_RETRY_DELAY * 2 ** (attempt - 1), settings.BACKGROUND_JOB_MAX_RETRY_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+def claim_jobs(worker_id, limit):
+    candidates = BackgroundJob.objects.filter(
+        status=BackgroundJob.QUEUED, run_after__lte=timezone.now(),
+    ).order_by('run_after', 'pk').values_list('pk', flat=True)
+    if connection.features.has_select_for_update_skip_locked:
+        # Postgres: workers skip rows another worker is claiming instead of queueing up behind it
+        with transaction.atomic():
+            claimed = _claim(worker_id, list(candidates.select_for_update(skip_locked=True)[:limit]))
+    else:
+        # SQLite has no row locks, and a read-then-write transaction fails under contention
+        # instead of waiting, the conditional update alone keeps each claim exclusive
+        claimed = _claim(worker_id, list(candidates[:limit]))
+    return list(BackgroundJob.objects.filter(pk__in=claimed).order_by('run_after', 'pk'))
+
+
+def _claim(worker_id, pks):
+    now = timezone.now()
+    claimed = []
+    for pk in pks:
+        updated = BackgroundJob.objects.filter(pk=pk, status=BackgroundJob.QUEUED).update(
+            status=BackgroundJob.RUNNING, locked_by=worker_id, locked_at=now, attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(pk)
+    return claimed
+
+
+def requeue_stale_jobs(timeout=None):
+    # Jobs of workers that died mid-run go back to the queue, or fail when out of attempts
+    timeout = timeout if timeout is not None else settings.BACKGROUND_JOB_TIMEOUT
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = BackgroundJob.objects.filter(status=BackgroundJob.RUNNING, locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=BackgroundJob.FAILED, error='Worker timed out', finished_at=timezone.now(), locked_by='',
+    )
+    requeued = stale.update(status=BackgroundJob.QUEUED, run_after=timezone.now(), locked_by='')
+    return failed + requeued
+
+
+def run_job(job, worker_id):
+    now = timezone.now()
+    if job.started_at is None:
+        job.started_at = now
+    attempt = BackgroundJobAttempt.objects.create(job=job, number=job.attempts, worker=worker_id, started_at=now)
+    start = time.monotonic()
+    try:
+        handler = get_handler(job.kind)
+        if handler is None:
+            # Retrying will not make an unknown kind known
+            job.attempts = job.max_attempts
+            raise LookupError(f"No handler registered for {job.kind!r}")
+        result = handler(job.payload)
+    except Exception as error:
+        logger.exception("Background job %s attempt %s failed", job.pk, job.attempts)
+        job.error = f"{type(error).__name__}: {error}"
+        if job.attempts >= job.max_attempts:
+            job.status = BackgroundJob.FAILED
+            job.finished_at = timezone.now()
+        else:
+            job.status = BackgroundJob.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+    else:
+        job.status = BackgroundJob.SUCCEEDED
+        job.result = result
+        job.error = ''
+        job.finished_at = timezone.now()
+    attempt.finished_at = timezone.now()
+    attempt.duration_ms = int((time.monotonic() - start) * 1000)
+    attempt.error = job.error if job.status != BackgroundJob.SUCCEEDED else ''
+    attempt.save(update_fields=['finished_at', 'duration_ms', 'error'])
+    job.locked_by = ''
+    job.save(update_fields=[
+        'status', 'attempts', 'run_after', 'locked_by', 'result', 'error', 'started_at', 'finished_at',
+    ])
+    return job
+
+
+class Worker:
+    """Claims queued BackgroundJob rows and runs up to ``concurrency`` of them at a time.
+
+    Any number of workers can share one database, each job is claimed by exactly one of them.
+    """
+
+    def __init__(self, concurrency=None, interval=None, worker_id=None):
+        self.concurrency = concurrency or settings.BACKGROUND_WORKER_CONCURRENCY
+        self.interval = interval if interval is not None else settings.BACKGROUND_WORKER_POLL_INTERVAL
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop_event = threading.Event()
+
+    def run_once(self):
+        # Claims and runs one batch, returns the number of jobs run
+        jobs = claim_jobs(self.worker_id, self.concurrency)
+        if jobs:
+            with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix='background-job') as executor:
+                list(executor.map(self._run, jobs))
+        return len(jobs)
+
+    def run(self):
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='background-job')
+        running = set()
+        try:
+            while not self._stop_event.is_set():
+                running = {future for future in running if not future.done()}
+                claimed = []
+                close_old_connections()
+                try:
+                    requeue_stale_jobs()
+                    if len(running) < self.concurrency:
+                        claimed = claim_jobs(self.worker_id, self.concurrency - len(running))
+                except Exception:
+                    logger.exception("Claiming background jobs failed")
+                for job in claimed:
+                    running.add(executor.submit(self._run, job))
+                if not claimed:
+                    self._stop_event.wait(self.interval)
+        finally:
+            executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, job):
+        close_old_connections()
+        try:
+            return run_job(job, self.worker_id)
+        finally:
+            close_old_connections()
@@ -0,0 +1,191 @@
+import functools
+import hashlib
+import re
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import CachedSummary, CachedTranscript
+from .singleflight import asingle_flight, single_flight, single_flight_stream
+from .utils import OPENAI_MODEL, SUMMARY_PROMPT_VERSION
+
+_stats = {'transcript': {'hits': 0, 'misses': 0}, 'summary': {'hits': 0, 'misses': 0}}
+_stats_lock = threading.Lock()
+
+
+def get_transcript(key):
+    # Returns the cached transcript JSON text, or None on a miss
+    entry = get_transcript_entry(key)
+    return None if entry is None else entry.content
+
+
+def get_transcript_entry(key):
+    # The CachedTranscript itself, for its content and etag
+    if not settings.TRANSCRIPT_CACHE_ENABLED:
+        return None
+    return _get('transcript', CachedTranscript, key, settings.TRANSCRIPT_CACHE_MAX_AGE)
+
+
+def put_transcript(key, content, etag=''):
+    if not settings.TRANSCRIPT_CACHE_ENABLED:
+        return
+    _put(CachedTranscript, key, content, etag=etag)
+    evict_transcripts()
+
+
+def invalidate_transcript(key):
+    deleted, _ = CachedTranscript.objects.filter(key=key).delete()
+    return deleted > 0
+
+
+def evict_transcripts():
+    return _evict(
+        CachedTranscript,
+        settings.TRANSCRIPT_CACHE_MAX_ENTRIES,
+        settings.TRANSCRIPT_CACHE_MAX_BYTES,
+        settings.TRANSCRIPT_CACHE_MAX_AGE,
+    )
+
+
+def summary_key(text, model=OPENAI_MODEL, prompt_version=SUMMARY_PROMPT_VERSION):
+    # Whitespace differences (re-flowed or re-pasted transcripts) must not cause a miss
+    normalized = re.sub(r'\s+', ' ', text).strip()
+    digest = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    return f"{model}:v{prompt_version}:{digest}"
+
+
+def get_summary(key):
+    if not settings.SUMMARY_CACHE_ENABLED:
+        return None
+    entry = _get('summary', CachedSummary, key, settings.SUMMARY_CACHE_MAX_AGE)
+    return None if entry is None else entry.content
+
+
+def put_summary(key, summary):
+    if not settings.SUMMARY_CACHE_ENABLED:
+        return
+    _put(CachedSummary, key, summary)
+    evict_summaries()
+
+
+def summarize_once(key, summarize):
+    # Calls summarize() and caches its result, once for concurrent requests of the same summary
+    def run():
+        summary = summarize()
+        put_summary(key, summary)
+        return summary
+
+    return single_flight(f'summary:{key}', run, _summary_lookup(key))
+
+
+async def asummarize_once(key, summarize):
+    # summarize_once() for a coroutine function
+    async def run():
+        summary = await summarize()
+        await sync_to_async(put_summary)(key, summary)
+        return summary
+
+    return await asingle_flight(f'summary:{key}', run, _summary_lookup(key))
+
+
+def summarize_stream_once(key, stream):
+    # summarize_once() for a summary streamed as it is generated: yields its pieces, or the
+    # summary of the identical request doing it as one piece
+    def run():
+        pieces = []
+        for piece in stream():
+            pieces.append(piece)
+            yield piece
+        put_summary(key, ''.join(pieces))
+
+    return single_flight_stream(f'summary:{key}', run, _summary_lookup(key))
+
+
+def _summary_lookup(key):
+    # Other processes can only be waited for when they leave the summary in the cache
+    return functools.partial(get_summary, key) if settings.SUMMARY_CACHE_ENABLED else None
+
+
+def evict_summaries():
+    return _evict(
+        CachedSummary,
+        settings.SUMMARY_CACHE_MAX_ENTRIES,
+        settings.SUMMARY_CACHE_MAX_BYTES,
+        settings.SUMMARY_CACHE_MAX_AGE,
+    )
+
+
+def cache_stats():
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        for counters in _stats.values():
+            counters.update(hits=0, misses=0)
+
+
+def _count(cache_name, hit):
+    with _stats_lock:
+        _stats[cache_name]['hits' if hit else 'misses'] += 1
+    metrics.cache_requests.inc(cache=cache_name, result='hit' if hit else 'miss', route=metrics.current_route())
+    metrics.record(f'cache_{cache_name}_hit' if hit else f'cache_{cache_name}_miss')
+
+
+def _get(cache_name, model, key, max_age):
+    entry = model.objects.filter(key=key).first()
+    now = timezone.now()
+    if entry is not None and entry.created_at < now - timedelta(seconds=max_age):
+        entry.delete()
+        entry = None
+    _count(cache_name, entry is not None)
+    if entry is None:
+        return None
+    model.objects.filter(pk=entry.pk).update(last_accessed=now)
+    return entry
+
+
+def _put(model, key, content, **fields):
+    now = timezone.now()
+    values = {
+        'content': content,
+        'size': len(content.encode('utf-8')),
+        'created_at': now,
+        'last_accessed': now,
+        **fields,
+    }
+    # Write first instead of update_or_create: on SQLite a read-then-write transaction fails
+    # under concurrent writers (web threads, workers) instead of waiting for the lock
+    if model.objects.filter(key=key).update(**values):
+        return
+    try:
+        model.objects.create(key=key, **values)
+    except IntegrityError:
+        model.objects.filter(key=key).update(**values)
+
+
+def _evict(model, max_entries, max_bytes, max_age):
+    # Drop expired entries first, then least recently used ones until we fit the count and size limits
+    expired_before = timezone.now() - timedelta(seconds=max_age)
+    model.objects.filter(created_at__lt=expired_before).delete()
+
+    entries = model.objects.order_by('-last_accessed').values_list('pk', 'size')
+    total = model.objects.aggregate(total=Sum('size'))['total'] or 0
+    if len(entries) <= max_entries and total <= max_bytes:
+        return 0
+
+    keep_size = 0
+    stale = []
+    for index, (pk, size) in enumerate(entries):
+        keep_size += size
+        if index >= max_entries or keep_size > max_bytes:
+            stale.append(pk)
+    model.objects.filter(pk__in=stale).delete()
+    return len(stale)
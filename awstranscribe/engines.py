@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .aws import get_client
+from .models import TranscriptionJob
+
+# MediaFormat values accepted by AWS Transcribe
+MEDIA_FORMATS = ['amr', 'flac', 'm4a', 'mp3', 'mp4', 'ogg', 'wav', 'webm']
+MEDICAL_SPECIALTIES = ['PRIMARYCARE']
+MEDICAL_TYPES = ['CONVERSATION', 'DICTATION']
+
+
+# Size of the pieces transcripts are streamed from S3 in
+TRANSCRIPT_CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(body, chunk_size=TRANSCRIPT_CHUNK_SIZE):
+    # Chunks of a botocore StreamingBody, the connection is released however far they are read
+    try:
+        yield from body.iter_chunks(chunk_size)
+    finally:
+        body.close()
+
+
+def get_transcribe_client():
+    return get_client('transcribe')
+
+
+def media_format_for(s3_url):
+    # TRANSCRIBE_MEDIA_FORMAT when set, else the file extension, else mp4 as before
+    if settings.TRANSCRIBE_MEDIA_FORMAT:
+        return settings.TRANSCRIBE_MEDIA_FORMAT
+    extension = s3_url.rsplit('/', 1)[-1].rpartition('.')[2].lower()
+    return extension if extension in MEDIA_FORMATS else 'mp4'
+
+
+class TranscriptionEngine:
+    """What the views, the poller and the workers need from a transcription service.
+
+    Job descriptions use the shape of AWS Transcribe's ``TranscriptionJob``: at least
+    ``TranscriptionJobStatus``, plus ``Transcript.TranscriptFileUri`` once completed and
+    ``FailureReason`` when failed. ``options`` are the per-job settings stored on the job
+    (``language_code``, ``media_format``, ``specialty``, ``type``).
+    """
+
+    def get_job(self, job_name):
+        # The job description, or None if the service does not know the job
+        raise NotImplementedError
+
+    def start_job(self, job_name, s3_url, options=None):
+        # Starts the job and returns its description
+        raise NotImplementedError
+
+    def list_jobs(self, status, since):
+        # {job name: summary with TranscriptionJobStatus and FailureReason} of jobs with `status` created after `since`
+        raise NotImplementedError
+
+    def open_transcript(self, key):
+        # Returns (iterable of UTF-8 byte chunks of the transcript JSON, etag)
+        raise NotImplementedError
+
+    def read_transcript(self, key):
+        # Returns (transcript JSON text, etag)
+        chunks, etag = self.open_transcript(key)
+        return b''.join(chunks).decode('utf-8'), etag
+
+
+class AwsTranscribeEngine(TranscriptionEngine):
+    job_key = 'TranscriptionJob'
+    name_key = 'TranscriptionJobName'
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_transcribe_client()
+        return self._client
+
+    def get_job(self, job_name):
+        try:
+            return self._get(job_name)[self.job_key]
+        except self.client.exceptions.BadRequestException:
+            return None
+
+    def start_job(self, job_name, s3_url, options=None):
+        options = options or {}
+        arguments = {
+            self.name_key: job_name,
+            'Media': {'MediaFileUri': s3_url},
+            'MediaFormat': options.get('media_format') or media_format_for(s3_url),
+            'LanguageCode': options.get('language_code') or settings.TRANSCRIBE_LANGUAGE_CODE,
+            'OutputBucketName': settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS,
+        }
+        return self._start(**arguments, **self.extra_arguments(options))[self.job_key]
+
+    def extra_arguments(self, options):
+        return {}
+
+    def list_jobs(self, status, since):
+        # AWS lists newest first, so paging stops once past `since`
+        jobs = {}
+        kwargs = {'Status': status, 'MaxResults': 100}
+        while True:
+            page = self._list(**kwargs)
+            summaries = page.get(f'{self.job_key}Summaries', [])
+            for summary in summaries:
+                jobs[summary[self.name_key]] = summary
+            if not page.get('NextToken') or (summaries and summaries[-1]['CreationTime'] < since):
+                return jobs
+            kwargs['NextToken'] = page['NextToken']
+
+    def open_transcript(self, key):
+        obj = get_client('s3').get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS, Key=key)
+        return read_chunks(obj['Body']), obj.get('ETag', '')
+
+    def _get(self, job_name):
+        return self.client.get_transcription_job(TranscriptionJobName=job_name)
+
+    def _start(self, **arguments):
+        return self.client.start_transcription_job(**arguments)
+
+    def _list(self, **kwargs):
+        return self.client.list_transcription_jobs(**kwargs)
+
+
+class AwsMedicalTranscribeEngine(AwsTranscribeEngine):
+    job_key = 'MedicalTranscriptionJob'
+    name_key = 'MedicalTranscriptionJobName'
+
+    def extra_arguments(self, options):
+        return {
+            'Specialty': options.get('specialty') or settings.TRANSCRIBE_MEDICAL_SPECIALTY,
+            'Type': options.get('type') or settings.TRANSCRIBE_MEDICAL_TYPE,
+        }
+
+    def _get(self, job_name):
+        return self.client.get_medical_transcription_job(MedicalTranscriptionJobName=job_name)
+
+    def _start(self, **arguments):
+        return self.client.start_medical_transcription_job(**arguments)
+
+    def _list(self, **kwargs):
+        return self.client.list_medical_transcription_jobs(**kwargs)
+
+
+class LocalTranscriptionEngine(TranscriptionEngine):
+    """Offline stand-in for tests and benchmarks, TRANSCRIBE_BACKEND = 'local'.
+
+    Jobs live in process memory and complete TRANSCRIBE_LOCAL_DURATION seconds after they are
+    started, with a one-line transcript in the Transcribe output format.
+    """
+
+    _jobs = {}
+    _lock = threading.Lock()
+
+    def __init__(self, job_type=TranscriptionJob.STANDARD, duration=None):
+        self.job_type = job_type
+        self.duration = duration if duration is not None else settings.TRANSCRIBE_LOCAL_DURATION
+
+    def get_job(self, job_name):
+        with self._lock:
+            job = self._jobs.get(job_name)
+        return None if job is None else self._describe(job_name, job)
+
+    def start_job(self, job_name, s3_url, options=None):
+        job = {'s3_url': s3_url, 'job_type': self.job_type, 'CreationTime': timezone.now(), 'started': time.monotonic()}
+        with self._lock:
+            job = self._jobs.setdefault(job_name, job)
+        return self._describe(job_name, job)
+
+    def list_jobs(self, status, since):
+        with self._lock:
+            jobs = [(name, job) for name, job in self._jobs.items() if job['job_type'] == self.job_type]
+        described = {name: self._describe(name, job) for name, job in jobs if job['CreationTime'] >= since}
+        return {name: details for name, details in described.items() if details['TranscriptionJobStatus'] == status}
+
+    def open_transcript(self, key):
+        job_name = key.rsplit('/', 1)[-1][:-len('.json')]
+        with self._lock:
+            job = self._jobs[job_name]
+        text = f"Local transcript of {job['s3_url']}."
+        transcript = {
+            'jobName': job_name,
+            'results': {'transcripts': [{'transcript': text}], 'items': []},
+            'status': TranscriptionJob.COMPLETED,
+        }
+        return [json.dumps(transcript).encode('utf-8')], f'"{job_name}"'
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._jobs.clear()
+
+    def _describe(self, job_name, job):
+        details = {'TranscriptionJobName': job_name, 'CreationTime': job['CreationTime'], 'FailureReason': ''}
+        if time.monotonic() - job['started'] < self.duration:
+            details['TranscriptionJobStatus'] = TranscriptionJob.IN_PROGRESS
+            return details
+        prefix = 'medical/' if self.job_type == TranscriptionJob.MEDICAL else ''
+        details['TranscriptionJobStatus'] = TranscriptionJob.COMPLETED
+        # Same URI layout as AWS, see jobs.transcript_key_from_uri
+        details['Transcript'] = {
+            'TranscriptFileUri': f"https://localhost/{settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS}/{prefix}{job_name}.json",
+        }
+        return details
+
+
+def get_engine(job_type, client=None):
+    # `client` is a Transcribe client to use instead of the shared one, the local engine ignores it
+    if settings.TRANSCRIBE_BACKEND == 'local':
+        return LocalTranscriptionEngine(job_type)
+    if job_type == TranscriptionJob.MEDICAL:
+        return AwsMedicalTranscribeEngine(client)
+    return AwsTranscribeEngine(client)
+
+
+def clean_options(data, job_type):
+    # Picks the per-job options out of request data, raises ValueError for values Transcribe would reject
+    options = {}
+    language_code = data.get('language_code')
+    if language_code:
+        options['language_code'] = str(language_code)
+    media_format = data.get('media_format')
+    if media_format:
+        if media_format not in MEDIA_FORMATS:
+            raise ValueError(f"media_format must be one of {', '.join(MEDIA_FORMATS)}")
+        options['media_format'] = media_format
+    for name, choices in [('specialty', MEDICAL_SPECIALTIES), ('type', MEDICAL_TYPES)]:
+        value = data.get(name)
+        if not value:
+            continue
+        if job_type != TranscriptionJob.MEDICAL:
+            raise ValueError(f"{name} only applies to medical jobs")
+        if value not in choices:
+            raise ValueError(f"{name} must be one of {', '.join(choices)}")
+        options[name] = value
+    return options
@@ -0,0 +1,108 @@
+import json
+import logging
+import posixpath
+import urllib.request
+from urllib.parse import unquote_plus, urlparse
+
+from django.conf import settings
+
+from .engines import get_engine
+from .jobs import mark_job_completed, refresh_job
+from .listing import get_bucket_index
+from .models import TranscriptionJob
+
+logger = logging.getLogger(__name__)
+
+
+def unwrap_events(payload):
+    """Flattens the envelopes AWS delivers events in into a list of plain events.
+
+    Handles SNS notifications (HTTP subscriptions and Lambda style ``Records[].Sns``), S3 event
+    notifications (``Records[].s3``) and EventBridge events, which are returned as they are.
+    """
+    if payload.get('Type') == 'Notification':
+        return unwrap_events(json.loads(payload['Message']))
+    if 'Records' in payload:
+        events = []
+        for record in payload['Records']:
+            if 'Sns' in record:
+                events.extend(unwrap_events(json.loads(record['Sns']['Message'])))
+            else:
+                events.append(record)
+        return events
+    return [payload]
+
+
+def handle_event(event):
+    # Returns the job the event moved on, or None when it is not about one of our jobs
+    apply_to_bucket_index(event)
+    if event.get('source') == 'aws.transcribe':
+        return handle_job_state_change(event.get('detail', {}))
+    if event.get('eventSource') == 'aws:s3' and event.get('eventName', '').startswith('ObjectCreated'):
+        return handle_transcript_created(event['s3']['bucket']['name'], unquote_plus(event['s3']['object']['key']))
+    if event.get('source') == 'aws.s3' and event.get('detail-type') == 'Object Created':
+        return handle_transcript_created(event['detail']['bucket']['name'], event['detail']['object']['key'])
+    return None
+
+
+def apply_to_bucket_index(event):
+    # Objects created or deleted in the media bucket, also outside this server, are listed right away
+    if event.get('eventSource') == 'aws:s3':
+        bucket, obj = event['s3']['bucket']['name'], event['s3']['object']
+        key, etag = unquote_plus(obj['key']), obj.get('eTag', '')
+        created = event.get('eventName', '').startswith('ObjectCreated')
+        removed = event.get('eventName', '').startswith('ObjectRemoved')
+    elif event.get('source') == 'aws.s3':
+        bucket, obj = event['detail']['bucket']['name'], event['detail']['object']
+        key, etag = obj['key'], obj.get('etag', '')
+        created = event.get('detail-type') == 'Object Created'
+        removed = event.get('detail-type') == 'Object Deleted'
+    else:
+        return
+    if bucket != settings.AWS_STORAGE_BUCKET_NAME:
+        return
+    if created:
+        # Listings quote ETags, events do not
+        get_bucket_index(bucket).put(key, obj.get('size', 0), f'"{etag}"' if etag else '')
+    elif removed:
+        get_bucket_index(bucket).discard(key)
+
+
+def handle_job_state_change(detail):
+    # EventBridge "Transcribe Job State Change"
+    job_name = detail.get('TranscriptionJobName') or detail.get('MedicalTranscriptionJobName')
+    job = TranscriptionJob.objects.filter(job_name=job_name).first()
+    if job is None or not job.is_pending:
+        return None
+    status = detail.get('TranscriptionJobStatus')
+    if status == TranscriptionJob.FAILED:
+        job.status = status
+        job.failure_reason = detail.get('FailureReason', '')
+        job.save(update_fields=['status', 'failure_reason', 'updated_at'])
+        return job
+    if status == TranscriptionJob.COMPLETED:
+        # The event does not say where the transcript was written
+        return refresh_job(get_engine(job.job_type), job)
+    return None
+
+
+def handle_transcript_created(bucket, key):
+    # Transcribe writes <job name>.json (medical/<job name>.json for medical jobs) to the output bucket
+    if bucket != settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS or not key.endswith('.json'):
+        return None
+    job_name = posixpath.basename(key)[:-len('.json')]
+    job = TranscriptionJob.objects.filter(job_name=job_name).first()
+    if job is None or not job.is_pending:
+        return None
+    return mark_job_completed(job, key)
+
+
+def confirm_subscription(payload):
+    # SNS sends this once when the endpoint is subscribed to a topic
+    url = payload.get('SubscribeURL', '')
+    parsed = urlparse(url)
+    if parsed.scheme != 'https' or not parsed.hostname or not parsed.hostname.endswith('.amazonaws.com'):
+        raise ValueError('Unexpected SubscribeURL')
+    with urllib.request.urlopen(url, timeout=10) as response:
+        response.read()
+    logger.info("Confirmed SNS subscription to %s", payload.get('TopicArn'))
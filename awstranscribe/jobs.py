@@ -0,0 +1,269 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .background import enqueue
+from .engines import get_engine
+from .models import TranscriptionJob
+from .singleflight import single_flight
+
+logger = logging.getLogger(__name__)
+
+
+def job_name_for(s3_url, job_type):
+    # Deterministic, so submitting the same file twice finds the first job
+    url_hash = hashlib.md5(s3_url.encode('utf-8')).hexdigest()
+    if job_type == TranscriptionJob.MEDICAL:
+        return f"MedicalTranscriptionJob_{url_hash}"
+    return f"TranscriptionJob_{url_hash}"
+
+
+def transcript_key_from_uri(transcript_file_uri):
+    # https://s3.<region>.amazonaws.com/<bucket>/<key...>
+    return '/'.join(transcript_file_uri.split('/')[4:])
+
+
+def record_job(job_name, job_type, s3_url, details=None, options=None):
+    job, created = TranscriptionJob.objects.get_or_create(
+        job_name=job_name,
+        defaults={'job_type': job_type, 's3_url': s3_url, 'options': options or {}},
+    )
+    if created:
+        wake_poller()
+    if details is not None:
+        update_job_from_details(job, details)
+    return job
+
+
+def submit_job(job_name, job_type, s3_url, options=None):
+    # Looks the job up on the service, starting it when there is none, once for concurrent requests
+    # of the same file. Other processes find the job recorded by the one that asked
+    def submit():
+        details = get_or_start_job(get_engine(job_type), job_name, s3_url, options)
+        return record_job(job_name, job_type, s3_url, details, options)
+
+    return single_flight(f'transcribe:{job_name}', submit, lambda: TranscriptionJob.objects.filter(job_name=job_name).first())
+
+
+def get_or_start_job(engine, job_name, s3_url, options=None):
+    # The job's description, starting it if the service does not know it yet
+    try:
+        return engine.get_job(job_name) or engine.start_job(job_name, s3_url, options)
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') != 'ConflictException':
+            raise
+        # Started by another process between our two calls
+        return engine.get_job(job_name)
+
+
+def update_job_from_details(job, details):
+    if details['TranscriptionJobStatus'] == TranscriptionJob.COMPLETED:
+        return mark_job_completed(job, transcript_key_from_uri(details['Transcript']['TranscriptFileUri']))
+    job.status = details['TranscriptionJobStatus']
+    if job.status == TranscriptionJob.FAILED:
+        job.failure_reason = details.get('FailureReason', '')
+    job.save(update_fields=['status', 'transcript_key', 'failure_reason', 'updated_at'])
+    return job
+
+
+def mark_job_completed(job, transcript_key):
+    # Every way of learning about a finished job (poller, events, requests) ends here
+    newly_completed = job.status != TranscriptionJob.COMPLETED
+    job.status = TranscriptionJob.COMPLETED
+    job.transcript_key = transcript_key
+    job.save(update_fields=['status', 'transcript_key', 'updated_at'])
+    if newly_completed and settings.TRANSCRIPT_AUTO_SUMMARIZE:
+        # Summarized by a worker right away, so the summary is ready when it is asked for
+        enqueue_summary(job)
+    return job
+
+
+def enqueue_summary(job):
+    # One queued or running summary per job, however often and from wherever it is asked for
+    return enqueue('summarize_transcript', {'job_name': job.job_name}, unique_key=f'summarize_transcript:{job.job_name}')
+
+
+# Errors after which a WAITING job is simply tried again on the next poll
+RETRYABLE_SUBMIT_ERRORS = ['LimitExceededException', 'ThrottlingException', 'InternalFailureException']
+# A SUBMITTING job whose poller died before recording the outcome is WAITING again after this
+SUBMIT_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def submit_waiting_jobs(client=None):
+    # Starts WAITING jobs, oldest first, while fewer than TRANSCRIBE_MAX_CONCURRENT_JOBS are running.
+    # Returns the number of jobs that moved on
+    jobs = TranscriptionJob.objects
+    jobs.filter(status=TranscriptionJob.SUBMITTING, updated_at__lt=timezone.now() - SUBMIT_CLAIM_TIMEOUT).update(
+        status=TranscriptionJob.WAITING, updated_at=timezone.now())
+    running = jobs.filter(status__in=[TranscriptionJob.SUBMITTING, *TranscriptionJob.SUBMITTED_STATUSES]).count()
+    room = settings.TRANSCRIBE_MAX_CONCURRENT_JOBS - running
+    if room <= 0:
+        return 0
+    # Each job is claimed with a conditional update first, so concurrent pollers (several
+    # processes) never submit the same one; the jobs another poller took are skipped
+    waiting = [
+        job for job in jobs.filter(status=TranscriptionJob.WAITING).order_by('created_at', 'pk')[:room]
+        if jobs.filter(pk=job.pk, status=TranscriptionJob.WAITING).update(
+            status=TranscriptionJob.SUBMITTING, updated_at=timezone.now())
+    ]
+    if not waiting:
+        return 0
+    engines = {job_type: get_engine(job_type, client) for job_type in {job.job_type for job in waiting}}
+
+    def submit(job):
+        # Service calls only, the rows are saved from the calling thread
+        try:
+            return get_or_start_job(engines[job.job_type], job.job_name, job.s3_url, job.options), None
+        except (BotoCoreError, ClientError) as error:
+            return None, error
+
+    with ThreadPoolExecutor(max_workers=min(settings.TRANSCRIBE_SUBMIT_CONCURRENCY, len(waiting))) as executor:
+        results = list(executor.map(submit, waiting))
+
+    changed = 0
+    for job, (details, error) in zip(waiting, results):
+        if details is not None:
+            update_job_from_details(job, details)
+        elif isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') not in RETRYABLE_SUBMIT_ERRORS:
+            job.status = TranscriptionJob.FAILED
+            job.failure_reason = str(error)
+            job.save(update_fields=['status', 'failure_reason', 'updated_at'])
+        else:
+            logger.warning("Could not submit transcription job %s yet: %s", job.job_name, error)
+            jobs.filter(pk=job.pk, status=TranscriptionJob.SUBMITTING).update(
+                status=TranscriptionJob.WAITING, updated_at=timezone.now())
+            continue
+        changed += 1
+    return changed
+
+
+def refresh_job(engine, job):
+    details = engine.get_job(job.job_name)
+    if details is None:
+        job.status = TranscriptionJob.FAILED
+        job.failure_reason = 'Transcription job not found'
+        job.save(update_fields=['status', 'failure_reason', 'updated_at'])
+        return job
+    return update_job_from_details(job, details)
+
+
+class TranscriptionPoller(threading.Thread):
+    """Background thread keeping pending TranscriptionJob rows in sync with the transcription engine.
+
+    Each poll lists the account's jobs per status, a handful of calls however many jobs are
+    pending, and only fetches the jobs that finished. The interval starts at ``interval`` and
+    doubles up to ``max_interval`` while nothing changes; a newly recorded job resets it.
+    Completion events (see awstranscribe.events) usually get there first, polling is the fallback.
+    """
+
+    LIST_STATUSES = [TranscriptionJob.QUEUED, TranscriptionJob.IN_PROGRESS, TranscriptionJob.COMPLETED, TranscriptionJob.FAILED]
+
+    def __init__(self, interval=None, client_factory=None, max_interval=None):
+        super().__init__(name='transcription-poller', daemon=True)
+        self.interval = interval if interval is not None else settings.TRANSCRIBE_POLL_INTERVAL
+        self.max_interval = max(max_interval if max_interval is not None else settings.TRANSCRIBE_POLL_MAX_INTERVAL, self.interval)
+        # Builds the Transcribe client the engines use, the shared one by default
+        self.client_factory = client_factory or (lambda: None)
+        self.current_interval = self.interval
+        self.changed = 0
+        self._stopped = False
+        self._wake_event = threading.Event()
+
+    def poll_once(self):
+        # Returns the number of pending jobs, `changed` is set to how many of them moved on
+        self.changed = 0
+        # SUBMITTING too, for the ones a poller that died left behind
+        waiting = TranscriptionJob.objects.filter(status__in=[TranscriptionJob.WAITING, TranscriptionJob.SUBMITTING])
+        if waiting.exists():
+            self.changed += submit_waiting_jobs(self.client_factory())
+        pending = list(TranscriptionJob.objects.filter(status__in=TranscriptionJob.SUBMITTED_STATUSES))
+        if not pending:
+            return waiting.count()
+        client = self.client_factory()
+        for job_type in {job.job_type for job in pending}:
+            jobs = [job for job in pending if job.job_type == job_type]
+            try:
+                self.changed += self.refresh_jobs(get_engine(job_type, client), jobs)
+            except (BotoCoreError, ClientError) as error:
+                logger.warning("Could not refresh %s transcription jobs: %s", job_type, error)
+        return len(pending) + waiting.count()
+
+    def refresh_jobs(self, engine, jobs):
+        # Some slack for clock skew between this server and AWS
+        since = min(job.created_at for job in jobs) - timedelta(minutes=5)
+        listed = {status: engine.list_jobs(status, since) for status in self.LIST_STATUSES}
+        changed = 0
+        for job in jobs:
+            status = next((status for status, summaries in listed.items() if job.job_name in summaries), None)
+            if status == job.status:
+                continue
+            if status == TranscriptionJob.FAILED:
+                job.status = status
+                job.failure_reason = listed[status][job.job_name].get('FailureReason', '')
+                job.save(update_fields=['status', 'failure_reason', 'updated_at'])
+            elif status in TranscriptionJob.SUBMITTED_STATUSES:
+                job.status = status
+                job.save(update_fields=['status', 'updated_at'])
+            else:
+                # Completed (summaries carry no transcript location) or not listed at all
+                refresh_job(engine, job)
+            changed += 1
+        return changed
+
+    def run(self):
+        while not self._stopped:
+            close_old_connections()
+            try:
+                pending = self.poll_once()
+                if self.changed:
+                    self.current_interval = self.interval
+                elif pending:
+                    self.current_interval = min(self.current_interval * 2, self.max_interval)
+                else:
+                    # Nothing to do until wake() is called for a new job
+                    self.current_interval = self.max_interval
+            except Exception:
+                logger.exception("Transcription poller iteration failed")
+                self.current_interval = min(self.current_interval * 2, self.max_interval)
+            finally:
+                close_old_connections()
+            self._wake_event.wait(self.current_interval)
+            self._wake_event.clear()
+
+    def wake(self):
+        self.current_interval = self.interval
+        self._wake_event.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake_event.set()
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def ensure_poller():
+    # Lazily start one in-process poller; deployments running `manage.py poll_transcriptions`
+    # separately can turn this off with TRANSCRIBE_POLLER_AUTOSTART = False
+    global _poller
+    if not settings.TRANSCRIBE_POLLER_AUTOSTART:
+        return None
+    with _poller_lock:
+        if _poller is None or not _poller.is_alive():
+            _poller = TranscriptionPoller()
+            _poller.start()
+    return _poller
+
+
+def wake_poller():
+    # Polls right away and resets the backoff, called when a job is recorded
+    if _poller is not None and _poller.is_alive():
+        _poller.wake()
@@ -0,0 +1,152 @@
+import codecs
+import json
+import re
+from json.decoder import scanstring
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+STRUCTURE = re.compile(r'["\[\]{}]')
+SCALAR_END = re.compile(r'[^0-9A-Za-z+\-.]')
+
+_decoder = json.JSONDecoder()
+
+
+def iter_paths(chunks, paths):
+    """Yields ``(path, value)`` for the values at ``paths`` of the JSON document read from ``chunks``.
+
+    ``chunks`` is any iterable of bytes (UTF-8) or str, a path a tuple of object keys with ``'*'``
+    for every element of an array, e.g. ``('results', 'items', '*')``. Only the selected values are
+    decoded, everything else is skipped over, so memory use follows the chunk size and the largest
+    selected value instead of the size of the document.
+    """
+    reader = _Reader(chunks)
+    paths = set(paths)
+    prefixes = {path[:length] for path in paths for length in range(len(path))}
+    yield from _walk(reader, (), paths, prefixes)
+    if reader.peek():
+        raise ValueError(f"Extra data after the JSON document at offset {reader.pos}")
+
+
+def _walk(reader, path, paths, prefixes):
+    if path in paths:
+        yield path, reader.value()
+        return
+    char = reader.peek()
+    if path not in prefixes or char not in ['{', '[']:
+        reader.skip()
+        return
+    reader.pos += 1
+    closing = '}' if char == '{' else ']'
+    if reader.peek() == closing:
+        reader.pos += 1
+        return
+    while True:
+        if char == '{':
+            if reader.peek() != '"':
+                raise ValueError(f"Expected an object key at offset {reader.pos}")
+            child = path + (reader.string(),)
+            reader.expect(':')
+        else:
+            child = path + ('*',)
+        # Selected values are yielded here rather than one generator further down, arrays of them are the hot loop
+        if child in paths:
+            yield child, reader.value()
+        else:
+            yield from _walk(reader, child, paths, prefixes)
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == closing:
+            return
+        if separator != ',':
+            raise ValueError(f"Expected ',' or '{closing}' at offset {reader.pos - 1}")
+
+
+class _Reader:
+    # A window over the document: consumed text is dropped whenever the next chunk is appended
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        # Appends the next chunk, returns False at the end of the input
+        while not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                data = self.decode(b'', final=True)
+            else:
+                data = self.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if data:
+                self.buffer = self.buffer[self.pos:] + data
+                self.pos = 0
+                return True
+        return False
+
+    def peek(self):
+        # The next character that is not whitespace, '' at the end of the input
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def string(self):
+        self.peek()
+        while True:
+            try:
+                value, end = scanstring(self.buffer, self.pos + 1)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def value(self):
+        if self.peek() not in ['"', '{', '[']:
+            # A number or literal cut off by the end of the window may still decode ("1" of "1.5")
+            while not SCALAR_END.search(self.buffer, self.pos) and self.fill():
+                pass
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            self.pos = end
+            return value
+
+    def skip(self):
+        char = self.peek()
+        if char == '"':
+            self.string()
+            return
+        if char not in ['{', '[']:
+            self.value()
+            return
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise ValueError("Unexpected end of the JSON document")
+                continue
+            self.pos = match.start()
+            if match.group() == '"':
+                self.string()
+                continue
+            self.pos += 1
+            depth += 1 if match.group() in '[{' else -1
+            if depth == 0:
+                return
@@ -0,0 +1,171 @@
+import base64
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .aws import get_client
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything we did not hand out
+    try:
+        return base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (UnicodeError, ValueError) as error:
+        raise ValueError('Invalid cursor') from error
+
+
+def _apply(keys, entries, key, entry):
+    # Adds or replaces the entry of `key` in the sorted lists, removes it when entry is None
+    index = bisect.bisect_left(keys, key)
+    found = index < len(keys) and keys[index] == key
+    if entry is None:
+        if found:
+            del keys[index]
+            del entries[index]
+    elif found:
+        entries[index] = entry
+    else:
+        keys.insert(index, key)
+        entries.insert(index, entry)
+
+
+class BucketIndex:
+    """Sorted in-memory listing of a bucket shared by every request in the process.
+
+    The first request loads it; after ``ttl`` seconds it is refreshed in a background thread
+    while requests keep being served from the previous snapshot. A refresh is a full re-list:
+    one ListObjectsV2 call per 1000 objects, in every process, every ``ttl`` seconds while the
+    listing is used, and the whole bucket held in memory. S3 cannot list only what changed, so
+    changes are applied as they are learnt of instead: uploads made through this server and S3
+    object events posted to api/transcribe/events/ (see awstranscribe.events) show up right away
+    in the process that saw them, the others catch up on their next refresh.
+    """
+
+    def __init__(self, bucket, ttl=None, client_factory=None):
+        self.bucket = bucket
+        self.ttl = ttl if ttl is not None else settings.S3_LIST_CACHE_TTL
+        self.client_factory = client_factory or (lambda: get_client('s3'))
+        self.keys = []
+        self.entries = []
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        # Held by the request doing the first load, the concurrent ones wait for its listing
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        # put() and discard() calls made while a listing runs, which it may have missed
+        self._changes = None
+
+    def snapshot(self):
+        # Lists are replaced, never mutated, so a snapshot stays consistent for the whole request
+        if self.loaded_at is None:
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self.refresh()
+        elif time.monotonic() - self.loaded_at > self.ttl:
+            self._refresh_in_background()
+        with self._lock:
+            return self.keys, self.entries
+
+    def refresh(self):
+        with self._lock:
+            self._changes = []
+        try:
+            s3 = self.client_factory()
+            entries = []
+            kwargs = {'Bucket': self.bucket}
+            while True:
+                page = s3.list_objects_v2(**kwargs)
+                entries.extend(
+                    {'Key': obj['Key'], 'LastModified': obj['LastModified'], 'Size': obj['Size'], 'ETag': obj['ETag']}
+                    for obj in page.get('Contents', [])
+                )
+                if not page.get('IsTruncated'):
+                    break
+                kwargs['ContinuationToken'] = page['NextContinuationToken']
+            entries.sort(key=lambda entry: entry['Key'])
+            keys = [entry['Key'] for entry in entries]
+            with self._lock:
+                for key, entry in self._changes:
+                    _apply(keys, entries, key, entry)
+                self.keys = keys
+                self.entries = entries
+                self.loaded_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def put(self, key, size, etag='', last_modified=None):
+        self._change(key, {'Key': key, 'LastModified': last_modified or timezone.now(), 'Size': size, 'ETag': etag})
+
+    def discard(self, key):
+        self._change(key, None)
+
+    def _change(self, key, entry):
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append((key, entry))
+            if self.loaded_at is None:
+                return
+            keys, entries = list(self.keys), list(self.entries)
+            _apply(keys, entries, key, entry)
+            self.keys, self.entries = keys, entries
+
+    def page(self, prefix='', cursor=None, limit=1000, match=None):
+        # Returns up to `limit` entries after `cursor` and the cursor of the next page, or None
+        keys, entries = self.snapshot()
+        start = bisect.bisect_left(keys, prefix)
+        if cursor:
+            start = max(start, bisect.bisect_right(keys, decode_cursor(cursor)))
+        results = []
+        for index in range(start, len(entries)):
+            entry = entries[index]
+            if not entry['Key'].startswith(prefix):
+                break
+            if match is not None and not match(entry):
+                continue
+            if len(results) == limit:
+                return results, encode_cursor(results[-1]['Key'])
+            results.append(entry)
+        return results, None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name='bucket-index-refresh', daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Refreshing the listing of bucket %s failed", self.bucket)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_bucket_index(bucket):
+    with _indexes_lock:
+        if bucket not in _indexes:
+            _indexes[bucket] = BucketIndex(bucket)
+        return _indexes[bucket]
+
+
+def reset_bucket_indexes():
+    with _indexes_lock:
+        _indexes.clear()
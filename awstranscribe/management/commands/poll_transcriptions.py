@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from awstranscribe.jobs import TranscriptionPoller
+
+
+class Command(BaseCommand):
+    help = "Poll AWS Transcribe and update pending transcription jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None, help="Seconds between polls while jobs change.")
+        parser.add_argument('--max-interval', type=float, default=None, help="Longest backoff between polls.")
+        parser.add_argument('--once', action='store_true', help="Poll a single time and exit.")
+
+    def handle(self, *args, **options):
+        poller = TranscriptionPoller(interval=options['interval'], max_interval=options['max_interval'])
+        if options['once']:
+            count = poller.poll_once()
+            self.stdout.write(f"Refreshed {count} pending job(s).")
+            return
+        self.stdout.write(f"Polling every {poller.interval}s to {poller.max_interval}s, press CTRL-C to stop.")
+        try:
+            poller.run()
+        except KeyboardInterrupt:
+            poller.stop()
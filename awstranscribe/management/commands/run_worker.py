@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from awstranscribe.background import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (transcriptions, summaries). Start more processes to scale out."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None, help="Jobs run at the same time.")
+        parser.add_argument('--interval', type=float, default=None, help="Seconds between polls when idle.")
+        parser.add_argument('--once', action='store_true', help="Run one batch of due jobs and exit.")
+
+    def handle(self, *args, **options):
+        worker = Worker(concurrency=options['concurrency'], interval=options['interval'])
+        if options['once']:
+            count = worker.run_once()
+            self.stdout.write(f"Ran {count} job(s).")
+            return
+        self.stdout.write(f"Worker {worker.worker_id} running {worker.concurrency} job(s) at a time, press CTRL-C to stop.")
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
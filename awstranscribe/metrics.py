@@ -0,0 +1,327 @@
+"""Process-local request, AWS and OpenAI metrics in the Prometheus text format.
+
+Every worker process keeps its own counters, Prometheus scrapes each one (or sums them with
+``sum by``). Calls made while serving a request are also added to that request's totals, which
+``METRICS_LOG_REQUESTS`` logs as one JSON line per request.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached read to a long OpenAI completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_current_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        pairs = list(zip(self.labelnames, key)) + list(extra.items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._labels(key)} {value}"]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels):
+        value = self._values.get(self._key(labels))
+        return value[2] if value else 0
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = [f"{self.name}_bucket{self._labels(key, le=bound)} {bucket}" for bound, bucket in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{self._labels(key, le='+Inf')} {count}")
+        lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in _registry:
+        metric.reset()
+
+
+http_requests = Counter('http_requests_total', 'Requests served.', ['method', 'route', 'status'])
+http_request_duration = Histogram('http_request_duration_seconds', 'Time spent serving requests.', ['method', 'route'])
+aws_calls = Counter('aws_calls_total', 'AWS API calls.', ['service', 'operation', 'outcome', 'route'])
+aws_call_duration = Histogram('aws_call_duration_seconds', 'AWS API call latency, retries included.', ['service', 'operation', 'route'])
+aws_retries = Counter('aws_retries_total', 'AWS API call retries made by botocore.', ['service', 'operation', 'route'])
+openai_calls = Counter('openai_calls_total', 'OpenAI API calls.', ['operation', 'outcome', 'route'])
+openai_call_duration = Histogram('openai_call_duration_seconds', 'OpenAI API call latency, retries included.', ['operation', 'route'])
+openai_retries = Counter('openai_retries_total', 'OpenAI HTTP requests that were retries.', ['operation', 'route'])
+openai_tokens = Counter('openai_tokens_total', 'Tokens used by OpenAI calls.', ['operation', 'kind', 'route'])
+cache_requests = Counter('cache_requests_total', 'Local cache lookups.', ['cache', 'result', 'route'])
+singleflight_shared = Counter('singleflight_shared_total', 'Calls that waited for the same work already in flight.', ['kind', 'scope', 'route'])
+
+
+class RequestStats:
+    # What one request spent its time on, filled in by the hooks below while it is served
+
+    def __init__(self, request):
+        self.request = request
+        self.counts = {}
+        self.durations = {}
+
+    @property
+    def route(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.route if match is not None else 'unmatched'
+
+    def add(self, name, duration=None, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+        if duration is not None:
+            self.durations[name] = self.durations.get(name, 0) + duration
+
+
+def start_request(request):
+    return _current_request.set(RequestStats(request))
+
+
+def end_request(token):
+    _current_request.reset(token)
+
+
+def current_stats():
+    return _current_request.get()
+
+
+def current_route():
+    # Calls made outside of a request (poller, workers) are labelled with an empty route
+    stats = _current_request.get()
+    return stats.route if stats is not None else ''
+
+
+def record(name, duration=None, amount=1):
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add(name, duration, amount)
+
+
+def log_request(stats, method, status, duration):
+    entry = {
+        'method': method,
+        'route': stats.route,
+        'path': stats.request.path,
+        'status': status,
+        'duration_ms': round(duration * 1000, 1),
+    }
+    for name, count in sorted(stats.counts.items()):
+        entry[f'{name}_count'] = count
+    for name, seconds in sorted(stats.durations.items()):
+        entry[f'{name}_ms'] = round(seconds * 1000, 1)
+    logger.info(json.dumps(entry))
+
+
+# botocore event hooks, installed on the shared clients by awstranscribe.aws
+
+def instrument_boto_client(client):
+    # Timing starts before the parameters are built: handlers of `before-call` stop at the first
+    # one that returns a response (botocore's Stubber), so a start recorded there can be skipped
+    client.meta.events.register('before-parameter-build', _before_aws_call)
+    client.meta.events.register('after-call', _after_aws_call)
+    client.meta.events.register('after-call-error', _after_aws_call_error)
+
+
+def _before_aws_call(model, context, **kwargs):
+    context['metrics'] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _after_aws_call(http_response, parsed, context, **kwargs):
+    outcome = 'ok' if http_response.status_code < 300 else parsed.get('Error', {}).get('Code', 'error')
+    _record_aws_call(context, outcome, parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+
+def _after_aws_call_error(exception, context, **kwargs):
+    _record_aws_call(context, type(exception).__name__, 0)
+
+
+def _record_aws_call(context, outcome, retries):
+    service, operation, start = context.pop('metrics', (None, None, None))
+    if service is None:
+        return
+    duration = time.perf_counter() - start
+    route = current_route()
+    aws_calls.inc(service=service, operation=operation, outcome=outcome, route=route)
+    aws_call_duration.observe(duration, service=service, operation=operation, route=route)
+    if retries:
+        aws_retries.inc(retries, service=service, operation=operation, route=route)
+    record('aws', duration)
+
+
+# OpenAI: the helpers in awstranscribe.utils are wrapped, retries are counted by an httpx hook
+
+_openai_attempts = contextvars.ContextVar('openai_attempts', default=None)
+
+
+def count_openai_attempt(request):
+    attempts = _openai_attempts.get()
+    if attempts is not None:
+        attempts[0] += 1
+
+
+async def acount_openai_attempt(request):
+    count_openai_attempt(request)
+
+
+def instrument_openai(operation):
+    """Records latency, outcome, retries and token usage of an OpenAI helper.
+
+    Token usage is read from the ``usage`` of the returned completion. Streaming (generator)
+    helpers report the usage of their final chunk with record_stream_usage().
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                call = _OpenAICall(operation)
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as error:
+                    call.finish(error)
+                    raise
+                call.finish(usage=getattr(result, 'usage', None))
+                return result
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                # The route is taken now, a streamed body is consumed after the middleware has returned
+                return _instrumented_stream(operation, current_route(), func(*args, **kwargs))
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call = _OpenAICall(operation)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as error:
+                call.finish(error)
+                raise
+            call.finish(usage=getattr(result, 'usage', None))
+            return result
+        return wrapper
+    return decorator
+
+
+def _instrumented_stream(operation, route, stream):
+    call = _OpenAICall(operation, route)
+    try:
+        yield from stream
+    except Exception as error:
+        call.finish(error)
+        raise
+    call.finish(usage=_stream_usage.get())
+
+
+# Streaming helpers leave the usage of their final chunk here
+_stream_usage = contextvars.ContextVar('openai_stream_usage', default=None)
+
+
+def record_stream_usage(usage):
+    _stream_usage.set(usage)
+
+
+class _OpenAICall:
+
+    def __init__(self, operation, route=None):
+        self.operation = operation
+        self.route = route
+        self.attempts = [0]
+        self.token = _openai_attempts.set(self.attempts)
+        _stream_usage.set(None)
+        self.start = time.perf_counter()
+
+    def finish(self, error=None, usage=None):
+        duration = time.perf_counter() - self.start
+        try:
+            _openai_attempts.reset(self.token)
+        except ValueError:
+            # A stream finished in another context than it started in
+            pass
+        route = self.route if self.route is not None else current_route()
+        outcome = 'ok' if error is None else type(error).__name__
+        openai_calls.inc(operation=self.operation, outcome=outcome, route=route)
+        openai_call_duration.observe(duration, operation=self.operation, route=route)
+        if self.attempts[0] > 1:
+            openai_retries.inc(self.attempts[0] - 1, operation=self.operation, route=route)
+        record('openai', duration)
+        if usage is not None:
+            for kind in ['prompt', 'completion']:
+                tokens = getattr(usage, f'{kind}_tokens', None) or 0
+                if tokens:
+                    openai_tokens.inc(tokens, operation=self.operation, kind=kind, route=route)
+                    record(f'openai_{kind}_tokens', amount=tokens)
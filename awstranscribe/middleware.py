@@ -0,0 +1,124 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    # Optional, `pip install brotli`; without it responses are only gzipped
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+# Quality 11 is meant for static files, 5 compresses about as well as gzip -9 in a fraction of the time
+BROTLI_QUALITY = 5
+MIN_SIZE = 200
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compresses responses with brotli when installed and accepted by the client, else with gzip.
+
+    Server-Sent Events are sent as they are: a compressor holds output back until a block fills,
+    which would delay every event.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        if brotli is None or not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return super().process_response(request, response)
+        if not response.streaming and len(response.content) < MIN_SIZE:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compress_async_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed_content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+            if len(compressed_content) >= len(response.content):
+                return response
+            response.content = compressed_content
+            response.headers['Content-Length'] = str(len(compressed_content))
+
+        # Same as GZipMiddleware: the compressed bytes differ, so a strong ETag becomes weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
+
+
+def compress_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_async_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    async for chunk in sequence:
+        data = compressor.process(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class MetricsMiddleware:
+    """Counts and times every request by route, see awstranscribe.metrics.
+
+    AWS, OpenAI and cache calls made while the view runs are attributed to the same route and, with
+    METRICS_LOG_REQUESTS, summed up in a JSON log line per request. The time of a streamed body is
+    not included, it is sent after the middleware has returned.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Runs in whichever mode the handler is in, so requests are not moved between threads for it
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = metrics.start_request(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - start)
+        finally:
+            metrics.end_request(token)
+        return response
+
+    async def __acall__(self, request):
+        token = metrics.start_request(request)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.record(request, response, time.perf_counter() - start)
+        finally:
+            metrics.end_request(token)
+        return response
+
+    def record(self, request, response, duration):
+        stats = metrics.current_stats()
+        metrics.http_requests.inc(method=request.method, route=stats.route, status=response.status_code)
+        metrics.http_request_duration.observe(duration, method=request.method, route=stats.route)
+        if settings.METRICS_LOG_REQUESTS:
+            metrics.log_request(stats, request.method, response.status_code, duration)
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_name', models.CharField(max_length=200, unique=True)),
+                ('job_type', models.CharField(choices=[('standard', 'Standard'), ('medical', 'Medical')], default='standard', max_length=20)),
+                ('s3_url', models.TextField()),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('IN_PROGRESS', 'In progress'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], db_index=True, default='QUEUED', max_length=20)),
+                ('transcript_key', models.CharField(blank=True, max_length=1024)),
+                ('failure_reason', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
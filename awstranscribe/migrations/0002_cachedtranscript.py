@@ -0,0 +1,25 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedTranscript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('content', models.TextField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('etag', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
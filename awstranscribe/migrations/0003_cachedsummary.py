@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0002_cachedtranscript'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=200, unique=True)),
+                ('content', models.TextField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0003_cachedsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenAIAssistant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('assistant_id', models.CharField(max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0005_backgroundjob_backgroundjobattempt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transcriptionjob',
+            name='status',
+            field=models.CharField(choices=[('WAITING', 'Waiting'), ('QUEUED', 'Queued'), ('IN_PROGRESS', 'In progress'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], db_index=True, default='QUEUED', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='TranscriptionBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(choices=[('standard', 'Standard'), ('medical', 'Medical')], default='standard', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('jobs', models.ManyToManyField(related_name='batches', to='awstranscribe.transcriptionjob')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0006_alter_transcriptionjob_status_transcriptionbatch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptionjob',
+            name='options',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
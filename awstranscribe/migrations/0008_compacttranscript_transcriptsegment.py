@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 12:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0007_transcriptionjob_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompactTranscript',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('duration', models.FloatField(default=0)),
+                ('source_size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='compact_transcript', to='awstranscribe.transcriptionjob')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TranscriptSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.FloatField()),
+                ('end', models.FloatField()),
+                ('speaker', models.CharField(blank=True, max_length=50)),
+                ('text', models.TextField()),
+                ('transcript', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='awstranscribe.compacttranscript')),
+            ],
+            options={
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['transcript', 'start'], name='awstranscri_transcr_c3d387_idx')],
+            },
+        ),
+    ]
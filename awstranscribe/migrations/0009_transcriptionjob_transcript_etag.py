@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0008_compacttranscript_transcriptsegment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptionjob',
+            name='transcript_etag',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
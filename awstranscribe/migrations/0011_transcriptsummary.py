@@ -0,0 +1,25 @@
+# Generated by Django 5.0.4 on 2026-10-18 12:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0010_inflightlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField()),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_version', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('job', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='awstranscribe.transcriptionjob')),
+            ],
+        ),
+    ]
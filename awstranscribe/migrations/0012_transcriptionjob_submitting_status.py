@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('awstranscribe', '0011_transcriptsummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transcriptionjob',
+            name='status',
+            field=models.CharField(choices=[('WAITING', 'Waiting'), ('SUBMITTING', 'Submitting'), ('QUEUED', 'Queued'), ('IN_PROGRESS', 'In progress'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], db_index=True, default='QUEUED', max_length=20),
+        ),
+    ]
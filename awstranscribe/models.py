@@ -1 +1,204 @@
 from django.db import models
+
+# Create your models here.
+
+class TranscriptionJob(models.Model):
+    STANDARD = 'standard'
+    MEDICAL = 'medical'
+    JOB_TYPE_CHOICES = [
+        (STANDARD, 'Standard'),
+        (MEDICAL, 'Medical'),
+    ]
+
+    # Not started on AWS yet, waiting for room under TRANSCRIBE_MAX_CONCURRENT_JOBS
+    WAITING = 'WAITING'
+    # Taken by one poller, being started on AWS
+    SUBMITTING = 'SUBMITTING'
+    QUEUED = 'QUEUED'
+    IN_PROGRESS = 'IN_PROGRESS'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (SUBMITTING, 'Submitting'),
+        (QUEUED, 'Queued'),
+        (IN_PROGRESS, 'In progress'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    ]
+    # Statuses of jobs running on AWS
+    SUBMITTED_STATUSES = [QUEUED, IN_PROGRESS]
+    PENDING_STATUSES = [WAITING, SUBMITTING, QUEUED, IN_PROGRESS]
+
+    job_name = models.CharField(max_length=200, unique=True)
+    job_type = models.CharField(max_length=20, choices=JOB_TYPE_CHOICES, default=STANDARD)
+    s3_url = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    transcript_key = models.CharField(max_length=1024, blank=True)
+    # ETag of the transcript object, lets conditional requests be answered without reading it
+    transcript_etag = models.CharField(max_length=100, blank=True)
+    failure_reason = models.TextField(blank=True)
+    # language_code, media_format, specialty and type the job is started with, see awstranscribe.engines
+    options = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.job_name} ({self.status})"
+
+    @property
+    def is_pending(self):
+        return self.status in self.PENDING_STATUSES
+
+
+class TranscriptionBatch(models.Model):
+    # Jobs submitted together through api/transcribe/batch/, a job can belong to several batches
+    job_type = models.CharField(max_length=20, choices=TranscriptionJob.JOB_TYPE_CHOICES, default=TranscriptionJob.STANDARD)
+    jobs = models.ManyToManyField(TranscriptionJob, related_name='batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Batch {self.pk} ({self.job_type})"
+
+
+class CompactTranscript(models.Model):
+    # A finished job's transcript reduced to plain text and timed segments, see awstranscribe.transcripts
+    job = models.OneToOneField(TranscriptionJob, on_delete=models.CASCADE, related_name='compact_transcript')
+    text = models.TextField()
+    duration = models.FloatField(default=0)
+    source_size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.job_id} ({len(self.text)} characters)"
+
+
+class TranscriptSegment(models.Model):
+    # One speaker turn or sentence; (transcript, start) is the time offset index of range queries
+    transcript = models.ForeignKey(CompactTranscript, on_delete=models.CASCADE, related_name='segments')
+    start = models.FloatField()
+    end = models.FloatField()
+    speaker = models.CharField(max_length=50, blank=True)
+    text = models.TextField()
+
+    class Meta:
+        ordering = ['start']
+        indexes = [models.Index(fields=['transcript', 'start'])]
+
+    def __str__(self):
+        return f"{self.start:.2f}-{self.end:.2f} {self.speaker}"
+
+
+class TranscriptSummary(models.Model):
+    # Summary of a finished job's transcript, made on the server from the compact text, see awstranscribe.summarize
+    job = models.OneToOneField(TranscriptionJob, on_delete=models.CASCADE, related_name='summary')
+    summary = models.TextField()
+    # Summaries made with another model or prompt version are made again
+    model = models.CharField(max_length=100)
+    prompt_version = models.PositiveIntegerField()
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.job_id} ({self.model} v{self.prompt_version})"
+
+
+class CacheEntry(models.Model):
+    key = models.CharField(max_length=200, unique=True)
+    content = models.TextField()
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.key} ({self.size} bytes)"
+
+
+class CachedTranscript(CacheEntry):
+    # Raw transcript JSON as stored in the transcripts bucket, keyed by job name
+    etag = models.CharField(max_length=100, blank=True)
+
+
+class CachedSummary(CacheEntry):
+    # Summary text keyed by a hash of the normalized input, the model and the prompt version
+    pass
+
+
+class OpenAIAssistant(models.Model):
+    # One long-lived summarization assistant per model and prompt version, shared by all processes
+    key = models.CharField(max_length=100, unique=True)
+    assistant_id = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.assistant_id})"
+
+
+class InFlightLock(models.Model):
+    # Work one process has taken on for everyone (a transcript download, a summary), see awstranscribe.singleflight
+    key = models.CharField(max_length=200, unique=True)
+    owner = models.CharField(max_length=100)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} (until {self.expires_at})"
+
+
+class BackgroundJob(models.Model):
+    # Work queued for `manage.py run_worker`, see awstranscribe.background
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # At most one queued or running job per key, see background.enqueue
+    unique_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=200, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['unique_key'], condition=models.Q(status__in=['queued', 'running']),
+                name='unique_pending_background_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class BackgroundJobAttempt(models.Model):
+    job = models.ForeignKey(BackgroundJob, related_name='attempt_set', on_delete=models.CASCADE)
+    number = models.PositiveIntegerField()
+    worker = models.CharField(max_length=200)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['number']
+
+    def __str__(self):
+        return f"{self.job} attempt {self.number}"
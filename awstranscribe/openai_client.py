@@ -0,0 +1,318 @@
+"""The process-wide OpenAI clients and the limits every call to them goes through.
+
+Calls are paced by a token bucket sized to the account's requests and tokens per minute
+(OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE), at most OPENAI_MAX_CONCURRENCY are in
+flight at once across all threads, and rate limits, timeouts, connection errors and 5xx answers
+are retried with jittered exponential backoff. The SDK's own retries are turned off so every
+attempt is paced and counted. Limits are per process, divide the quota by the number of processes.
+"""
+import asyncio
+import collections
+import random
+import threading
+import time
+
+import httpx
+import openai
+from django.conf import settings
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from .metrics import acount_openai_attempt, count_openai_attempt
+
+# Assumed size of a completion when reserving tokens, corrected once the usage is known
+COMPLETION_TOKENS_ESTIMATE = 1000
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+_clients = {}
+_limits = {}
+_lock = threading.Lock()
+
+
+def get_client():
+    return _get('client', _create_client)
+
+
+def get_async_client():
+    # Used by the ASGI views in awstranscribe.async_views
+    return _get('async_client', _create_async_client)
+
+
+def reset_clients():
+    # Needed after settings change (tests)
+    with _lock:
+        _clients.clear()
+        _limits.clear()
+
+
+def _get(name, create):
+    # Created on first use, so importing the app does not need OPENAI_API_KEY
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = create()
+    return client
+
+
+def _timeout():
+    return httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+def _create_client():
+    # The request hook sees every HTTP attempt, for the retry metrics
+    http_client = DefaultHttpxClient(event_hooks={'request': [count_openai_attempt]})
+    return OpenAI(timeout=_timeout(), max_retries=0, http_client=http_client)
+
+
+def _create_async_client():
+    http_client = DefaultAsyncHttpxClient(event_hooks={'request': [acount_openai_attempt]})
+    return AsyncOpenAI(timeout=_timeout(), max_retries=0, http_client=http_client)
+
+
+class TokenBucket:
+    """Holds up to `per_minute` units and refills continuously at that rate.
+
+    reserve() takes the units right away, going into debt if needed, and returns how long the
+    caller must wait for the debt to be paid off. Callers are served in the order they reserve.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+            self.updated = now
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount):
+        # Gives back (positive) or takes (negative) units once the real cost is known
+        with self.lock:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class ConcurrencyLimit:
+    """At most ``limit`` holders at once, shared by threads and event loops.
+
+    Waiters queue in order; a release hands the slot straight to the first of them, waking a
+    thread through its Event or a coroutine through its future, so neither kind polls.
+    """
+
+    def __init__(self, limit):
+        self.available = limit
+        self.waiters = collections.deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.available > 0 and not self.waiters:
+                self.available -= 1
+                return
+            event = threading.Event()
+            self.waiters.append(event)
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.available > 0 and not self.waiters:
+                self.available -= 1
+                return
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                if (loop, future) in self.waiters:
+                    self.waiters.remove((loop, future))
+            # Otherwise the slot is on its way, _hand_over passes it on
+            raise
+
+    def release(self):
+        with self.lock:
+            if not self.waiters:
+                self.available += 1
+                return
+            waiter = self.waiters.popleft()
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+            return
+        loop, future = waiter
+        try:
+            loop.call_soon_threadsafe(self._hand_over, future)
+        except RuntimeError:
+            # The waiter's loop is closed
+            self.release()
+
+    def _hand_over(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    async def __aenter__(self):
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class RateLimiter:
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        # A limit of 0 turns that bucket off
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens=0):
+        waits = [0.0]
+        if self.requests is not None:
+            waits.append(self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            waits.append(self.tokens.reserve(tokens))
+        return max(waits)
+
+    def settle(self, reserved, used):
+        if self.tokens is not None and used is not None:
+            self.tokens.adjust(reserved - used)
+
+
+def get_limiter():
+    return _get_limit('limiter', lambda: RateLimiter(settings.OPENAI_REQUESTS_PER_MINUTE, settings.OPENAI_TOKENS_PER_MINUTE))
+
+
+def get_semaphore():
+    # One OPENAI_MAX_CONCURRENCY limit for the sync and the async calls
+    return _get_limit('semaphore', lambda: ConcurrencyLimit(settings.OPENAI_MAX_CONCURRENCY))
+
+
+def _get_limit(name, create):
+    limit = _limits.get(name)
+    if limit is None:
+        with _lock:
+            limit = _limits.get(name)
+            if limit is None:
+                limit = _limits[name] = create()
+    return limit
+
+
+def estimate_tokens(messages, completion_tokens=COMPLETION_TOKENS_ESTIMATE):
+    # About four characters per token; counting with tiktoken would cost more than the estimate saves
+    return sum(len(message['content']) for message in messages) // 4 + completion_tokens
+
+
+def retry_delay(error, attempt):
+    # Full jitter, but never sooner than the server asked for
+    delay = random.uniform(0, min(settings.OPENAI_RETRY_MAX_DELAY, settings.OPENAI_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after-ms')
+        if retry_after is not None:
+            return max(delay, _seconds(retry_after, unit=1000))
+        retry_after = response.headers.get('retry-after')
+        if retry_after is not None:
+            return max(delay, _seconds(retry_after))
+    return delay
+
+
+def _seconds(value, unit=1):
+    # Converted before it is capped, a `retry-after-ms` of 20000 is 20 seconds
+    try:
+        return min(float(value) / unit, settings.OPENAI_RETRY_MAX_DELAY)
+    except ValueError:
+        return 0.0
+
+
+def is_retryable(error):
+    # An exhausted quota is a 429 too, waiting does not help
+    if isinstance(error, openai.RateLimitError) and getattr(error, 'code', None) == 'insufficient_quota':
+        return False
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def _used_tokens(result):
+    usage = getattr(result, 'usage', None)
+    return getattr(usage, 'total_tokens', None) if usage is not None else None
+
+
+def request(method, *args, tokens=0, **kwargs):
+    """Calls ``method`` (of get_client()) within the rate and concurrency limits, with retries.
+
+    ``tokens`` is the estimated cost of the call against the tokens-per-minute quota.
+    """
+    limiter = get_limiter()
+    for attempt in range(1, settings.OPENAI_MAX_ATTEMPTS + 1):
+        time.sleep(limiter.reserve(tokens))
+        with get_semaphore():
+            try:
+                result = method(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error) or attempt == settings.OPENAI_MAX_ATTEMPTS:
+                    raise
+                delay = retry_delay(error, attempt)
+            else:
+                limiter.settle(tokens, _used_tokens(result))
+                return result
+        time.sleep(delay)
+
+
+def request_stream(method, *args, tokens=0, **kwargs):
+    # request() for streamed responses, yields the chunks. The concurrency slot is held until the
+    # stream ends, failures are only retried before the first chunk
+    limiter = get_limiter()
+    for attempt in range(1, settings.OPENAI_MAX_ATTEMPTS + 1):
+        time.sleep(limiter.reserve(tokens))
+        with get_semaphore():
+            try:
+                stream = method(*args, stream=True, **kwargs)
+            except Exception as error:
+                if not is_retryable(error) or attempt == settings.OPENAI_MAX_ATTEMPTS:
+                    raise
+                delay = retry_delay(error, attempt)
+            else:
+                used = None
+                try:
+                    for chunk in stream:
+                        used = _used_tokens(chunk) or used
+                        yield chunk
+                finally:
+                    stream.close()
+                limiter.settle(tokens, used)
+                return
+        time.sleep(delay)
+
+
+async def arequest(method, *args, tokens=0, **kwargs):
+    # request() for the methods of get_async_client()
+    limiter = get_limiter()
+    semaphore = get_semaphore()
+    for attempt in range(1, settings.OPENAI_MAX_ATTEMPTS + 1):
+        await asyncio.sleep(limiter.reserve(tokens))
+        async with semaphore:
+            try:
+                result = await method(*args, **kwargs)
+            except Exception as error:
+                if not is_retryable(error) or attempt == settings.OPENAI_MAX_ATTEMPTS:
+                    raise
+                delay = retry_delay(error, attempt)
+            else:
+                limiter.settle(tokens, _used_tokens(result))
+                return result
+        await asyncio.sleep(delay)
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import User
+from django.urls import reverse
 from rest_framework import serializers
 # from .models import Document
+from .models import BackgroundJob, BackgroundJobAttempt, TranscriptionBatch, TranscriptionJob
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -11,3 +13,91 @@ class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = User.objects.create_user(**validated_data)
         return user
+
+class TranscriptionJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.CharField(source='job_name', read_only=True)
+    status_url = serializers.SerializerMethodField()
+    result_url = serializers.SerializerMethodField()
+    text_url = serializers.SerializerMethodField()
+    segments_url = serializers.SerializerMethodField()
+    summary_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TranscriptionJob
+        fields = [
+            'job_id', 'job_type', 'status', 'failure_reason', 'created_at', 'updated_at',
+            'status_url', 'result_url', 'text_url', 'segments_url', 'summary_url',
+        ]
+        read_only_fields = fields
+
+    def get_status_url(self, job):
+        return self._build_url('transcription_job_status', job)
+
+    def get_result_url(self, job):
+        return self._build_url('transcription_job_result', job)
+
+    def get_text_url(self, job):
+        return self._build_url('transcription_job_text', job)
+
+    def get_segments_url(self, job):
+        return self._build_url('transcription_job_segments', job)
+
+    def get_summary_url(self, job):
+        return self._build_url('transcription_job_summary', job)
+
+    def _build_url(self, name, job):
+        url = reverse(name, kwargs={'job_id': job.job_name})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class TranscriptionBatchItemSerializer(TranscriptionJobSerializer):
+    class Meta(TranscriptionJobSerializer.Meta):
+        fields = ['s3_url'] + TranscriptionJobSerializer.Meta.fields
+        read_only_fields = fields
+
+class TranscriptionBatchSerializer(serializers.ModelSerializer):
+    batch_id = serializers.IntegerField(source='pk', read_only=True)
+    counts = serializers.SerializerMethodField()
+    items = TranscriptionBatchItemSerializer(source='jobs', many=True, read_only=True)
+    status_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TranscriptionBatch
+        fields = ['batch_id', 'job_type', 'created_at', 'counts', 'items', 'status_url']
+        read_only_fields = fields
+
+    def get_counts(self, batch):
+        counts = {}
+        for job in batch.jobs.all():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def get_status_url(self, batch):
+        url = reverse('transcription_batch', kwargs={'batch_id': batch.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+class BackgroundJobAttemptSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BackgroundJobAttempt
+        fields = ['number', 'worker', 'started_at', 'finished_at', 'duration_ms', 'error']
+        read_only_fields = fields
+
+class BackgroundJobSerializer(serializers.ModelSerializer):
+    # The payload is left out, it can hold a whole transcript
+    job_id = serializers.IntegerField(source='pk', read_only=True)
+    attempts = BackgroundJobAttemptSerializer(source='attempt_set', many=True, read_only=True)
+    status_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BackgroundJob
+        fields = [
+            'job_id', 'kind', 'status', 'result', 'error', 'max_attempts', 'attempts',
+            'created_at', 'started_at', 'finished_at', 'status_url',
+        ]
+        read_only_fields = fields
+
+    def get_status_url(self, job):
+        url = reverse('background_job', kwargs={'job_id': job.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
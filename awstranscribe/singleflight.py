@@ -0,0 +1,225 @@
+"""Concurrent calls for the same piece of work wait for one of them to do it (single flight).
+
+Within a process the callers of single_flight() with the same key share the result, or the error,
+of one call. Across processes an InFlightLock row marks the work as taken: the other processes wait
+for the row to go, then ``lookup()`` the result where its owner left it (the transcript or summary
+cache, the job record) and only do the work themselves when it is not there.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import InFlightLock
+
+logger = logging.getLogger(__name__)
+
+_calls = {}
+_tasks = {}
+_lock = threading.Lock()
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, func, lookup=None):
+    """Returns ``func()``, called once for all the concurrent callers with the same ``key``.
+
+    ``lookup()`` returns the result another process produced, or None. Without it the work is
+    only shared within this process.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        _count(key, 'process')
+        if not call.done.wait(settings.SINGLE_FLIGHT_WAIT):
+            logger.warning("Gave up waiting for %s, doing it again", key)
+            return func()
+        if call.error is not None:
+            raise call.error
+        return call.result
+    try:
+        call.result = _run_locked(key, func, lookup)
+        return call.result
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+
+
+def _run_locked(key, func, lookup):
+    if lookup is None or not settings.SINGLE_FLIGHT_LOCKS:
+        return func()
+    owner = acquire_lock(key)
+    if owner is None:
+        result, owner = _wait_for_owner(key, lookup)
+        if result is not None:
+            return result
+        if owner is None:
+            return func()
+    try:
+        return func()
+    finally:
+        release_lock(key, owner)
+
+
+def _wait_for_owner(key, lookup):
+    # Waits while another process holds the lock. Returns (its result, None) when it left one,
+    # (None, our owner token) when the lock is ours instead, (None, None) after SINGLE_FLIGHT_WAIT
+    _count(key, 'lock')
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT
+    while True:
+        if time.monotonic() >= deadline:
+            logger.warning("Gave up waiting for %s, doing it again", key)
+            return None, None
+        time.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+        if not lock_held(key):
+            # The owner is done, its result is found unless it failed
+            result = lookup()
+            if result is not None:
+                return result, None
+            owner = acquire_lock(key)
+            if owner is not None:
+                return None, owner
+
+
+def single_flight_stream(key, stream, lookup=None):
+    """single_flight() for ``stream()``, a generator of text pieces.
+
+    The caller doing the work yields the pieces as they come, the concurrent ones wait and get
+    the joined text as one piece. If the first caller stops reading before the end, the ones
+    waiting for it do the work themselves.
+    """
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+    if not leader:
+        _count(key, 'process')
+        if call.done.wait(settings.SINGLE_FLIGHT_WAIT):
+            if call.error is not None:
+                raise call.error
+            if call.result is not None:
+                yield call.result
+                return
+        else:
+            logger.warning("Gave up waiting for %s, doing it again", key)
+        yield from stream()
+        return
+    pieces = []
+    try:
+        for piece in _stream_locked(key, stream, lookup):
+            pieces.append(piece)
+            yield piece
+        call.result = ''.join(pieces)
+    except Exception as error:
+        call.error = error
+        raise
+    finally:
+        with _lock:
+            del _calls[key]
+        call.done.set()
+
+
+def _stream_locked(key, stream, lookup):
+    owner = None
+    if lookup is not None and settings.SINGLE_FLIGHT_LOCKS:
+        owner = acquire_lock(key)
+        if owner is None:
+            result, owner = _wait_for_owner(key, lookup)
+            if result is not None:
+                yield result
+                return
+    try:
+        yield from stream()
+    finally:
+        if owner is not None:
+            release_lock(key, owner)
+
+
+async def asingle_flight(key, func, lookup=None):
+    # single_flight() for a coroutine function. The callers on an event loop share one task, a
+    # caller that goes away (client disconnect) does not cancel it for the others
+    task_key = (asyncio.get_running_loop(), key)
+    task = _tasks.get(task_key)
+    if task is None:
+        task = _tasks[task_key] = asyncio.ensure_future(_arun_locked(key, func, lookup))
+        task.add_done_callback(lambda _: _tasks.pop(task_key, None))
+    else:
+        _count(key, 'process')
+    return await asyncio.shield(task)
+
+
+async def _arun_locked(key, func, lookup):
+    if lookup is None or not settings.SINGLE_FLIGHT_LOCKS:
+        return await func()
+    owner = await sync_to_async(acquire_lock)(key)
+    if owner is None:
+        _count(key, 'lock')
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT
+        while owner is None:
+            if time.monotonic() >= deadline:
+                logger.warning("Gave up waiting for %s, doing it again", key)
+                return await func()
+            await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_INTERVAL)
+            if not await sync_to_async(lock_held)(key):
+                result = await sync_to_async(lookup)()
+                if result is not None:
+                    return result
+                owner = await sync_to_async(acquire_lock)(key)
+    try:
+        return await func()
+    finally:
+        await sync_to_async(release_lock)(key, owner)
+
+
+def acquire_lock(key):
+    # The new owner's token, or None while another process holds the lock
+    owner = uuid.uuid4().hex
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.SINGLE_FLIGHT_LOCK_TIMEOUT)
+    # The lock of a process that died is taken over once it expires. Write first, like the caches:
+    # on SQLite a read-then-write transaction fails under concurrent writers
+    if InFlightLock.objects.filter(key=key, expires_at__lt=now).update(owner=owner, expires_at=expires_at):
+        return owner
+    try:
+        with transaction.atomic():
+            InFlightLock.objects.create(key=key, owner=owner, expires_at=expires_at)
+    except IntegrityError:
+        return None
+    return owner
+
+
+def lock_held(key):
+    return InFlightLock.objects.filter(key=key, expires_at__gte=timezone.now()).exists()
+
+
+def release_lock(key, owner):
+    # Only our own: once expired the lock may have been taken over
+    InFlightLock.objects.filter(key=key, owner=owner).delete()
+
+
+def _count(key, scope):
+    kind = key.split(':', 1)[0]
+    metrics.singleflight_shared.inc(kind=kind, scope=scope, route=metrics.current_route())
+    metrics.record('singleflight_wait')
@@ -0,0 +1,88 @@
+import json
+import logging
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+from .cache import get_summary, summarize_stream_once
+from .summarize import MapReduceSummarizer
+
+logger = logging.getLogger(__name__)
+
+
+class EventStreamRenderer(BaseRenderer):
+    # Lets DRF content negotiation accept `Accept: text/event-stream`; the stream itself is a
+    # StreamingHttpResponse, this only renders errors returned before streaming starts
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return sse_event(data, event='error').encode('utf-8')
+
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+def wants_stream(request):
+    # DRF requests have query_params, the plain Django requests of the async views only GET
+    stream = getattr(request, 'query_params', request.GET).get('stream')
+    if stream is not None:
+        return stream.lower() in ['1', 'true', 'yes']
+    return 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
+
+
+def summary_events(text, cache_key, summarizer=None):
+    """Server-Sent Events for a summary: `delta` events with text as it is generated, then `done`.
+
+    The first bytes go out before any OpenAI call so clients see the stream open right away.
+    """
+    yield ": stream opened\n\n"
+    summary = get_summary(cache_key)
+    if summary is not None:
+        yield sse_event({'delta': summary}, event='delta')
+        yield sse_event({'summary': summary}, event='done')
+        return
+
+    # Identical texts summarized at the same time, streamed or not, share one summary
+    pieces = []
+    try:
+        stream = lambda: (summarizer or MapReduceSummarizer()).summarize_stream(text)
+        for piece in summarize_stream_once(cache_key, stream):
+            pieces.append(piece)
+            yield sse_event({'delta': piece}, event='delta')
+    except Exception as e:
+        logger.exception("Streaming summary failed")
+        yield sse_event({'error': str(e)}, event='error')
+        return
+
+    yield sse_event({'summary': ''.join(pieces)}, event='done')
+
+
+async def pull_events(events, run_blocking):
+    # Under ASGI Django drains a sync iterator with sync_to_async(list) before sending a byte, so
+    # the async views hand over an async iterator taking one event at a time off the event loop
+    try:
+        while True:
+            event = await run_blocking(next, events, None)
+            if event is None:
+                return
+            yield event
+    finally:
+        await run_blocking(events.close)
+
+
+def summary_stream_response(text, cache_key, run_blocking=None):
+    # run_blocking(func, *args) runs blocking calls for an async view, see awstranscribe.async_views
+    events = summary_events(text, cache_key)
+    if run_blocking is not None:
+        events = pull_events(events, run_blocking)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx and similar proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
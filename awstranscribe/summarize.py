@@ -0,0 +1,215 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .assistants import summarize_with_assistant
+from .cache import get_summary, summarize_once, summary_key
+from .models import TranscriptSummary
+from .transcripts import get_compact_transcript
+from .utils import (
+        OPENAI_MODEL,
+        SUMMARY_INSTRUCTIONS,
+        SUMMARY_PROMPT_VERSION,
+        achat_complete,
+        calculate_tokens,
+        chat_complete,
+        chat_complete_stream,
+        get_encoding,
+    )
+
+# Texts up to this many tokens are summarized with a single chat completion
+SUMMARY_MAX_TOKENS = 10000
+
+CHUNK_INSTRUCTIONS = (
+    "The prompt is one part of a longer lecture transcript. "
+    "Summarize the lecture content inside the prompt into 15%, keep every key point, definition and example."
+)
+REDUCE_INSTRUCTIONS = (
+    "The prompt contains summaries of consecutive parts of one lecture. "
+    "Combine them into a single summary of the whole lecture. The summary must less than 1000 tokens."
+)
+
+
+def complete_text(text, instructions):
+    completion = chat_complete(text, instructions=instructions)
+    return completion.choices[0].message.content
+
+
+async def acomplete_text(text, instructions):
+    completion = await achat_complete(text, instructions=instructions)
+    return completion.choices[0].message.content
+
+
+def summarize_text(text):
+    # The choice SummarizeTxt makes, for callers outside a request
+    if settings.SUMMARY_ENGINE == 'assistant' and calculate_tokens(text) >= SUMMARY_MAX_TOKENS:
+        return summarize_with_assistant(text.encode('utf-8'))
+    return MapReduceSummarizer().summarize(text)
+
+
+def get_transcript_summary(job):
+    # The stored summary of a completed job, None until summarize_transcript() made it
+    return TranscriptSummary.objects.filter(job=job, model=OPENAI_MODEL, prompt_version=SUMMARY_PROMPT_VERSION).first()
+
+
+def summarize_transcript(job):
+    """Summarizes a completed job's transcript and stores the summary, unless it is stored already.
+
+    The text is the compact transcript, built from the transcripts bucket, so it never goes through
+    the client. The summary is cached like one of a POSTed text, a later api/summarize/ of the same
+    text is a hit.
+    """
+    stored = get_transcript_summary(job)
+    if stored is not None:
+        return stored
+    text = get_compact_transcript(job).text
+    if not text.strip():
+        # Nothing was said, there is nothing to ask OpenAI about
+        summary = ''
+    else:
+        key = summary_key(text)
+        summary = get_summary(key)
+        if summary is None:
+            summary = summarize_once(key, lambda: summarize_text(text))
+    values = {'summary': summary, 'model': OPENAI_MODEL, 'prompt_version': SUMMARY_PROMPT_VERSION, 'created_at': timezone.now()}
+    # Write first, a summary of an older prompt version is replaced
+    if not TranscriptSummary.objects.filter(job=job).update(**values):
+        try:
+            with transaction.atomic():
+                TranscriptSummary.objects.create(job=job, **values)
+        except IntegrityError:
+            TranscriptSummary.objects.filter(job=job).update(**values)
+    return TranscriptSummary.objects.get(job=job)
+
+
+def split_text(text, chunk_tokens, overlap=0):
+    # Consecutive windows of `chunk_tokens` tokens, each repeating the last `overlap` tokens of the previous one
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= chunk_tokens:
+        return [text]
+    step = max(chunk_tokens - overlap, 1)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(encoding.decode(tokens[start:start + chunk_tokens]))
+        if start + chunk_tokens >= len(tokens):
+            break
+    return chunks
+
+
+def _advance(rounds, partials=None):
+    # One step of MapReduceSummarizer.rounds: (next map round, None) or (None, final completion).
+    # StopIteration is caught here, it cannot travel through asyncio.to_thread's future
+    try:
+        return rounds.send(partials), None
+    except StopIteration as stop:
+        return None, stop.value
+
+
+class MapReduceSummarizer:
+    """Summarizes text of any length with chat completions only.
+
+    Texts under ``max_tokens`` are summarized with one completion. Longer ones are split into
+    token windows which are summarized concurrently (map), then the partial summaries are combined
+    (reduce), in several rounds if they do not fit one prompt. The streamed and the JSON summary of
+    a text go through this same choice. ``complete`` is any ``callable(text, instructions) -> str``,
+    chat completions by default.
+    """
+
+    def __init__(self, complete=None, chunk_tokens=None, overlap=None, concurrency=None, max_tokens=None):
+        self.complete = complete or complete_text
+        self.max_tokens = max_tokens or SUMMARY_MAX_TOKENS
+        self.chunk_tokens = chunk_tokens or settings.SUMMARY_CHUNK_TOKENS
+        self.overlap = overlap if overlap is not None else settings.SUMMARY_CHUNK_OVERLAP
+        self.concurrency = concurrency or settings.SUMMARY_CONCURRENCY
+
+    def summarize(self, text):
+        return self.complete(*self.prepare(text))
+
+    def summarize_stream(self, text, stream_complete=None):
+        # Map and intermediate reduce rounds run as usual, only the final completion is streamed
+        stream_complete = stream_complete or chat_complete_stream
+        yield from stream_complete(*self.prepare(text))
+
+    def prepare(self, text):
+        # Returns the (text, instructions) of the final completion
+        rounds = self.rounds(text)
+        step, final = _advance(rounds)
+        while step is not None:
+            step, final = _advance(rounds, self.map(*step))
+        return final
+
+    def rounds(self, text):
+        # The chunking decision shared by both summarizers: yields the (texts, instructions) of each
+        # map round, is sent back its partial summaries, returns the final (text, instructions)
+        if calculate_tokens(text) < self.max_tokens:
+            return text, SUMMARY_INSTRUCTIONS
+        chunks = split_text(text, self.chunk_tokens, self.overlap)
+        if len(chunks) == 1:
+            return text, SUMMARY_INSTRUCTIONS
+        partials = yield chunks, CHUNK_INSTRUCTIONS
+        while len(partials) > 1 and calculate_tokens('\n\n'.join(partials)) > self.chunk_tokens:
+            partials = yield self.group(partials), REDUCE_INSTRUCTIONS
+        return '\n\n'.join(partials), REDUCE_INSTRUCTIONS
+
+    def map(self, texts, instructions):
+        # executor.map keeps the order of the transcript. Each call runs in a copy of the caller's
+        # context, so its OpenAI metrics are attributed to the request
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(texts))) as executor:
+            return list(executor.map(lambda text: context.copy().run(self.complete, text, instructions), texts))
+
+    def group(self, partials):
+        # Packs consecutive partial summaries into prompts of at most chunk_tokens, at least two per
+        # prompt so every round shrinks the list
+        groups = []
+        current = []
+        current_tokens = 0
+        for partial in partials:
+            tokens = calculate_tokens(partial)
+            if len(current) >= 2 and current_tokens + tokens > self.chunk_tokens:
+                groups.append('\n\n'.join(current))
+                current = []
+                current_tokens = 0
+            current.append(partial)
+            current_tokens += tokens
+        if len(current) == 1 and groups:
+            groups[-1] += '\n\n' + current[0]
+        elif current:
+            groups.append('\n\n'.join(current))
+        return groups
+
+
+class AsyncMapReduceSummarizer(MapReduceSummarizer):
+    """asyncio flavour of MapReduceSummarizer for the ASGI views.
+
+    Chunk summaries are awaited together instead of occupying threads; ``complete`` is an
+    ``async callable(text, instructions) -> str``.
+    """
+
+    def __init__(self, complete=None, **kwargs):
+        super().__init__(complete=complete or acomplete_text, **kwargs)
+
+    async def summarize(self, text):
+        return await self.complete(*await self.prepare(text))
+
+    async def prepare(self, text):
+        # Tokenizing a long transcript is CPU work, every step of the rounds runs off the event loop
+        rounds = self.rounds(text)
+        step, final = await asyncio.to_thread(_advance, rounds)
+        while step is not None:
+            step, final = await asyncio.to_thread(_advance, rounds, await self.map(*step))
+        return final
+
+    async def map(self, texts, instructions):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def complete(text):
+            async with semaphore:
+                return await self.complete(text, instructions)
+
+        return await asyncio.gather(*(complete(text) for text in texts))
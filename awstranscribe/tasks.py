@@ -0,0 +1,32 @@
+# Handlers of the background job queue, run by `manage.py run_worker`
+from .background import register
+from .cache import get_summary, summarize_once, summary_key
+from .jobs import ensure_poller, submit_job
+from .models import TranscriptionJob
+from .summarize import summarize_text, summarize_transcript
+
+
+@register('transcribe')
+def transcribe(payload):
+    job_name, job_type, s3_url = payload['job_name'], payload['job_type'], payload['s3_url']
+    options = payload.get('options', {})
+    job = submit_job(job_name, job_type, s3_url, options)
+    # Completion is tracked by the poller like for jobs started from a request
+    ensure_poller()
+    return {'job_id': job.job_name, 'status': job.status}
+
+
+@register('summarize')
+def summarize(payload):
+    cache_key = summary_key(payload['text'])
+    summary = get_summary(cache_key)
+    if summary is None:
+        summary = summarize_once(cache_key, lambda: summarize_text(payload['text']))
+    return {'summary': summary}
+
+
+@register('summarize_transcript')
+def summarize_job_transcript(payload):
+    # Queued when a job completes with TRANSCRIPT_AUTO_SUMMARIZE, or by api/transcribe/<job_id>/summary/?queue=true
+    job = TranscriptionJob.objects.get(job_name=payload['job_name'])
+    return {'job_id': job.job_name, 'summary': summarize_transcript(job).summary}
@@ -1,3 +1,1839 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'test-key')
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+import httpx
+import openai
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+import tiktoken
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import metrics
+from .assistants import AssistantRunError, forget_assistant, summarize_with_assistant
+from .background import _handlers, claim_jobs, enqueue, get_handler, requeue_stale_jobs, run_job
+from .aws import get_client, reset_clients
+from .cache import get_transcript, put_summary, put_transcript, reset_cache_stats, summarize_once, summary_key
+from .engines import AwsTranscribeEngine, LocalTranscriptionEngine
+from .jobs import TranscriptionPoller, mark_job_completed
+from .listing import BucketIndex, reset_bucket_indexes
+from .middleware import brotli
+from .singleflight import acquire_lock, asingle_flight, lock_held, release_lock, single_flight, single_flight_stream
+from .openai_client import (
+    ConcurrencyLimit, TokenBucket, arequest as openai_arequest, request as openai_request, reset_clients as reset_openai_clients, retry_delay,
+)
+from .summarize import AsyncMapReduceSummarizer, MapReduceSummarizer, split_text
+from .transcripts import compact_transcript, compact_transcript_stream
+from .utils import calculate_tokens, chat_complete, calculate_tokens_batch, get_encoding, split_for_counting
+from .models import BackgroundJob, CachedTranscript, OpenAIAssistant, TranscriptionJob, TranscriptSummary
 
 # Create your tests here.
+
+TRANSCRIPT = {'results': {'transcripts': [{'transcript': 'hello world'}], 'items': []}}
+
+
+class StubTranscribeClient:
+    """In-memory stand-in for the boto3 Transcribe client."""
+
+    class exceptions:
+        class BadRequestException(Exception):
+            pass
+
+    def __init__(self):
+        self.jobs = {}
+        self.types = {}
+        self.arguments = {}
+        self.calls = []
+
+    def _get(self, name, key):
+        self.calls.append(('get', name))
+        if name not in self.jobs:
+            raise self.exceptions.BadRequestException(name)
+        return {key: dict(self.jobs[name])}
+
+    def _start(self, name, key, arguments):
+        self.calls.append(('start', name))
+        self.arguments[name] = arguments
+        self.jobs[name] = {'TranscriptionJobName': name, 'TranscriptionJobStatus': 'IN_PROGRESS', 'CreationTime': timezone.now()}
+        self.types[name] = key
+        return {key: dict(self.jobs[name])}
+
+    def _list(self, key, name_key, Status, MaxResults, NextToken=None):
+        self.calls.append(('list', Status))
+        summaries = [
+            {name_key: name, 'TranscriptionJobStatus': job['TranscriptionJobStatus'],
+             'FailureReason': job.get('FailureReason', ''), 'CreationTime': job['CreationTime']}
+            for name, job in self.jobs.items()
+            if self.types[name] == key and job['TranscriptionJobStatus'] == Status
+        ]
+        return {f'{key}Summaries': sorted(summaries, key=lambda summary: summary['CreationTime'], reverse=True)}
+
+    def list_transcription_jobs(self, **kwargs):
+        return self._list('TranscriptionJob', 'TranscriptionJobName', **kwargs)
+
+    def list_medical_transcription_jobs(self, **kwargs):
+        return self._list('MedicalTranscriptionJob', 'MedicalTranscriptionJobName', **kwargs)
+
+    def get_transcription_job(self, TranscriptionJobName):
+        return self._get(TranscriptionJobName, 'TranscriptionJob')
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        return self._start(TranscriptionJobName, 'TranscriptionJob', kwargs)
+
+    def get_medical_transcription_job(self, MedicalTranscriptionJobName):
+        return self._get(MedicalTranscriptionJobName, 'MedicalTranscriptionJob')
+
+    def start_medical_transcription_job(self, MedicalTranscriptionJobName, **kwargs):
+        return self._start(MedicalTranscriptionJobName, 'MedicalTranscriptionJob', kwargs)
+
+    def complete(self, name, key=None):
+        self.jobs[name]['TranscriptionJobStatus'] = 'COMPLETED'
+        self.jobs[name]['Transcript'] = {
+            'TranscriptFileUri': f"https://s3.us-east-1.amazonaws.com/transcripts/{key or name + '.json'}"
+        }
+
+
+class StubS3Client:
+    """In-memory stand-in for the boto3 S3 client."""
+
+    last_modified = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+
+    def __init__(self, fail_part=None):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.fail_part = fail_part
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = bytes(Body)
+        return {'ETag': '"put"'}
+
+    def list_objects_v2(self, Bucket, ContinuationToken=None, page_size=2):
+        self.list_calls = getattr(self, 'list_calls', 0) + 1
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket)
+        start = int(ContinuationToken or 0)
+        page = {
+            'Contents': [
+                {'Key': key, 'LastModified': self.last_modified, 'Size': len(self.objects[(Bucket, key)]), 'ETag': '"etag"'}
+                for key in keys[start:start + page_size]
+            ],
+            'IsTruncated': start + page_size < len(keys),
+        }
+        if page['IsTruncated']:
+            page['NextContinuationToken'] = str(start + page_size)
+        return page
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise RuntimeError('part upload failed')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId, None)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.objects[(Bucket, Key)]), 'ETag': '"etag"'}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        query = '&'.join(f'{name}={value}' for name, value in sorted(Params.items()) if name not in ['Bucket', 'Key'])
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?method={ClientMethod}&{query}"
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False, AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS='transcripts')
+class TranscriptionJobApiTests(TestCase):
+    s3_url = 'https://media.s3.amazonaws.com/lecture.mp4'
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.transcribe = StubTranscribeClient()
+        patcher = mock.patch('awstranscribe.engines.get_transcribe_client', return_value=self.transcribe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(AwsTranscribeEngine, 'read_transcript', return_value=(json.dumps(TRANSCRIPT), '"etag"'))
+        self.read_transcript = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_submit_returns_job_id_immediately(self):
+        response = self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'IN_PROGRESS')
+        job = TranscriptionJob.objects.get(job_name=response.data['job_id'])
+        self.assertEqual(job.s3_url, self.s3_url)
+        self.assertEqual([call[0] for call in self.transcribe.calls], ['get', 'start'])
+
+    def test_resubmitting_pending_job_does_not_call_aws(self):
+        self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json')
+        calls = len(self.transcribe.calls)
+
+        response = self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(self.transcribe.calls), calls)
+
+    def test_poller_completes_job_and_result_is_served(self):
+        job_id = self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json').data['job_id']
+        self.assertEqual(self.api.get(f'/api/transcribe/{job_id}/result/').status_code, 202)
+
+        self.transcribe.complete(job_id)
+        TranscriptionPoller(client_factory=lambda: self.transcribe).poll_once()
+
+        status_response = self.api.get(f'/api/transcribe/{job_id}/status/')
+        self.assertEqual(status_response.data['status'], 'COMPLETED')
+        result = self.api.get(f'/api/transcribe/{job_id}/result/')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.content), TRANSCRIPT)
+        self.read_transcript.assert_called_with(f'{job_id}.json')
+
+    def test_poller_marks_failed_jobs(self):
+        job_id = self.api.post('/api/transcribe-medical/', {'s3_url': self.s3_url}, format='json').data['job_id']
+        self.transcribe.jobs[job_id].update(TranscriptionJobStatus='FAILED', FailureReason='Unsupported media')
+
+        TranscriptionPoller(client_factory=lambda: self.transcribe).poll_once()
+
+        job = TranscriptionJob.objects.get(job_name=job_id)
+        self.assertEqual(job.job_type, TranscriptionJob.MEDICAL)
+        self.assertEqual(job.failure_reason, 'Unsupported media')
+        self.assertEqual(self.api.get(f'/api/transcribe/{job_id}/result/').status_code, 500)
+
+    def test_unknown_job_status_is_404(self):
+        self.assertEqual(self.api.get('/api/transcribe/missing/status/').status_code, 404)
+
+    def test_completed_transcript_is_served_from_cache(self):
+        job_id = self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json').data['job_id']
+        self.transcribe.complete(job_id)
+        TranscriptionPoller(client_factory=lambda: self.transcribe).poll_once()
+        self.api.get(f'/api/transcribe/{job_id}/result/')
+        calls = len(self.transcribe.calls)
+
+        response = self.api.post('/api/transcribe/', {'s3_url': self.s3_url}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), TRANSCRIPT)
+        self.assertEqual(len(self.transcribe.calls), calls)
+        self.assertEqual(self.read_transcript.call_count, 1)
+
+    def test_delete_invalidates_cached_transcript(self):
+        put_transcript('TranscriptionJob_abc', '{}')
+
+        self.assertEqual(self.api.delete('/api/transcribe/TranscriptionJob_abc/result/').status_code, 204)
+        self.assertIsNone(get_transcript('TranscriptionJob_abc'))
+        self.assertEqual(self.api.delete('/api/transcribe/TranscriptionJob_abc/result/').status_code, 404)
+
+    def test_job_options_are_passed_to_transcribe(self):
+        response = self.api.post('/api/transcribe/', {'s3_url': 'https://media.s3.amazonaws.com/talk.mp3'}, format='json')
+        arguments = self.transcribe.arguments[response.data['job_id']]
+        self.assertEqual((arguments['MediaFormat'], arguments['LanguageCode']), ('mp3', 'en-US'))
+
+        response = self.api.post('/api/transcribe-medical/', {'s3_url': self.s3_url, 'language_code': 'en-GB', 'type': 'CONVERSATION'}, format='json')
+        arguments = self.transcribe.arguments[response.data['job_id']]
+        self.assertEqual(arguments['LanguageCode'], 'en-GB')
+        self.assertEqual((arguments['Specialty'], arguments['Type']), ('PRIMARYCARE', 'CONVERSATION'))
+        self.assertEqual(TranscriptionJob.objects.get(job_name=response.data['job_id']).options, {'language_code': 'en-GB', 'type': 'CONVERSATION'})
+
+    def test_invalid_options_are_rejected(self):
+        self.assertEqual(self.api.post('/api/transcribe/', {'s3_url': self.s3_url, 'media_format': 'avi'}, format='json').status_code, 400)
+        self.assertEqual(self.api.post('/api/transcribe/', {'s3_url': self.s3_url, 'type': 'DICTATION'}, format='json').status_code, 400)
+        self.assertEqual(self.transcribe.calls, [])
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False, TRANSCRIBE_BACKEND='local', TRANSCRIBE_LOCAL_DURATION=60)
+class LocalTranscriptionEngineTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        LocalTranscriptionEngine.reset()
+        self.addCleanup(LocalTranscriptionEngine.reset)
+
+    def test_jobs_run_end_to_end_without_aws(self):
+        response = self.api.post('/api/transcribe-medical/', {'s3_url': 'https://media.s3.amazonaws.com/visit.wav'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data['job_id']
+
+        with override_settings(TRANSCRIBE_LOCAL_DURATION=0):
+            TranscriptionPoller().poll_once()
+            result = self.api.get(f'/api/transcribe/{job_id}/result/')
+
+        self.assertEqual(TranscriptionJob.objects.get(job_name=job_id).transcript_key, f'medical/{job_id}.json')
+        self.assertEqual(result.status_code, 200)
+        transcript = json.loads(result.content)['results']['transcripts'][0]['transcript']
+        self.assertEqual(transcript, 'Local transcript of https://media.s3.amazonaws.com/visit.wav.')
+
+
+def word(content, start, end, speaker=None):
+    item = {'type': 'pronunciation', 'start_time': str(start), 'end_time': str(end), 'alternatives': [{'confidence': '0.99', 'content': content}]}
+    if speaker:
+        item['speaker_label'] = speaker
+    return item
+
+
+def punctuation(content):
+    return {'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': content}]}
+
+
+SPEAKER_TRANSCRIPT = {'results': {
+    'transcripts': [{'transcript': 'Good morning. How are you? Fine thanks'}],
+    'items': [
+        word('Good', 0.0, 0.4, 'spk_0'), word('morning', 0.4, 0.9, 'spk_0'), punctuation('.'),
+        word('How', 1.2, 1.4, 'spk_0'), word('are', 1.4, 1.5, 'spk_0'), word('you', 1.5, 1.8, 'spk_0'), punctuation('?'),
+        word('Fine', 2.5, 2.9, 'spk_1'), punctuation(','), word('thanks', 2.9, 3.4, 'spk_1'),
+    ],
+}}
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False, AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS='transcripts')
+class CompactTranscriptTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.job = TranscriptionJob.objects.create(
+            job_name='TranscriptionJob_abc', s3_url='https://media.s3.amazonaws.com/a.mp4',
+            status=TranscriptionJob.COMPLETED, transcript_key='TranscriptionJob_abc.json',
+        )
+        self.content = json.dumps(SPEAKER_TRANSCRIPT)
+        patcher = mock.patch.object(AwsTranscribeEngine, 'open_transcript', side_effect=lambda key: ([self.content.encode()], '"etag"'))
+        self.open_transcript = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_items_are_grouped_into_sentences_and_speaker_turns(self):
+        compact = compact_transcript(SPEAKER_TRANSCRIPT)
+
+        self.assertEqual(compact['duration'], 3.4)
+        self.assertEqual(compact['segments'], [
+            {'start': 0.0, 'end': 0.9, 'speaker': 'spk_0', 'text': 'Good morning.'},
+            {'start': 1.2, 'end': 1.8, 'speaker': 'spk_0', 'text': 'How are you?'},
+            {'start': 2.5, 'end': 3.4, 'speaker': 'spk_1', 'text': 'Fine, thanks'},
+        ])
+
+    def test_streamed_compaction_matches_parsing_the_whole_document(self):
+        content = json.dumps(SPEAKER_TRANSCRIPT, indent=2).encode()
+        chunks = [content[start:start + 7] for start in range(0, len(content), 7)]
+
+        self.assertEqual(compact_transcript_stream(chunks), compact_transcript(SPEAKER_TRANSCRIPT))
+        with self.assertRaises(ValueError):
+            compact_transcript_stream([content[:-1]])
+
+    def test_text_and_segment_ranges_are_served_from_one_compaction(self):
+        text = self.api.get('/api/transcribe/TranscriptionJob_abc/text/')
+        self.assertEqual(text.status_code, 200)
+        self.assertEqual(text.content.decode(), 'Good morning. How are you? Fine thanks')
+
+        segments = self.api.get('/api/transcribe/TranscriptionJob_abc/segments/?start=1&end=2')
+        self.assertEqual([segment['text'] for segment in segments.data['segments']], ['How are you?'])
+        everything = self.api.get('/api/transcribe/TranscriptionJob_abc/segments/')
+        self.assertEqual(len(everything.data['segments']), 3)
+        self.assertEqual(self.open_transcript.call_count, 1)
+
+    def test_conditional_requests_are_answered_without_reading_the_transcript(self):
+        result = self.api.get('/api/transcribe/TranscriptionJob_abc/result/')
+        text = self.api.get('/api/transcribe/TranscriptionJob_abc/text/')
+        self.assertEqual((result['ETag'], text['ETag']), ('"etag"', '"etag-text"'))
+        calls = self.open_transcript.call_count
+
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/result/', HTTP_IF_NONE_MATCH='"etag"').status_code, 304)
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/text/', HTTP_IF_NONE_MATCH='W/"etag-text"').status_code, 304)
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/text/', HTTP_IF_NONE_MATCH='"etag"').status_code, 200)
+        self.assertEqual(self.open_transcript.call_count, calls)
+
+    def test_large_transcripts_are_streamed_compressed(self):
+        content = json.dumps({'results': {'transcripts': [{'transcript': 'word ' * 50000}], 'items': []}})
+        self.content = content
+
+        response = self.api.get('/api/transcribe/TranscriptionJob_abc/result/', HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertTrue(response.streaming)
+        self.assertEqual((response['Content-Encoding'], response['ETag']), ('gzip', 'W/"etag"'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode(), content)
+
+    @skipUnless(brotli, 'brotli is not installed')
+    def test_brotli_is_preferred_when_installed(self):
+        response = self.api.get('/api/transcribe/TranscriptionJob_abc/result/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content)), SPEAKER_TRANSCRIPT)
+
+    def test_pending_jobs_and_bad_ranges(self):
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/segments/?start=soon').status_code, 400)
+        self.job.status = TranscriptionJob.IN_PROGRESS
+        self.job.save()
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/text/').status_code, 202)
+
+
+class TranscriptCacheTests(TestCase):
+
+    @override_settings(TRANSCRIPT_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        put_transcript('a', '{}')
+        put_transcript('b', '{}')
+        get_transcript('a')
+        put_transcript('c', '{}')
+
+        self.assertEqual(set(CachedTranscript.objects.values_list('key', flat=True)), {'a', 'c'})
+
+    @override_settings(TRANSCRIPT_CACHE_MAX_BYTES=10)
+    def test_entries_are_evicted_by_total_size(self):
+        put_transcript('a', '"12345"')
+        put_transcript('b', '"12345"')
+
+        self.assertEqual(list(CachedTranscript.objects.values_list('key', flat=True)), ['b'])
+
+    @override_settings(TRANSCRIPT_CACHE_MAX_AGE=0)
+    def test_expired_entries_are_misses(self):
+        put_transcript('a', '{}')
+
+        self.assertIsNone(get_transcript('a'))
+
+
+@override_settings(AWS_S3_REGION_NAME='us-east-1', AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing')
+class AwsClientRegistryTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    def test_client_is_created_once_across_threads(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: get_client('s3'), range(32)))
+
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        self.assertIsNot(get_client('transcribe'), clients[0])
+
+    @override_settings(AWS_MAX_POOL_CONNECTIONS=7)
+    def test_client_uses_configured_pool(self):
+        config = get_client('s3').meta.config
+
+        self.assertEqual(config.max_pool_connections, 7)
+        self.assertTrue(config.tcp_keepalive)
+
+
+@override_settings(AWS_S3_REGION_NAME='us-east-1', AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        reset_clients()
+        self.addCleanup(reset_clients)
+        self.user = User.objects.create_user(username='metrics', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_requests_are_counted_by_route(self):
+        self.client.get('/api/cache-stats/')
+        self.client.get('/api/no-such-endpoint/')
+
+        self.assertEqual(metrics.http_requests.value(method='GET', route='api/cache-stats/', status=200), 1)
+        self.assertEqual(metrics.http_requests.value(method='GET', route='unmatched', status=404), 1)
+        self.assertEqual(metrics.http_request_duration.count(method='GET', route='api/cache-stats/'), 1)
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        metrics.http_request_duration.observe(0.3, method='GET', route='a "quoted" route')
+
+        response = self.client.get('/api/metrics/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="a \\"quoted\\" route",le="0.25"} 0', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="a \\"quoted\\" route",le="0.5"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="a \\"quoted\\" route",le="+Inf"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="a \\"quoted\\" route"} 1', text)
+
+    def test_metrics_require_authentication(self):
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, 401)
+
+    def test_aws_calls_are_counted_with_their_outcome(self):
+        client = get_client('s3')
+        with Stubber(client) as stubber:
+            stubber.add_response('list_buckets', {'Buckets': [], 'ResponseMetadata': {'RetryAttempts': 2}})
+            stubber.add_client_error('head_bucket', 'NoSuchBucket', http_status_code=404)
+            client.list_buckets()
+            with self.assertRaises(ClientError):
+                client.head_bucket(Bucket='missing')
+
+        self.assertEqual(metrics.aws_calls.value(service='s3', operation='ListBuckets', outcome='ok', route=''), 1)
+        self.assertEqual(metrics.aws_retries.value(service='s3', operation='ListBuckets', route=''), 2)
+        self.assertEqual(metrics.aws_calls.value(service='s3', operation='HeadBucket', outcome='NoSuchBucket', route=''), 1)
+        self.assertEqual(metrics.aws_call_duration.count(service='s3', operation='HeadBucket', route=''), 1)
+
+    def test_openai_calls_count_tokens_and_retries(self):
+        completion = mock.Mock(usage=mock.Mock(prompt_tokens=120, completion_tokens=30, total_tokens=150))
+
+        def create(**kwargs):
+            # Two HTTP attempts, the first one retried
+            metrics.count_openai_attempt(None)
+            metrics.count_openai_attempt(None)
+            return completion
+
+        with mock.patch('awstranscribe.utils.get_client') as get_client:
+            get_client.return_value.chat.completions.create.side_effect = create
+            chat_complete('A lecture.')
+
+        self.assertEqual(metrics.openai_calls.value(operation='chat_complete', outcome='ok', route=''), 1)
+        self.assertEqual(metrics.openai_retries.value(operation='chat_complete', route=''), 1)
+        self.assertEqual(metrics.openai_tokens.value(operation='chat_complete', kind='prompt', route=''), 120)
+        self.assertEqual(metrics.openai_tokens.value(operation='chat_complete', kind='completion', route=''), 30)
+
+    def test_cache_lookups_are_counted(self):
+        get_transcript('metrics')
+        put_transcript('metrics', '{}')
+        get_transcript('metrics')
+
+        self.assertEqual(metrics.cache_requests.value(cache='transcript', result='miss', route=''), 1)
+        self.assertEqual(metrics.cache_requests.value(cache='transcript', result='hit', route=''), 1)
+
+    @override_settings(METRICS_LOG_REQUESTS=True)
+    def test_requests_are_logged_as_json(self):
+        with self.assertLogs('awstranscribe.metrics', level='INFO') as logs:
+            self.client.get('/api/cache-stats/')
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['route'], 'api/cache-stats/')
+        self.assertEqual(entry['status'], 200)
+        self.assertIn('duration_ms', entry)
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME='media', AWS_S3_MULTIPART_PART_SIZE=4, AWS_S3_MULTIPART_CONCURRENCY=2)
+class StreamingUploadTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        patcher = mock.patch('awstranscribe.uploadhandlers.MIN_PART_SIZE', 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, s3, content):
+        with mock.patch('awstranscribe.uploadhandlers.get_client', return_value=s3):
+            upload = SimpleUploadedFile('lecture.mp4', content, content_type='video/mp4')
+            return self.api.post('/api/upload/?stream=true', {'file': upload}, format='multipart')
+
+    def test_body_is_streamed_as_multipart_upload(self):
+        s3 = StubS3Client()
+
+        response = self.upload(s3, b'0123456789')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['file_url'], 'https://media.s3.amazonaws.com/lecture.mp4')
+        self.assertEqual(s3.objects[('media', 'lecture.mp4')], b'0123456789')
+        self.assertEqual(s3.uploads, {})
+
+    def test_small_file_uses_single_put(self):
+        s3 = StubS3Client()
+
+        self.upload(s3, b'012')
+
+        self.assertEqual(s3.objects[('media', 'lecture.mp4')], b'012')
+        self.assertEqual(s3.uploads, {})
+
+    def test_failed_part_aborts_upload(self):
+        s3 = StubS3Client(fail_part=2)
+
+        response = self.upload(s3, b'0123456789')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(s3.aborted, ['upload-1'])
+        self.assertEqual(s3.objects, {})
+
+
+@override_settings(
+    AWS_STORAGE_BUCKET_NAME='media',
+    AWS_S3_MULTIPART_PART_SIZE=4,
+    TRANSCRIBE_POLLER_AUTOSTART=False,
+)
+class PresignedUploadTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.s3 = StubS3Client()
+        self.transcribe = StubTranscribeClient()
+        for patcher in [
+            mock.patch('awstranscribe.views.get_client', return_value=self.s3),
+            mock.patch('awstranscribe.engines.get_transcribe_client', return_value=self.transcribe),
+            mock.patch('awstranscribe.views.MIN_PART_SIZE', 1),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_small_file_gets_single_put_url(self):
+        response = self.api.post('/api/upload/presign/', {'file_name': 'a.mp4', 'file_size': 3}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('method=put_object', response.data['url'])
+        self.assertNotIn('upload_id', response.data)
+
+    def test_large_file_gets_part_urls_and_completes(self):
+        presign = self.api.post('/api/upload/presign/', {'file_name': 'a.mp4', 'file_size': 10}, format='json').data
+        self.assertEqual([part['part_number'] for part in presign['parts']], [1, 2, 3])
+
+        # The client PUTs each part to its URL, simulated here
+        for part, body in zip(presign['parts'], [b'0123', b'4567', b'89']):
+            self.s3.upload_part('media', 'a.mp4', presign['upload_id'], part['part_number'], body)
+        parts = [{'part_number': number, 'etag': f'"part-{number}"'} for number in [3, 1, 2]]
+
+        response = self.api.post('/api/upload/complete/', {
+            'key': 'a.mp4', 'upload_id': presign['upload_id'], 'parts': parts, 'file_size': 10,
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['size'], 10)
+        self.assertEqual(self.s3.objects[('media', 'a.mp4')], b'0123456789')
+
+    def test_complete_validates_object(self):
+        missing = self.api.post('/api/upload/complete/', {'key': 'missing.mp4'}, format='json')
+        self.s3.put_object('media', 'a.mp4', b'012')
+        wrong_size = self.api.post('/api/upload/complete/', {'key': 'a.mp4', 'file_size': 5}, format='json')
+
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(wrong_size.status_code, 400)
+        self.assertEqual(self.api.post('/api/upload/complete/', {'key': 'a.mp4', 'file_size': '3'}, format='json').status_code, 200)
+        self.assertEqual(self.api.post('/api/upload/complete/', {'key': 'a.mp4', 'file_size': '3.0'}, format='json').status_code, 400)
+
+    def test_abandoned_multipart_upload_is_aborted(self):
+        presign = self.api.post('/api/upload/presign/', {'file_name': 'a.mp4', 'file_size': 10}, format='json').data
+
+        response = self.api.post('/api/upload/abort/', {'key': 'a.mp4', 'upload_id': presign['upload_id']}, format='json')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.s3.aborted, [presign['upload_id']])
+        self.assertEqual(self.api.post('/api/upload/abort/', {'key': 'a.mp4'}, format='json').status_code, 400)
+
+    def test_complete_can_submit_transcription(self):
+        self.s3.put_object('media', 'a.mp4', b'012')
+
+        response = self.api.post('/api/upload/complete/', {'key': 'a.mp4', 'transcribe': True, 'medical': True}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['transcription']['job_type'], TranscriptionJob.MEDICAL)
+        self.assertTrue(TranscriptionJob.objects.filter(s3_url='https://media.s3.amazonaws.com/a.mp4').exists())
+        self.assertEqual([call[0] for call in self.transcribe.calls], ['get', 'start'])
+
+    def test_complete_reports_a_failed_transcription(self):
+        self.s3.put_object('media', 'a.mp4', b'012')
+        error = ClientError({'Error': {'Code': 'BadRequestException', 'Message': 'Unsupported media'}}, 'StartTranscriptionJob')
+
+        with mock.patch.object(self.transcribe, 'start_transcription_job', side_effect=error):
+            response = self.api.post('/api/upload/complete/', {'key': 'a.mp4', 'transcribe': True}, format='json')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.data['key'], 'a.mp4')
+        self.assertIn('Unsupported media', response.data['transcription']['error'])
+
+
+@override_settings(AWS_STORAGE_BUCKET_NAME='media', S3_LIST_CACHE_TTL=60)
+class S3FileListTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.s3 = StubS3Client()
+        for key, size in [('a/1.mp4', 1), ('a/2.mp4', 5), ('a/3.mp4', 10), ('b/1.mp4', 1), ('b/2.mp4', 1)]:
+            self.s3.put_object('media', key, b'0' * size)
+        for patcher in [
+            mock.patch('awstranscribe.listing.get_client', return_value=self.s3),
+            mock.patch('awstranscribe.views.get_client', return_value=self.s3),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        reset_bucket_indexes()
+        self.addCleanup(reset_bucket_indexes)
+
+    def list_keys(self, url):
+        response = self.api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [file['Key'] for file in response.data], response
+
+    def test_cursor_pagination_walks_the_whole_bucket(self):
+        keys, response = self.list_keys('/api/s3-files/?limit=2')
+        pages = [keys]
+        while 'X-Next-Cursor' in response:
+            keys, response = self.list_keys(f"/api/s3-files/?limit=2&cursor={response['X-Next-Cursor']}")
+            pages.append(keys)
+
+        self.assertEqual(pages, [['a/1.mp4', 'a/2.mp4'], ['a/3.mp4', 'b/1.mp4'], ['b/2.mp4']])
+        # The index was listed once (three S3 pages) and reused for every API page
+        self.assertEqual(self.s3.list_calls, 3)
+
+    def test_prefix_and_size_filters(self):
+        keys, _ = self.list_keys('/api/s3-files/?prefix=a/&min_size=2&max_size=5')
+
+        self.assertEqual(keys, ['a/2.mp4'])
+
+    def test_date_filter_and_invalid_values(self):
+        keys, _ = self.list_keys('/api/s3-files/?modified_after=2024-06-01')
+
+        self.assertEqual(keys, [])
+        self.assertEqual(self.api.get('/api/s3-files/?modified_after=soon').status_code, 400)
+        self.assertEqual(self.api.get('/api/s3-files/?cursor=***').status_code, 400)
+
+    def test_uploads_are_added_to_the_index(self):
+        self.list_keys('/api/s3-files/')
+        self.s3.put_object('media', 'a/4.mp4', b'0')
+
+        self.api.post('/api/upload/complete/', {'key': 'a/4.mp4'}, format='json')
+        keys, _ = self.list_keys('/api/s3-files/?prefix=a/')
+
+        self.assertEqual(keys, ['a/1.mp4', 'a/2.mp4', 'a/3.mp4', 'a/4.mp4'])
+        self.assertEqual(self.s3.list_calls, 3)
+
+    def test_concurrent_first_requests_list_the_bucket_once(self):
+        index = BucketIndex('media', client_factory=lambda: self.s3)
+        list_objects = self.s3.list_objects_v2
+
+        def slow_list(**kwargs):
+            time.sleep(0.02)
+            return list_objects(**kwargs)
+
+        with mock.patch.object(self.s3, 'list_objects_v2', side_effect=slow_list), ThreadPoolExecutor(max_workers=8) as executor:
+            snapshots = list(executor.map(lambda _: index.snapshot()[0], range(8)))
+
+        self.assertEqual(snapshots, [['a/1.mp4', 'a/2.mp4', 'a/3.mp4', 'b/1.mp4', 'b/2.mp4']] * 8)
+        self.assertEqual(self.s3.list_calls, 3)
+
+    def test_changes_made_during_a_refresh_are_kept(self):
+        index = BucketIndex('media', client_factory=lambda: self.s3)
+        list_objects = self.s3.list_objects_v2
+
+        def list_during_changes(**kwargs):
+            page = list_objects(**kwargs)
+            if 'ContinuationToken' not in kwargs:
+                # Uploaded and deleted while the listing runs, after it read those keys
+                index.put('a/0.mp4', 1)
+                index.discard('a/1.mp4')
+            return page
+
+        with mock.patch.object(self.s3, 'list_objects_v2', side_effect=list_during_changes):
+            index.refresh()
+
+        self.assertEqual(index.keys, ['a/0.mp4', 'a/2.mp4', 'a/3.mp4', 'b/1.mp4', 'b/2.mp4'])
+
+    @override_settings(TRANSCRIBE_EVENTS_SECRET='s3cret')
+    def test_s3_object_events_are_applied_to_the_index(self):
+        self.list_keys('/api/s3-files/')
+        records = [
+            {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+             's3': {'bucket': {'name': 'media'}, 'object': {'key': 'a/new+file.mp4', 'size': 3, 'eTag': 'abc'}}},
+            {'eventSource': 'aws:s3', 'eventName': 'ObjectRemoved:Delete',
+             's3': {'bucket': {'name': 'media'}, 'object': {'key': 'a/2.mp4'}}},
+        ]
+
+        APIClient().post('/api/transcribe/events/?secret=s3cret', json.dumps({'Records': records}), content_type='text/plain')
+        keys, response = self.list_keys('/api/s3-files/?prefix=a/')
+
+        self.assertEqual(keys, ['a/1.mp4', 'a/3.mp4', 'a/new file.mp4'])
+        self.assertEqual(response.data[-1]['ETag'], '"abc"')
+        self.assertEqual(self.s3.list_calls, 3)
+
+
+class FakeCompletions:
+    """Stand-in for chat completions: the summary of a text is its first `keep` words."""
+
+    def __init__(self, keep=5):
+        self.keep = keep
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, text, instructions):
+        with self.lock:
+            self.calls.append((text, instructions))
+        return ' '.join(text.split()[:self.keep])
+
+
+class FakeEncoding:
+    """Word level stand-in for a tiktoken encoding, tests must not download BPE files."""
+
+    def __init__(self):
+        self.vocabulary = []
+        self.ids = {}
+
+    def encode(self, text, **kwargs):
+        return self.encode_ordinary(text)
+
+    def encode_ordinary(self, text):
+        tokens = []
+        for word in text.split():
+            if word not in self.ids:
+                self.ids[word] = len(self.vocabulary)
+                self.vocabulary.append(word)
+            tokens.append(self.ids[word])
+        return tokens
+
+    def encode_ordinary_batch(self, texts, num_threads=8):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode(self, tokens):
+        return ' '.join(self.vocabulary[token] for token in tokens)
+
+
+class FakeEncodingMixin:
+
+    def setUp(self):
+        super().setUp()
+        get_encoding.cache_clear()
+        self.addCleanup(get_encoding.cache_clear)
+        patcher = mock.patch('tiktoken.get_encoding', return_value=FakeEncoding())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class MapReduceSummarizerTests(FakeEncodingMixin, SimpleTestCase):
+    text = ' '.join(f'word{index}' for index in range(2000))
+
+    def test_split_text_windows_overlap(self):
+        chunks = split_text(self.text, chunk_tokens=500, overlap=50)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith('word0 '))
+        self.assertTrue(chunks[-1].endswith('word1999'))
+        self.assertEqual(split_text('short text', chunk_tokens=500), ['short text'])
+
+    def test_chunks_are_summarized_then_reduced_in_order(self):
+        fake = FakeCompletions()
+
+        summary = MapReduceSummarizer(complete=fake, chunk_tokens=500, max_tokens=500, overlap=0, concurrency=4).summarize(self.text)
+
+        chunk_calls = [call for call in fake.calls if 'one part of a longer' in call[1]]
+        self.assertEqual(len(chunk_calls), len(split_text(self.text, 500)))
+        self.assertEqual(len(fake.calls), len(chunk_calls) + 1)
+        self.assertTrue(summary.startswith('word0 '))
+
+    def test_reduce_runs_several_rounds_when_partials_do_not_fit(self):
+        fake = FakeCompletions(keep=200)
+
+        summary = MapReduceSummarizer(complete=fake, chunk_tokens=300, max_tokens=300, overlap=0).summarize(self.text)
+
+        reduce_calls = [call for call in fake.calls if 'consecutive parts' in call[1]]
+        self.assertGreater(len(reduce_calls), 1)
+        self.assertTrue(summary.startswith('word0 '))
+
+    def test_short_text_is_one_call(self):
+        fake = FakeCompletions()
+
+        MapReduceSummarizer(complete=fake, chunk_tokens=500).summarize('a short lecture')
+
+        self.assertEqual(len(fake.calls), 1)
+
+
+def fake_completion(content):
+    message = mock.Mock()
+    message.content = content
+    return mock.Mock(choices=[mock.Mock(message=message)])
+
+
+class SummaryCacheTests(FakeEncodingMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        reset_cache_stats()
+        patcher = mock.patch('awstranscribe.views.chat_complete', return_value=fake_completion('short summary'))
+        self.chat_complete = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeat_summaries_are_served_from_cache(self):
+        first = self.api.post('/api/summarize/', {'text': 'A lecture  about\ncaching.'}, format='json')
+        second = self.api.post('/api/summarize/', {'text': ' A lecture about caching. '}, format='json')
+
+        self.assertEqual(first.data, {'summary': 'short summary'})
+        self.assertEqual(second.data, {'summary': 'short summary'})
+        self.assertEqual(self.chat_complete.call_count, 1)
+        stats = self.api.get('/api/cache-stats/').data
+        self.assertEqual(stats['summary'], {'hits': 1, 'misses': 1})
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1)
+    def test_file_upload_is_sent_to_openai_from_memory(self):
+        upload = SimpleUploadedFile('notes', b'A lecture.', content_type='text/plain')
+
+        with mock.patch('awstranscribe.views.summarize_with_assistant', return_value='file summary') as summarize:
+            response = self.api.post('/api/summarize-file/', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.data, {'summary': 'file summary'})
+        summarize.assert_called_once_with(b'A lecture.', 'notes.txt')
+
+    @override_settings(SUMMARY_UPLOAD_MAX_BYTES=4)
+    def test_file_upload_over_the_limit_is_refused(self):
+        upload = SimpleUploadedFile('lecture.txt', b'A lecture.', content_type='text/plain')
+
+        with mock.patch('awstranscribe.views.summarize_with_assistant') as summarize:
+            response = self.api.post('/api/summarize-file/', {'file': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, 413)
+        summarize.assert_not_called()
+
+    def test_key_depends_on_model_and_prompt_version(self):
+        self.assertNotEqual(summary_key('text'), summary_key('text', prompt_version=99))
+        self.assertNotEqual(summary_key('text'), summary_key('text', model='other-model'))
+        self.assertEqual(summary_key('some  text'), summary_key('some text\n'))
+
+    @override_settings(OPENAI_RETRY_MAX_DELAY=30)
+    def test_openai_rate_limit_is_answered_with_503(self):
+        self.chat_complete.side_effect = openai_rate_limited()
+
+        response = self.api.post('/api/summarize/', {'text': 'A lecture.'}, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '30')
+
+
+@override_settings(SINGLE_FLIGHT_POLL_INTERVAL=0)
+class SingleFlightTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def work(self):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def run_concurrently(self, count):
+        # The first caller does the work, the others join it before it is allowed to finish
+        def call():
+            try:
+                return single_flight('test:key', self.work)
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(count) as pool:
+            futures = [pool.submit(call) for _ in range(count)]
+            while metrics.singleflight_shared.value(kind='test', scope='process') < count - 1:
+                time.sleep(0.001)
+            self.release.set()
+            return [future.result() for future in futures]
+
+    def test_concurrent_calls_share_one_call(self):
+        self.result = 'transcript'
+
+        results = self.run_concurrently(5)
+
+        self.assertEqual(results, ['transcript'] * 5)
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_calls_share_the_error(self):
+        self.result = RuntimeError('throttled')
+
+        results = self.run_concurrently(3)
+
+        self.assertEqual(results, [self.result] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_concurrent_streams_share_one_stream(self):
+        def stream():
+            self.calls += 1
+            yield 'A short '
+            self.release.wait(5)
+            yield 'summary.'
+
+        leader = single_flight_stream('test:key', stream)
+        self.assertEqual(next(leader), 'A short ')
+        with ThreadPoolExecutor(1) as pool:
+            follower = pool.submit(lambda: list(single_flight_stream('test:key', stream)))
+            while metrics.singleflight_shared.value(kind='test', scope='process') < 1:
+                time.sleep(0.001)
+            self.release.set()
+            self.assertEqual(list(leader), ['summary.'])
+            self.assertEqual(follower.result(), ['A short summary.'])
+        self.assertEqual(self.calls, 1)
+
+    def test_stream_abandoned_by_its_reader_is_done_again(self):
+        def stream():
+            self.calls += 1
+            yield 'A summary.'
+
+        leader = single_flight_stream('test:key', stream)
+        next(leader)
+        leader.close()
+
+        self.assertEqual(list(single_flight_stream('test:key', stream)), ['A summary.'])
+        self.assertEqual(self.calls, 2)
+
+    def test_async_calls_share_one_call(self):
+        async def work():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            return 'summary'
+
+        async def main():
+            return await asyncio.gather(*[asingle_flight('test:key', work) for _ in range(3)])
+
+        self.assertEqual(asyncio.run(main()), ['summary'] * 3)
+        self.assertEqual(self.calls, 1)
+
+    def test_waits_for_another_process_and_uses_its_summary(self):
+        key = summary_key('A lecture.')
+        owner = acquire_lock(f'summary:{key}')
+        put_summary(key, 'cached summary')
+        summarize = mock.Mock(return_value='new summary')
+
+        # The other process finishes on the first poll
+        with mock.patch('awstranscribe.singleflight.lock_held', return_value=False):
+            summary = summarize_once(key, summarize)
+
+        self.assertEqual(summary, 'cached summary')
+        summarize.assert_not_called()
+        self.assertEqual(metrics.singleflight_shared.value(kind='summary', scope='lock'), 1)
+        release_lock(f'summary:{key}', owner)
+
+    def test_does_the_work_when_the_other_process_failed(self):
+        key = summary_key('A lecture.')
+        acquire_lock(f'summary:{key}')
+
+        with mock.patch('awstranscribe.singleflight.lock_held', return_value=False), \
+                mock.patch('awstranscribe.singleflight.acquire_lock', side_effect=[None, 'owner']):
+            summary = summarize_once(key, lambda: 'new summary')
+
+        self.assertEqual(summary, 'new summary')
+
+    def test_expired_lock_is_taken_over(self):
+        with override_settings(SINGLE_FLIGHT_LOCK_TIMEOUT=-1):
+            first = acquire_lock('test:key')
+        self.assertFalse(lock_held('test:key'))
+
+        second = acquire_lock('test:key')
+        release_lock('test:key', first)
+
+        self.assertIsNotNone(second)
+        self.assertTrue(lock_held('test:key'))
+        self.assertIsNone(acquire_lock('test:key'))
+
+
+class TokenCountingTests(FakeEncodingMixin, SimpleTestCase):
+    text = ' '.join(f'word{index % 50}' for index in range(5000))
+
+    def test_encoding_is_loaded_once(self):
+        get_encoding()
+        get_encoding()
+
+        self.assertEqual(tiktoken.get_encoding.call_count, 1)
+
+    def test_segments_cut_before_spaces_and_cover_the_text(self):
+        segments = list(split_for_counting(self.text, segment_size=100))
+
+        self.assertEqual(''.join(segments), self.text)
+        self.assertTrue(all(segment.startswith(' ') for segment in segments[1:]))
+        self.assertTrue(all(len(segment) <= 100 for segment in segments[:-1]))
+
+    def test_segmented_count_matches_single_pass(self):
+        with mock.patch('awstranscribe.utils.TOKEN_COUNT_SEGMENT_SIZE', 100):
+            self.assertEqual(calculate_tokens(self.text), 5000)
+
+    def test_batch_counts_each_text(self):
+        texts = [self.text, 'one two three', '']
+
+        with mock.patch('awstranscribe.utils.TOKEN_COUNT_SEGMENT_SIZE', 100):
+            self.assertEqual(calculate_tokens_batch(texts, num_threads=2), [5000, 3, 0])
+
+
+class ImmediateExecutor:
+
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+
+def openai_not_found():
+    response = httpx.Response(404, request=httpx.Request('GET', 'https://api.openai.com/v1/assistants'))
+    return openai.NotFoundError('No assistant found', response=response, body=None)
+
+
+class ReusableAssistantTests(TestCase):
+
+    def setUp(self):
+        forget_assistant()
+        self.addCleanup(forget_assistant)
+        self.openai = mock.MagicMock()
+        self.openai.upload_txt_file_to_openai.side_effect = lambda name, content: mock.Mock(id=f'file-{content.decode()}')
+        self.openai.create_assistant.side_effect = [mock.Mock(id='asst-1'), mock.Mock(id='asst-2')]
+        self.openai.create_thread.return_value = mock.Mock(
+            id='thread-1', tool_resources=mock.Mock(file_search=mock.Mock(vector_store_ids=['vs-1'])),
+        )
+        self.openai.retrieve_run.return_value = mock.Mock(status='completed')
+        self.openai.get_list_messages.return_value.data[0].content[0].text.value = 'summary'
+        for name in [
+            'upload_txt_file_to_openai', 'create_assistant', 'retrieve_assistant', 'delete_assistant',
+            'create_thread', 'create_message', 'run_thread', 'retrieve_run', 'get_list_messages',
+            'delete_thread', 'delete_txt_file_from_openai', 'delete_vector_store', 'cancel_run',
+        ]:
+            patcher = mock.patch(f'awstranscribe.assistants.{name}', getattr(self.openai, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('awstranscribe.assistants.cleanup_executor', ImmediateExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('awstranscribe.assistants.RUN_POLL_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_assistant_is_created_once_and_request_resources_cleaned_up(self):
+        self.assertEqual(summarize_with_assistant(b'a'), 'summary')
+        self.assertEqual(summarize_with_assistant(b'b'), 'summary')
+
+        self.openai.create_assistant.assert_called_once_with()
+        self.openai.create_thread.assert_called_with(file_id='file-b')
+        self.openai.run_thread.assert_called_with(thread_id='thread-1', assistant_id='asst-1')
+        self.openai.delete_assistant.assert_not_called()
+        self.assertEqual(self.openai.delete_txt_file_from_openai.call_count, 2)
+        self.openai.delete_vector_store.assert_called_with('vs-1')
+        self.assertEqual(OpenAIAssistant.objects.get().assistant_id, 'asst-1')
+
+    def test_every_resource_is_deleted_when_one_deletion_fails(self):
+        self.openai.delete_vector_store.side_effect = openai_not_found()
+
+        with self.assertLogs('awstranscribe.assistants', 'ERROR'):
+            self.assertEqual(summarize_with_assistant(b'a'), 'summary')
+
+        self.openai.delete_vector_store.assert_called_once_with('vs-1')
+        self.openai.delete_thread.assert_called_once_with(thread_id='thread-1')
+        self.openai.delete_txt_file_from_openai.assert_called_once_with(file_id='file-a')
+
+    def test_stored_assistant_is_validated_and_reused(self):
+        OpenAIAssistant.objects.create(key='gpt-4o:v1', assistant_id='asst-stored')
+
+        summarize_with_assistant(b'a')
+
+        self.openai.retrieve_assistant.assert_called_once_with('asst-stored')
+        self.openai.create_assistant.assert_not_called()
+
+    def test_missing_stored_assistant_is_replaced(self):
+        OpenAIAssistant.objects.create(key='gpt-4o:v1', assistant_id='asst-deleted')
+        self.openai.retrieve_assistant.side_effect = openai_not_found()
+
+        summarize_with_assistant(b'a')
+
+        self.openai.run_thread.assert_called_with(thread_id='thread-1', assistant_id='asst-1')
+        self.assertEqual(OpenAIAssistant.objects.get().assistant_id, 'asst-1')
+
+    def test_failed_run_raises_instead_of_polling_forever(self):
+        self.openai.retrieve_run.return_value = mock.Mock(id='run-1', status='expired', last_error=None)
+
+        with self.assertRaisesMessage(AssistantRunError, 'Run run-1 expired'):
+            summarize_with_assistant(b'a')
+
+        self.assertEqual(self.openai.retrieve_run.call_count, 1)
+        self.openai.delete_txt_file_from_openai.assert_called_once()
+
+    @override_settings(OPENAI_RUN_TIMEOUT=0)
+    def test_run_is_cancelled_after_the_timeout(self):
+        self.openai.run_thread.return_value = mock.Mock(id='run-1', status='in_progress')
+
+        with self.assertRaises(AssistantRunError):
+            summarize_with_assistant(b'a')
+
+        self.openai.cancel_run.assert_called_once_with(thread_id='thread-1', run_id='run-1')
+
+
+def openai_rate_limited(retry_after=None, code=None, retry_after_ms=None):
+    headers = {'retry-after': retry_after} if retry_after else {}
+    if retry_after_ms:
+        headers['retry-after-ms'] = retry_after_ms
+    response = httpx.Response(429, headers=headers, request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+    return openai.RateLimitError('Rate limit reached', response=response, body={'code': code} if code else None)
+
+
+@override_settings(OPENAI_RETRY_BASE_DELAY=0, OPENAI_RETRY_MAX_DELAY=0, OPENAI_MAX_ATTEMPTS=3)
+class OpenAIClientTests(SimpleTestCase):
+
+    def setUp(self):
+        reset_openai_clients()
+        self.addCleanup(reset_openai_clients)
+
+    def test_rate_limited_calls_are_retried(self):
+        method = mock.Mock(side_effect=[openai_rate_limited(), openai_rate_limited(), 'completion'])
+
+        self.assertEqual(openai_request(method, model='gpt-4o'), 'completion')
+        self.assertEqual(method.call_count, 3)
+
+    def test_retries_give_up_after_max_attempts(self):
+        method = mock.Mock(side_effect=openai_rate_limited())
+
+        with self.assertRaises(openai.RateLimitError):
+            openai_request(method)
+        self.assertEqual(method.call_count, 3)
+
+    def test_exhausted_quota_and_client_errors_are_not_retried(self):
+        method = mock.Mock(side_effect=[openai_rate_limited(code='insufficient_quota'), openai_not_found()])
+
+        with self.assertRaises(openai.RateLimitError):
+            openai_request(method)
+        with self.assertRaises(openai.NotFoundError):
+            openai_request(method)
+        self.assertEqual(method.call_count, 2)
+
+    @override_settings(OPENAI_RETRY_MAX_DELAY=30)
+    def test_retry_waits_at_least_retry_after(self):
+        self.assertGreaterEqual(retry_delay(openai_rate_limited(retry_after='7'), attempt=1), 7)
+
+    @override_settings(OPENAI_RETRY_MAX_DELAY=30)
+    def test_retry_after_ms_is_read_as_milliseconds(self):
+        self.assertAlmostEqual(retry_delay(openai_rate_limited(retry_after_ms='20000'), attempt=1), 20)
+
+    def test_token_bucket_delays_once_the_quota_is_spent(self):
+        bucket = TokenBucket(per_minute=600)
+
+        self.assertEqual(bucket.reserve(600), 0)
+        # 10 units a second refill, 50 more units are 5 seconds away
+        self.assertAlmostEqual(bucket.reserve(50), 5, delta=0.1)
+        bucket.adjust(50)
+        self.assertAlmostEqual(bucket.reserve(0), 0, delta=0.1)
+
+    @override_settings(OPENAI_MAX_CONCURRENCY=2)
+    def test_concurrency_is_bounded_across_threads(self):
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def method():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda _: openai_request(method), range(12)))
+
+        self.assertEqual(peak[0], 2)
+
+    def test_async_calls_are_retried(self):
+        method = mock.AsyncMock(side_effect=[openai_rate_limited(), 'completion'])
+
+        self.assertEqual(asyncio.run(openai_arequest(method)), 'completion')
+
+    def test_async_call_waits_for_a_thread_to_release_its_slot(self):
+        limit = ConcurrencyLimit(1)
+        limit.acquire()
+
+        async def wait():
+            async with limit:
+                return list(limit.waiters)
+
+        threading.Timer(0.05, limit.release).start()
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(wait()), [])
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        self.assertEqual(limit.available, 1)
+
+    def test_cancelled_async_waiter_does_not_keep_a_slot(self):
+        limit = ConcurrencyLimit(1)
+
+        async def cancel_waiter():
+            await limit.aacquire()
+            waiter = asyncio.create_task(limit.aacquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            limit.release()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            await asyncio.sleep(0)
+
+        asyncio.run(cancel_waiter())
+        self.assertEqual(limit.available, 1)
+        self.assertFalse(limit.waiters)
+
+
+class StreamingSummaryTests(FakeEncodingMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        patcher = mock.patch('awstranscribe.summarize.chat_complete_stream', return_value=iter(['A short ', 'summary.']))
+        self.stream = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def events(self, response):
+        body = b''.join(response.streaming_content).decode('utf-8')
+        events = []
+        for block in body.split('\n\n'):
+            lines = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+            if lines:
+                events.append((lines['event'], json.loads(lines['data'])))
+        return events
+
+    def test_summary_is_streamed_as_server_sent_events(self):
+        response = self.api.post('/api/summarize/?stream=true', {'text': 'A lecture.'}, format='json', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(self.events(response), [
+            ('delta', {'delta': 'A short '}),
+            ('delta', {'delta': 'summary.'}),
+            ('done', {'summary': 'A short summary.'}),
+        ])
+
+    def test_streamed_summary_is_cached(self):
+        self.events(self.api.post('/api/summarize/?stream=true', {'text': 'A lecture.'}, format='json'))
+
+        response = self.api.post('/api/summarize/', {'text': 'A lecture.'}, format='json', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(self.events(response)[-1], ('done', {'summary': 'A short summary.'}))
+        self.assertEqual(self.stream.call_count, 1)
+
+    @override_settings(SUMMARY_CHUNK_TOKENS=500)
+    def test_streamed_summary_is_split_like_the_json_one(self):
+        # Under SUMMARY_MAX_TOKENS, one completion of the whole text whether streamed or not
+        text = ' '.join(f'word{index}' for index in range(2000))
+
+        with mock.patch('awstranscribe.summarize.complete_text') as complete:
+            self.events(self.api.post('/api/summarize/?stream=true', {'text': text}, format='json'))
+
+        complete.assert_not_called()
+        self.assertEqual(self.stream.call_args[0][0], text)
+
+    def test_file_upload_can_stream(self):
+        upload = SimpleUploadedFile('lecture.txt', b'A lecture.', content_type='text/plain')
+
+        response = self.api.post('/api/summarize-file/?stream=true', {'file': upload}, format='multipart')
+
+        self.assertEqual(self.events(response)[-1], ('done', {'summary': 'A short summary.'}))
+
+    def test_errors_before_streaming_are_regular_responses(self):
+        response = self.api.post('/api/summarize/', {}, format='json', HTTP_ACCEPT='text/event-stream')
+
+        self.assertEqual(response.status_code, 400)
+
+
+async def run_inline(func, *args, **kwargs):
+    # Runs blocking calls on the test thread so they see the test transaction
+    return await sync_to_async(func)(*args, **kwargs)
+
+
+class AsyncViewTests(FakeEncodingMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        token = Token.objects.create(user=User.objects.create_user('alice', password='secret'))
+        self.headers = {'Authorization': f'Token {token.key}'}
+        patcher = mock.patch('awstranscribe.async_views.run_blocking', run_inline)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_summarize_requires_token(self):
+        response = await self.async_client.post('/api/async/summarize/', {'text': 'A lecture.'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 401)
+
+    async def test_summarize_uses_async_completion_and_cache(self):
+        with mock.patch('awstranscribe.summarize.acomplete_text', new_callable=mock.AsyncMock) as complete:
+            complete.return_value = 'A summary.'
+            first = await self.async_client.post(
+                '/api/async/summarize/', {'text': 'A lecture.'}, content_type='application/json', headers=self.headers)
+            second = await self.async_client.post(
+                '/api/async/summarize/', {'text': 'A  lecture.'}, content_type='application/json', headers=self.headers)
+
+        self.assertEqual(first.json(), {'summary': 'A summary.'})
+        self.assertEqual(second.json(), {'summary': 'A summary.'})
+        self.assertEqual(complete.await_count, 1)
+
+    async def test_streamed_summary_starts_before_the_completion_finishes(self):
+        release = threading.Event()
+        finished = []
+
+        def stream(text, instructions):
+            yield 'A short '
+            release.wait(5)
+            finished.append(True)
+            yield 'summary.'
+
+        with mock.patch('awstranscribe.summarize.chat_complete_stream', stream):
+            response = await self.async_client.post(
+                '/api/async/summarize/?stream=true', {'text': 'A lecture.'}, content_type='application/json', headers=self.headers)
+            chunks = response.__aiter__()
+            self.assertEqual(await anext(chunks), b': stream opened\n\n')
+            first = await anext(chunks)
+            self.assertFalse(finished)
+            release.set()
+            rest = [chunk async for chunk in chunks]
+
+        self.assertTrue(response.is_async)
+        self.assertIn(b'A short ', first)
+        self.assertIn(b'"summary": "A short summary."', rest[-1])
+
+    async def test_summarize_rejects_missing_text(self):
+        response = await self.async_client.post(
+            '/api/async/summarize/', {}, content_type='application/json', headers=self.headers)
+
+        self.assertEqual(response.status_code, 400)
+
+    async def test_transcribe_matches_sync_view(self):
+        with mock.patch('awstranscribe.engines.get_transcribe_client', return_value=StubTranscribeClient()), \
+                mock.patch('awstranscribe.views.ensure_poller'):
+            response = await self.async_client.post(
+                '/api/async/transcribe/', {'s3_url': 'https://media.s3.amazonaws.com/lecture.mp4'},
+                content_type='application/json', headers=self.headers,
+            )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'IN_PROGRESS')
+        self.assertTrue(await TranscriptionJob.objects.filter(job_name=response.json()['job_id']).aexists())
+
+    async def test_async_map_reduce_matches_threaded_one(self):
+        text = ' '.join(f'word{index}' for index in range(2000))
+        fake = FakeCompletions(keep=200)
+
+        async def complete(text, instructions):
+            return fake(text, instructions)
+
+        summary = await AsyncMapReduceSummarizer(complete=complete, chunk_tokens=300, max_tokens=300, overlap=0).summarize(text)
+
+        self.assertEqual(summary, MapReduceSummarizer(complete=FakeCompletions(keep=200), chunk_tokens=300, max_tokens=300, overlap=0).summarize(text))
+
+    async def test_async_map_reduce_tokenizes_off_the_event_loop(self):
+        text = ' '.join(f'word{index}' for index in range(2000))
+        fake = FakeCompletions(keep=200)
+        loop_thread = threading.get_ident()
+        threads = set()
+
+        async def complete(text, instructions):
+            return fake(text, instructions)
+
+        def counted(text):
+            threads.add(threading.get_ident())
+            return calculate_tokens(text)
+
+        with mock.patch('awstranscribe.summarize.calculate_tokens', side_effect=counted):
+            await AsyncMapReduceSummarizer(complete=complete, chunk_tokens=300, max_tokens=300, overlap=0).summarize(text)
+
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+
+@override_settings(BACKGROUND_JOB_RETRY_DELAY=60, TRANSCRIBE_POLLER_AUTOSTART=False)
+class BackgroundJobTests(FakeEncodingMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+
+    def work(self):
+        return [run_job(job, 'test-worker') for job in claim_jobs('test-worker', 10)]
+
+    def test_queued_summary_is_run_by_worker(self):
+        response = self.api.post('/api/summarize/?queue=true', {'text': 'A lecture.'}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'queued')
+        with mock.patch('awstranscribe.summarize.complete_text', return_value='A summary.'):
+            self.work()
+
+        response = self.api.get(f"/api/jobs/{response.data['job_id']}/")
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(response.data['result'], {'summary': 'A summary.'})
+        self.assertEqual(len(response.data['attempts']), 1)
+        self.assertIsNotNone(response.data['attempts'][0]['duration_ms'])
+        self.assertEqual(self.api.post('/api/summarize/', {'text': 'A lecture.'}, format='json').data, {'summary': 'A summary.'})
+
+    def transcript_job(self, status):
+        patcher = mock.patch.object(
+            AwsTranscribeEngine, 'open_transcript', return_value=([json.dumps(SPEAKER_TRANSCRIPT).encode()], '"etag"'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return TranscriptionJob.objects.create(
+            job_name='TranscriptionJob_abc', s3_url='https://media.s3.amazonaws.com/a.mp4',
+            status=status, transcript_key='TranscriptionJob_abc.json',
+        )
+
+    @override_settings(TRANSCRIPT_AUTO_SUMMARIZE=True)
+    def test_completed_transcript_is_summarized_by_worker(self):
+        job = self.transcript_job(TranscriptionJob.IN_PROGRESS)
+        self.assertEqual(self.api.get('/api/transcribe/TranscriptionJob_abc/summary/').status_code, 202)
+
+        mark_job_completed(job, 'TranscriptionJob_abc.json')
+        mark_job_completed(job, 'TranscriptionJob_abc.json')
+        self.assertEqual(BackgroundJob.objects.filter(kind='summarize_transcript').count(), 1)
+        with mock.patch('awstranscribe.summarize.complete_text', return_value='A summary.') as complete:
+            self.work()
+            response = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary'], 'A summary.')
+        complete.assert_called_once()
+        self.assertEqual(complete.call_args[0][0], 'Good morning. How are you? Fine thanks')
+
+    def test_auto_summarized_transcript_is_not_summarized_in_the_request(self):
+        self.transcript_job(TranscriptionJob.COMPLETED)
+
+        with mock.patch('awstranscribe.summarize.complete_text') as complete:
+            first = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/')
+            second = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/')
+
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+        complete.assert_not_called()
+
+    def test_unique_key_allows_one_pending_job(self):
+        first = enqueue('summarize_transcript', {'job_name': 'a'}, unique_key='summarize_transcript:a')
+        again = enqueue('summarize_transcript', {'job_name': 'a'}, unique_key='summarize_transcript:a')
+        self.assertEqual(again.pk, first.pk)
+        # What a concurrent caller that found nothing pending ends up doing
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BackgroundJob.objects.create(kind='summarize_transcript', run_after=timezone.now(), unique_key='summarize_transcript:a')
+
+        BackgroundJob.objects.filter(pk=first.pk).update(status=BackgroundJob.SUCCEEDED)
+        self.assertNotEqual(enqueue('summarize_transcript', unique_key='summarize_transcript:a').pk, first.pk)
+
+    @override_settings(TRANSCRIPT_AUTO_SUMMARIZE=False)
+    def test_transcript_summary_is_made_on_first_request(self):
+        self.transcript_job(TranscriptionJob.COMPLETED)
+
+        with mock.patch('awstranscribe.summarize.complete_text', return_value='A summary.') as complete:
+            first = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/')
+            second = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/')
+
+        self.assertEqual((first.data['summary'], second.data['summary']), ('A summary.', 'A summary.'))
+        self.assertEqual(complete.call_count, 1)
+        self.assertFalse(BackgroundJob.objects.exists())
+
+    def test_queued_transcript_summary_is_enqueued_once(self):
+        self.transcript_job(TranscriptionJob.COMPLETED)
+
+        first = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/?queue=true')
+        second = self.api.get('/api/transcribe/TranscriptionJob_abc/summary/?queue=true')
+
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+        self.assertFalse(TranscriptSummary.objects.exists())
+
+    def test_queued_transcription_is_started_by_worker(self):
+        transcribe = StubTranscribeClient()
+        response = self.api.post('/api/transcribe/?queue=true', {'s3_url': 'https://media.s3.amazonaws.com/lecture.mp4'}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(TranscriptionJob.objects.exists())
+        with mock.patch('awstranscribe.engines.get_transcribe_client', return_value=transcribe):
+            job, = self.work()
+
+        self.assertEqual(job.result['status'], 'IN_PROGRESS')
+        self.assertTrue(TranscriptionJob.objects.filter(job_name=job.result['job_id'], status='IN_PROGRESS').exists())
+        self.assertEqual([call[0] for call in transcribe.calls], ['get', 'start'])
+
+    def test_failed_job_is_retried_with_backoff_then_fails(self):
+        handler = mock.Mock(side_effect=RuntimeError('throttled'))
+        # Loads the real handlers first, patch.dict would drop them again
+        get_handler('summarize')
+        with mock.patch.dict(_handlers, {'flaky': handler}):
+            job = enqueue('flaky', max_attempts=2)
+
+            job, = self.work()
+            self.assertEqual(job.status, BackgroundJob.QUEUED)
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(self.work(), [])
+
+            BackgroundJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            job, = self.work()
+
+        self.assertEqual(job.status, BackgroundJob.FAILED)
+        self.assertEqual(job.error, 'RuntimeError: throttled')
+        self.assertEqual(job.attempt_set.count(), 2)
+        self.assertEqual(handler.call_count, 2)
+
+    def test_unknown_kind_is_not_retried(self):
+        enqueue('missing')
+
+        job, = self.work()
+
+        self.assertEqual(job.status, BackgroundJob.FAILED)
+
+    def test_job_is_claimed_once(self):
+        enqueue('summarize', {'text': 'A lecture.'})
+
+        self.assertEqual(len(claim_jobs('worker-1', 10)), 1)
+        self.assertEqual(claim_jobs('worker-2', 10), [])
+
+    @override_settings(BACKGROUND_JOB_TIMEOUT=0)
+    def test_jobs_of_dead_workers_are_requeued(self):
+        job = enqueue('summarize', {'text': 'A lecture.'})
+        claim_jobs('dead-worker', 10)
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, BackgroundJob.QUEUED)
+        self.assertEqual(job.attempts, 1)
+
+
+@override_settings(
+    TRANSCRIBE_POLLER_AUTOSTART=False,
+    AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS='transcripts',
+    TRANSCRIBE_EVENTS_SECRET='s3cret',
+)
+class TranscriptionEventTests(TestCase):
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.transcribe = StubTranscribeClient()
+        patcher = mock.patch('awstranscribe.engines.get_transcribe_client', return_value=self.transcribe)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job_ids = [
+            self.api.post('/api/transcribe/', {'s3_url': f'https://media.s3.amazonaws.com/{index}.mp4'}, format='json').data['job_id']
+            for index in range(3)
+        ]
+        self.transcribe.calls.clear()
+
+    def post_event(self, payload, secret='s3cret'):
+        return APIClient().post(
+            f'/api/transcribe/events/?secret={secret}', json.dumps(payload), content_type='text/plain',
+        )
+
+    def status(self, job_id):
+        return TranscriptionJob.objects.get(job_name=job_id).status
+
+    def test_s3_object_created_completes_job_without_aws_calls(self):
+        job_id = self.job_ids[0]
+        record = {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+                  's3': {'bucket': {'name': 'transcripts'}, 'object': {'key': f'{job_id}.json'}}}
+
+        response = self.post_event({'Records': [record]})
+
+        self.assertEqual(response.data, {'updated': [job_id]})
+        job = TranscriptionJob.objects.get(job_name=job_id)
+        self.assertEqual((job.status, job.transcript_key), ('COMPLETED', f'{job_id}.json'))
+        self.assertEqual(self.transcribe.calls, [])
+
+    def test_sns_wrapped_eventbridge_failure(self):
+        job_id = self.job_ids[1]
+        event = {'source': 'aws.transcribe', 'detail-type': 'Transcribe Job State Change',
+                 'detail': {'TranscriptionJobName': job_id, 'TranscriptionJobStatus': 'FAILED', 'FailureReason': 'Bad media'}}
+
+        response = self.post_event({'Type': 'Notification', 'Message': json.dumps(event)})
+
+        self.assertEqual(response.data, {'updated': [job_id]})
+        self.assertEqual(TranscriptionJob.objects.get(job_name=job_id).failure_reason, 'Bad media')
+
+    def test_eventbridge_completion_fetches_transcript_location(self):
+        job_id = self.job_ids[2]
+        self.transcribe.complete(job_id)
+        event = {'source': 'aws.transcribe', 'detail-type': 'Transcribe Job State Change',
+                 'detail': {'TranscriptionJobName': job_id, 'TranscriptionJobStatus': 'COMPLETED'}}
+
+        self.post_event(event)
+
+        self.assertEqual(self.status(job_id), 'COMPLETED')
+        self.assertEqual(self.transcribe.calls, [('get', job_id)])
+
+    def test_unknown_objects_are_ignored(self):
+        record = {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+                  's3': {'bucket': {'name': 'transcripts'}, 'object': {'key': '.write_access_check_file.temp'}}}
+
+        self.assertEqual(self.post_event({'Records': [record]}).data, {'updated': []})
+
+    def test_wrong_or_missing_secret_is_rejected(self):
+        self.assertEqual(self.post_event({'Records': []}, secret='guess').status_code, 403)
+        with override_settings(TRANSCRIBE_EVENTS_SECRET=''):
+            self.assertEqual(self.post_event({'Records': []}, secret='').status_code, 403)
+
+    def test_poller_lists_jobs_instead_of_fetching_each(self):
+        poller = TranscriptionPoller(client_factory=lambda: self.transcribe)
+
+        self.assertEqual(poller.poll_once(), 3)
+        self.assertEqual(poller.changed, 0)
+        self.assertEqual({call[0] for call in self.transcribe.calls}, {'list'})
+
+        self.transcribe.complete(self.job_ids[0])
+        self.transcribe.calls.clear()
+        poller.poll_once()
+
+        self.assertEqual(poller.changed, 1)
+        self.assertEqual(self.status(self.job_ids[0]), 'COMPLETED')
+        self.assertEqual([call for call in self.transcribe.calls if call[0] != 'list'], [('get', self.job_ids[0])])
+
+    def test_poller_backs_off_until_woken(self):
+        poller = TranscriptionPoller(interval=1, max_interval=4, client_factory=lambda: self.transcribe)
+        poller._wake_event = mock.Mock()
+        poller._wake_event.wait.side_effect = lambda timeout: poller.stop() if timeout >= 4 else None
+
+        # Run on the test's own thread, whose connection holds the test transaction
+        with mock.patch('awstranscribe.jobs.close_old_connections'):
+            poller.run()
+
+        self.assertEqual([call.args[0] for call in poller._wake_event.wait.call_args_list], [2, 4])
+        poller.wake()
+        self.assertEqual(poller.current_interval, 1)
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False, TRANSCRIBE_MAX_CONCURRENT_JOBS=2)
+class TranscriptionBatchTests(TestCase):
+    urls = [f'https://media.s3.amazonaws.com/lecture-{index}.mp4' for index in range(5)]
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        self.transcribe = StubTranscribeClient()
+        self.poller = TranscriptionPoller(client_factory=lambda: self.transcribe)
+
+    def statuses(self, batch_id):
+        return self.api.get(f'/api/transcribe/batch/{batch_id}/').data['counts']
+
+    def test_batch_is_recorded_without_aws_calls_and_deduplicated(self):
+        response = self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls + self.urls[:2]}, format='json')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.data['items']), 5)
+        self.assertEqual(response.data['counts'], {'WAITING': 5})
+        self.assertEqual(self.transcribe.calls, [])
+
+        again = self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls[:1]}, format='json')
+        self.assertEqual(again.data['items'][0]['job_id'], TranscriptionJob.objects.get(s3_url=self.urls[0]).job_name)
+        self.assertEqual(TranscriptionJob.objects.count(), 5)
+
+    def test_poller_submits_within_concurrency_limit(self):
+        batch_id = self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls}, format='json').data['batch_id']
+
+        self.poller.poll_once()
+        self.assertEqual(self.statuses(batch_id), {'IN_PROGRESS': 2, 'WAITING': 3})
+
+        self.poller.poll_once()
+        self.assertEqual(self.statuses(batch_id), {'IN_PROGRESS': 2, 'WAITING': 3})
+
+        self.transcribe.complete(TranscriptionJob.objects.filter(status='IN_PROGRESS').first().job_name)
+        self.poller.poll_once()
+        self.poller.poll_once()
+        self.assertEqual(self.statuses(batch_id), {'COMPLETED': 1, 'IN_PROGRESS': 2, 'WAITING': 2})
+
+    def test_quota_errors_keep_jobs_waiting(self):
+        self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls[:1], 'job_type': 'medical'}, format='json')
+        error = ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'Too many jobs'}}, 'StartMedicalTranscriptionJob')
+
+        with mock.patch.object(self.transcribe, 'start_medical_transcription_job', side_effect=error):
+            self.poller.poll_once()
+
+        job = TranscriptionJob.objects.get()
+        self.assertEqual((job.job_type, job.status), (TranscriptionJob.MEDICAL, TranscriptionJob.WAITING))
+        self.poller.poll_once()
+        self.assertEqual(TranscriptionJob.objects.get().status, TranscriptionJob.IN_PROGRESS)
+
+    def test_invalid_batches_are_rejected(self):
+        for body in [{}, {'s3_urls': []}, {'s3_urls': 'one.mp4'}, {'s3_urls': self.urls, 'job_type': 'legal'}]:
+            self.assertEqual(self.api.post('/api/transcribe/batch/', body, format='json').status_code, 400)
+
+    def test_job_started_elsewhere_meanwhile_is_recorded(self):
+        self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls[:1]}, format='json')
+        name = TranscriptionJob.objects.get().job_name
+        start = self.transcribe.start_transcription_job
+
+        def conflict(**kwargs):
+            # Another process started it between our lookup and start
+            start(**kwargs)
+            raise ClientError({'Error': {'Code': 'ConflictException', 'Message': 'Job exists'}}, 'StartTranscriptionJob')
+
+        with mock.patch.object(self.transcribe, 'start_transcription_job', side_effect=conflict):
+            self.poller.poll_once()
+
+        self.assertEqual(TranscriptionJob.objects.get().status, TranscriptionJob.IN_PROGRESS)
+        self.assertEqual(self.transcribe.calls[:3], [('get', name), ('start', name), ('get', name)])
+
+    def test_abandoned_submissions_are_tried_again(self):
+        self.api.post('/api/transcribe/batch/', {'s3_urls': self.urls[:1]}, format='json')
+        TranscriptionJob.objects.update(status=TranscriptionJob.SUBMITTING, updated_at=timezone.now() - datetime.timedelta(minutes=10))
+
+        self.poller.poll_once()
+
+        self.assertEqual(TranscriptionJob.objects.get().status, TranscriptionJob.IN_PROGRESS)
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False)
+class ConcurrentBatchTests(TransactionTestCase):
+    # Real transactions: each request runs on its own thread and database connection
+
+    def test_overlapping_batches_posted_concurrently(self):
+        User.objects.create_user('alice', password='secret')
+        urls = [f'https://media.s3.amazonaws.com/lecture-{index}.mp4' for index in range(8)]
+        bodies = [{'s3_urls': urls[index:index + 4]} for index in range(0, 5) for _ in range(4)]
+
+        def post(body):
+            api = APIClient()
+            api.force_authenticate(User.objects.get(username='alice'))
+            try:
+                return api.post('/api/transcribe/batch/', body, format='json')
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(post, bodies))
+
+        self.assertEqual([response.status_code for response in responses], [202] * len(bodies))
+        self.assertEqual(TranscriptionJob.objects.count(), len(urls))
+        for body, response in zip(bodies, responses):
+            self.assertEqual(response.data['counts'], {'WAITING': 4})
+            self.assertEqual(
+                sorted(item['job_id'] for item in response.data['items']),
+                sorted(TranscriptionJob.objects.filter(s3_url__in=body['s3_urls']).values_list('job_name', flat=True)),
+            )
+
+
+@override_settings(TRANSCRIBE_POLLER_AUTOSTART=False, TRANSCRIBE_MAX_CONCURRENT_JOBS=10)
+class ConcurrentPollerTests(TransactionTestCase):
+    # Real transactions: the pollers run on their own threads and database connections
+
+    def test_concurrent_pollers_submit_each_job_once(self):
+        urls = [f'https://media.s3.amazonaws.com/lecture-{index}.mp4' for index in range(5)]
+        api = APIClient()
+        api.force_authenticate(User.objects.create_user('alice', password='secret'))
+        api.post('/api/transcribe/batch/', {'s3_urls': urls}, format='json')
+        transcribe = StubTranscribeClient()
+        start = transcribe.start_transcription_job
+        started, release = threading.Event(), threading.Event()
+
+        def slow_start(**kwargs):
+            started.set()
+            release.wait(5)
+            return start(**kwargs)
+
+        def poll():
+            try:
+                TranscriptionPoller(client_factory=lambda: transcribe).poll_once()
+            finally:
+                connection.close()
+
+        with mock.patch.object(transcribe, 'start_transcription_job', side_effect=slow_start):
+            first = threading.Thread(target=poll)
+            first.start()
+            self.assertTrue(started.wait(5))
+            # The second poller runs while the first one is still submitting
+            TranscriptionPoller(client_factory=lambda: transcribe).poll_once()
+            release.set()
+            first.join(5)
+
+        starts = [name for call, name in transcribe.calls if call == 'start']
+        self.assertEqual(sorted(starts), sorted(TranscriptionJob.objects.values_list('job_name', flat=True)))
+        self.assertEqual(set(TranscriptionJob.objects.values_list('status', flat=True)), {TranscriptionJob.IN_PROGRESS})
@@ -0,0 +1,202 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .cache import get_transcript_entry, put_transcript
+from .engines import TRANSCRIPT_CHUNK_SIZE, get_engine
+from .jsonstream import iter_paths
+from .models import CompactTranscript, TranscriptionJob, TranscriptSegment
+from .singleflight import single_flight
+
+# A segment ends at a speaker change, at the end of a sentence, or once it spans this many seconds
+SEGMENT_MAX_SECONDS = 30
+SENTENCE_END = ('.', '?', '!')
+
+
+def read_transcript(job):
+    # The raw Transcribe JSON text of a completed job and its ETag, from the local cache when possible
+    entry = get_transcript_entry(job.job_name)
+    if entry is not None:
+        content, etag = entry.content, entry.etag
+    else:
+        # Downloaded once for concurrent requests of the same job
+        lookup = (lambda: _cached_transcript(job)) if settings.TRANSCRIPT_CACHE_ENABLED else None
+        content, etag = single_flight(f'transcript:{job.job_name}', lambda: _download_transcript(job), lookup)
+    remember_etag(job, etag)
+    return content, etag
+
+
+def _download_transcript(job):
+    content, etag = get_engine(job.job_type).read_transcript(job.transcript_key)
+    put_transcript(job.job_name, content, etag)
+    return content, etag
+
+
+def _cached_transcript(job):
+    entry = get_transcript_entry(job.job_name)
+    return None if entry is None else (entry.content, entry.etag)
+
+
+def remember_etag(job, etag):
+    # Kept on the job, so conditional requests are answered without reading the transcript
+    if etag and etag != job.transcript_etag:
+        job.transcript_etag = etag
+        TranscriptionJob.objects.filter(pk=job.pk).update(transcript_etag=etag)
+
+
+# The parts of Transcribe output the compact form is built from, by what they are used for
+TRANSCRIPT_PATHS = {
+    ('results', 'transcripts', '*', 'transcript'): 'text',
+    ('results', 'speaker_labels', 'segments', '*', 'items', '*'): 'speaker',
+    ('results', 'items', '*'): 'item',
+}
+
+
+def compact_transcript(data):
+    """Reduces Transcribe output to ``{'text', 'duration', 'segments'}``.
+
+    Each segment is ``{'start', 'end', 'speaker', 'text'}`` with times in seconds. The per-word
+    items, their alternatives and confidences are dropped.
+    """
+    results = data.get('results', {})
+    texts = [transcript['transcript'] for transcript in results.get('transcripts', [])]
+    speakers = {}
+    for turn in results.get('speaker_labels', {}).get('segments', []):
+        for item in turn.get('items', []):
+            speakers[item['start_time']] = item['speaker_label']
+    return _compact(texts, speakers, [_word(item) for item in results.get('items', [])])
+
+
+def compact_transcript_stream(chunks):
+    # compact_transcript() for the JSON as an iterable of chunks, without ever holding the whole
+    # document. Words are segmented as they are parsed: Transcribe writes `speaker_labels` ahead of
+    # `items` (and current output labels every item too), so speakers are known by then
+    texts, speakers = [], {}
+
+    def words():
+        for path, value in iter_paths(chunks, TRANSCRIPT_PATHS):
+            used_for = TRANSCRIPT_PATHS[path]
+            if used_for == 'text':
+                texts.append(value)
+            elif used_for == 'speaker':
+                speakers[value['start_time']] = value['speaker_label']
+            else:
+                yield _word(value)
+
+    return _compact(texts, speakers, words())
+
+
+def _word(item):
+    # (content, start_time, end_time, speaker_label), start_time is None for punctuation
+    content = item['alternatives'][0]['content'] if item.get('alternatives') else ''
+    if item.get('type') == 'punctuation':
+        return content, None, None, None
+    return content, item['start_time'], item['end_time'], item.get('speaker_label')
+
+
+def _compact(texts, speakers, words):
+    segments = []
+    current = None
+
+    def close(segment):
+        # Only the joined text is kept of a finished segment
+        segment['text'] = ' '.join(segment.pop('words'))
+        segments.append(segment)
+
+    for content, start_time, end_time, speaker in words:
+        if start_time is None:
+            if current is not None:
+                current['words'][-1] += content
+                if content in SENTENCE_END:
+                    close(current)
+                    current = None
+            continue
+        start, end = float(start_time), float(end_time)
+        speaker = speaker or speakers.get(start_time, '')
+        if current is not None and (speaker != current['speaker'] or start - current['start'] >= SEGMENT_MAX_SECONDS):
+            close(current)
+            current = None
+        if current is None:
+            current = {'start': start, 'end': end, 'speaker': speaker, 'words': []}
+        current['words'].append(content)
+        current['end'] = end
+    if current is not None:
+        close(current)
+
+    if texts:
+        text = ' '.join(texts)
+    else:
+        text = ' '.join(segment['text'] for segment in segments)
+    return {'text': text, 'duration': segments[-1]['end'] if segments else 0, 'segments': segments}
+
+
+def open_transcript(job):
+    """The raw transcript of a completed job as ``(chunks of UTF-8 bytes, etag)``.
+
+    The cached copy when there is one, else streamed from the engine. Unlike read_transcript()
+    nothing is cached, so the transcript is never held whole.
+    """
+    entry = get_transcript_entry(job.job_name)
+    if entry is not None:
+        content = entry.content
+        chunks = (content[start:start + TRANSCRIPT_CHUNK_SIZE].encode('utf-8') for start in range(0, len(content), TRANSCRIPT_CHUNK_SIZE))
+        etag = entry.etag
+    else:
+        chunks, etag = get_engine(job.job_type).open_transcript(job.transcript_key)
+    remember_etag(job, etag)
+    return chunks, etag
+
+
+def get_compact_transcript(job):
+    # Built from the raw transcript on first use, every later request only reads the compact rows
+    compact = CompactTranscript.objects.filter(job=job).first()
+    if compact is not None:
+        return compact
+    # Compacted once for concurrent requests, the others read the stored rows
+    compact = single_flight(
+        f'compact:{job.job_name}',
+        lambda: _compact_job(job),
+        lambda: CompactTranscript.objects.filter(job=job).first(),
+    )
+    if not job.transcript_etag:
+        # Learnt by the request that compacted the transcript
+        job.refresh_from_db(fields=['transcript_etag'])
+    return compact
+
+
+def _compact_job(job):
+    chunks, etag = open_transcript(job)
+    return store_compact_transcript(job, chunks)
+
+
+def store_compact_transcript(job, chunks):
+    source_size = 0
+
+    def counted():
+        nonlocal source_size
+        for chunk in chunks:
+            source_size += len(chunk)
+            yield chunk
+
+    compact = compact_transcript_stream(counted())
+    try:
+        with transaction.atomic():
+            transcript = CompactTranscript.objects.create(
+                job=job, text=compact['text'], duration=compact['duration'], source_size=source_size,
+            )
+            TranscriptSegment.objects.bulk_create(
+                [TranscriptSegment(transcript=transcript, **segment) for segment in compact['segments']], batch_size=500,
+            )
+    except IntegrityError:
+        # Another request compacted the same transcript first
+        return CompactTranscript.objects.get(job=job)
+    return transcript
+
+
+def segments_between(transcript, start=None, end=None):
+    # Segments overlapping [start, end), either bound may be left open
+    segments = transcript.segments.all()
+    if start is not None:
+        segments = segments.filter(end__gt=start)
+    if end is not None:
+        segments = segments.filter(start__lt=end)
+    return segments
@@ -0,0 +1,214 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+
+from .aws import get_client
+
+# S3 rejects multipart parts smaller than 5 MiB, except for the last one, and more than 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+
+class S3MultipartUpload:
+    """Uploads a byte stream to S3 as it is written, in parts uploaded concurrently.
+
+    At most ``concurrency`` parts are in flight and one part is being filled, so memory
+    stays around ``(concurrency + 1) * part_size`` whatever the file size. Objects smaller
+    than one part are sent with a single ``put_object``.
+    """
+
+    def __init__(self, s3_client, bucket, key, content_type=None, part_size=None, concurrency=None):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type or 'application/octet-stream'
+        self.part_size = max(part_size or settings.AWS_S3_MULTIPART_PART_SIZE, MIN_PART_SIZE)
+        self.concurrency = concurrency or settings.AWS_S3_MULTIPART_CONCURRENCY
+        self.upload_id = None
+        self.size = 0
+        self._buffer = bytearray()
+        self._futures = []
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self.size += len(data)
+        try:
+            while len(self._buffer) >= self.part_size:
+                part = bytes(self._buffer[:self.part_size])
+                del self._buffer[:self.part_size]
+                self._submit_part(part)
+        except Exception:
+            self.abort()
+            raise
+
+    def complete(self):
+        try:
+            if self.upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer), ContentType=self.content_type)
+                self._buffer = bytearray()
+                return
+            if self._buffer:
+                self._submit_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            parts = sorted((future.result() for future in self._futures), key=lambda part: part['PartNumber'])
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': parts},
+            )
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._shutdown()
+
+    def abort(self):
+        self._shutdown(cancel=True)
+        if self.upload_id is not None:
+            upload_id, self.upload_id = self.upload_id, None
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+
+    def _submit_part(self, data):
+        if self.upload_id is None:
+            created = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, ContentType=self.content_type)
+            self.upload_id = created['UploadId']
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='s3-multipart')
+        # Fail fast instead of streaming the rest of the body into a broken upload
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        # Blocks the reader while all workers are busy, which bounds memory
+        self._slots.acquire()
+        part_number = len(self._futures) + 1
+        future = self._executor.submit(self._upload_part, part_number, data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, data):
+        uploaded = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {'PartNumber': part_number, 'ETag': uploaded['ETag']}
+
+    def _shutdown(self, cancel=False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=cancel)
+            self._executor = None
+
+
+class S3UploadedFile(UploadedFile):
+    # Stands in request.FILES for a file that already lives in S3, there is no local content
+
+    def __init__(self, bucket, key, content_type, size, charset=None, content_type_extra=None):
+        super().__init__(None, key, content_type, size, charset, content_type_extra)
+        self.bucket = bucket
+        self.key = key
+
+    def open(self, mode=None):
+        raise ValueError("The file was streamed to S3 and has no local content.")
+
+    def close(self):
+        pass
+
+
+class S3MultipartUploadHandler(FileUploadHandler):
+    """Upload handler piping request body chunks straight into an S3 multipart upload.
+
+    Nothing is spooled to disk or kept in memory beyond the parts in flight.
+    """
+
+    def __init__(self, request=None, bucket=None, part_size=None, concurrency=None):
+        super().__init__(request)
+        self.bucket = bucket or settings.AWS_STORAGE_BUCKET_NAME
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.upload = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.upload = S3MultipartUpload(
+            get_client('s3'),
+            self.bucket,
+            self.file_name,
+            content_type=self.content_type,
+            part_size=self.part_size,
+            concurrency=self.concurrency,
+        )
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.upload.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.upload.complete()
+        uploaded = S3UploadedFile(
+            self.bucket,
+            self.upload.key,
+            self.content_type,
+            self.upload.size,
+            self.charset,
+            self.content_type_extra,
+        )
+        self.upload = None
+        return uploaded
+
+    def upload_interrupted(self):
+        self.abort()
+
+    def abort(self):
+        if self.upload is not None:
+            self.upload.abort()
+            self.upload = None
+
+
+class BoundedMemoryUploadHandler(FileUploadHandler):
+    """Upload handler keeping files in memory whatever their size, up to ``max_bytes`` each.
+
+    Django's default handlers spill files over FILE_UPLOAD_MAX_MEMORY_SIZE to a temporary file.
+    A larger file is skipped, the rest of the body is read and dropped, and ``too_large`` is set.
+    """
+
+    def __init__(self, request=None, max_bytes=None):
+        super().__init__(request)
+        self.max_bytes = max_bytes
+        self.too_large = False
+        self.file = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = BytesIO()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.max_bytes:
+            self.too_large = True
+            self.file = None
+            raise SkipFile()
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.file.seek(0)
+        uploaded = InMemoryUploadedFile(
+            self.file,
+            self.field_name,
+            self.file_name,
+            self.content_type,
+            file_size,
+            self.charset,
+            self.content_type_extra,
+        )
+        self.file = None
+        return uploaded
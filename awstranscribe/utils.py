@@ -1,141 +1,238 @@
-import os
+import functools
+import logging
 import tiktoken
-import random
-import string
 
-from openai import OpenAI
-client = OpenAI()
+from .metrics import instrument_openai, record_stream_usage
+# Every call goes through the rate limits and retries of awstranscribe.openai_client
+from .openai_client import arequest, estimate_tokens, get_async_client, get_client, request, request_stream
 
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = "gpt-4o"
+# Bump when the summary instructions change, cached summaries are keyed on it
+SUMMARY_PROMPT_VERSION = 1
 
-def calculate_tokens(text) -> int:
-    # Choose the encoding based on the model you're using
-    # For example, 'cl100k_base' is the encoding for GPT-4
-    encoding = tiktoken.get_encoding('cl100k_base')
 
-    # Encode the text to get tokens
-    tokens = encoding.encode(text)
+# Texts are counted in segments of about this many characters so the token list of a
+# multi-hour transcript is never held in memory at once
+TOKEN_COUNT_SEGMENT_SIZE = 64 * 1024
 
-    # Count the number of tokens
-    num_tokens = len(tokens)
 
+@functools.lru_cache(maxsize=None)
+def get_encoding(name='cl100k_base'):
+    # 'cl100k_base' is the encoding for GPT-4 and GPT-4o, loading it is not free so keep it around
+    return tiktoken.get_encoding(name)
 
-    return num_tokens
+def split_for_counting(text, segment_size=TOKEN_COUNT_SEGMENT_SIZE):
+    # Cuts right before a space that follows a non-space character. Tokens never span such a
+    # position, so the per-segment counts add up to the count of the whole text.
+    start = 0
+    while len(text) - start > segment_size:
+        cut = start + segment_size
+        while cut > start and not (text[cut] == ' ' and not text[cut - 1].isspace()):
+            cut -= 1
+        if cut == start:
+            # No safe cut point (e.g. one huge word), count the rest in one go
+            break
+        yield text[start:cut]
+        start = cut
+    yield text[start:]
+
+def calculate_tokens(text) -> int:
+    encoding = get_encoding()
+    # Only the length is needed, special tokens are counted as plain text
+    return sum(len(encoding.encode_ordinary(segment)) for segment in split_for_counting(text))
+
+def calculate_tokens_batch(texts, num_threads=8) -> list:
+    # Counts many texts at once with tiktoken's threaded batch encoder. Segments are fed in
+    # groups so only a few token lists are alive at any time.
+    encoding = get_encoding()
+    counts = [0] * len(texts)
+    group = []
+    owners = []
+    for owner, text in enumerate(texts):
+        for segment in split_for_counting(text):
+            group.append(segment)
+            owners.append(owner)
+            if len(group) >= num_threads * 4:
+                _count_group(encoding, group, owners, counts, num_threads)
+                group, owners = [], []
+    if group:
+        _count_group(encoding, group, owners, counts, num_threads)
+    return counts
+
+def _count_group(encoding, group, owners, counts, num_threads):
+    for owner, tokens in zip(owners, encoding.encode_ordinary_batch(group, num_threads=num_threads)):
+        counts[owner] += len(tokens)
 
 def check_token_limit_status(num_token, max_token) -> bool:
-    
-    print("num_tokens: ", num_token)
-    print("max_token: ", max_token)
+    logger.debug("Text has %s tokens, the limit is %s", num_token, max_token)
     if num_token >= max_token:
         return False
     else:
         return True
 
-def create_assistant(file_id):
-    my_assistant = client.beta.assistants.create(
-        instructions="Summarize the lecture content inside the file into 15%. The summary must less than 1000 tokens.",
-        name="Summarization",
+ASSISTANT_INSTRUCTIONS = "Summarize the lecture content inside the file into 15%. The summary must less than 1000 tokens."
+
+@instrument_openai('create_assistant')
+def create_assistant():
+    # The assistant holds no files, they are attached to each thread, so one assistant serves every request
+    my_assistant = request(
+        get_client().beta.assistants.create,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        name=f"Summarization v{SUMMARY_PROMPT_VERSION}",
         tools=[{"type": "file_search"}],
-        model="gpt-4o",
-        tool_resources={"file_search": {"vector_stores": [{"file_ids": [file_id]}]}}
+        model=OPENAI_MODEL,
     )
     return my_assistant
 
+@instrument_openai('retrieve_assistant')
 def retrieve_assistant(assistant_id):
-    my_assistant = client.beta.assistants.retrieve(assistant_id)
+    my_assistant = request(get_client().beta.assistants.retrieve, assistant_id)
     return my_assistant
 
+@instrument_openai('delete_assistant')
 def delete_assistant(assistant_id):
-    deleted_assistant = client.beta.assistants.delete(assistant_id)
+    deleted_assistant = request(get_client().beta.assistants.delete, assistant_id)
     return deleted_assistant
 
-def upload_txt_file_to_openai(file_path):
-    my_file = client.files.create(
-        file=open("." + file_path, "rb"),
+@instrument_openai('upload_txt_file_to_openai')
+def upload_txt_file_to_openai(name, content):
+    # content is bytes or a binary file object, sent from memory without a copy on the local disk
+    def create(**kwargs):
+        if hasattr(content, 'seek'):
+            # A retried upload sends the whole file again
+            content.seek(0)
+        return get_client().files.create(**kwargs)
+
+    my_file = request(
+        create,
+        file=(name, content),
         purpose="assistants"
     )
     return my_file
 
+@instrument_openai('delete_txt_file_from_openai')
 def delete_txt_file_from_openai(file_id):
-    deleted_file = client.files.delete(file_id)
+    deleted_file = request(get_client().files.delete, file_id)
     return deleted_file
 
-def create_thread():
-    empty_thread = client.beta.threads.create()
-    return empty_thread
+@instrument_openai('create_thread')
+def create_thread(file_id=None):
+    if file_id is None:
+        return request(get_client().beta.threads.create)
+    # The thread gets its own vector store holding the uploaded file
+    thread = request(
+        get_client().beta.threads.create,
+        tool_resources={"file_search": {"vector_stores": [{"file_ids": [file_id]}]}}
+    )
+    return thread
+
+@instrument_openai('delete_vector_store')
+def delete_vector_store(vector_store_id):
+    deleted_vector_store = request(get_client().beta.vector_stores.delete, vector_store_id)
+    return deleted_vector_store
 
+@instrument_openai('delete_thread')
 def delete_thread(thread_id):
-    deleted_thread = client.beta.threads.delete(thread_id)
+    deleted_thread = request(get_client().beta.threads.delete, thread_id)
     return deleted_thread
 
+@instrument_openai('run_thread')
 def run_thread(thread_id, assistant_id):
-    run = client.beta.threads.runs.create(
+    run = request(
+        get_client().beta.threads.runs.create,
         thread_id=thread_id,
         assistant_id=assistant_id
     )
     return run
 
+@instrument_openai('cancel_run')
+def cancel_run(run_id, thread_id):
+    cancelled_run = request(
+        get_client().beta.threads.runs.cancel,
+        thread_id=thread_id,
+        run_id=run_id
+    )
+    return cancelled_run
+
+@instrument_openai('retrieve_run')
 def retrieve_run(run_id, thread_id):
-    retrieved_run = client.beta.threads.runs.retrieve(
+    retrieved_run = request(
+        get_client().beta.threads.runs.retrieve,
         thread_id=thread_id,
         run_id=run_id
     )
     return retrieved_run
 
+@instrument_openai('create_message')
 def create_message(thread_id, message):
-    thread_message = client.beta.threads.messages.create(
+    thread_message = request(
+        get_client().beta.threads.messages.create,
         thread_id,
         role="user",
         content=message,
     )
     return thread_message
 
+@instrument_openai('retrieve_message')
 def retrieve_message(message_id, thread_id):
-    message = client.beta.threads.messages.retrieve(
+    message = request(
+        get_client().beta.threads.messages.retrieve,
         message_id=message_id,
         thread_id=thread_id,
     )
     return message
 
+@instrument_openai('get_list_messages')
 def get_list_messages(thread_id):
-    thread_messages = client.beta.threads.messages.list(thread_id)
+    thread_messages = request(get_client().beta.threads.messages.list, thread_id)
     return thread_messages
 
-def store_txt_file(text):
-    # Generate a random file name
-    random_file_path = './uploads/' + generate_random_string(12) + '.txt'
-    # Open a file in write mode
-    with open( random_file_path, 'w') as file:
-        # Write the text to the file
-        file.write(text)
-    return random_file_path
-
-def remove_file(file_path):
-    try:
-        # Remove the file
-        os.remove(file_path)
-        print(f"File '{file_path}' removed successfully.")
-    except FileNotFoundError:
-        print(f"File '{file_path}' not found.")
-    except PermissionError:
-        print(f"Permission denied: unable to remove '{file_path}'.")
-    except Exception as e:
-        print(f"An error occurred while trying to remove the file: {e}")
-
-def generate_random_string(length=10):
-    # Define the character set: lowercase, uppercase letters, and digits
-    characters = string.ascii_letters + string.digits
-    # Generate a random string
-    random_string = ''.join(random.choice(characters) for _ in range(length))
-    return random_string
-
-def chat_complete(text):
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Summarize the lecture content inside the prompt into 15%. The summary must less than 1000 tokens."},
-            {"role": "user", "content": text}
-        ]
+SUMMARY_INSTRUCTIONS = "Summarize the lecture content inside the prompt into 15%. The summary must less than 1000 tokens."
+
+def summary_messages(text, instructions):
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": text}
+    ]
+
+@instrument_openai('chat_complete')
+def chat_complete(text, instructions=SUMMARY_INSTRUCTIONS):
+    messages = summary_messages(text, instructions)
+    completion = request(
+        get_client().chat.completions.create,
+        model=OPENAI_MODEL,
+        messages=messages,
+        tokens=estimate_tokens(messages),
     )
     return completion
 
+@instrument_openai('chat_complete')
+async def achat_complete(text, instructions=SUMMARY_INSTRUCTIONS):
+    messages = summary_messages(text, instructions)
+    completion = await arequest(
+        get_async_client().chat.completions.create,
+        model=OPENAI_MODEL,
+        messages=messages,
+        tokens=estimate_tokens(messages),
+    )
+    return completion
 
+@instrument_openai('chat_complete_stream')
+def chat_complete_stream(text, instructions=SUMMARY_INSTRUCTIONS):
+    # Yields the completion text piece by piece as OpenAI produces it
+    messages = summary_messages(text, instructions)
+    stream = request_stream(
+        get_client().chat.completions.create,
+        model=OPENAI_MODEL,
+        messages=messages,
+        tokens=estimate_tokens(messages),
+        # The last chunk then carries the token usage, with no choices
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if chunk.usage is not None:
+            record_stream_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
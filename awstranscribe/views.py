@@ -2,41 +2,61 @@ from typing import Any
 from django.contrib.auth import authenticate
 from rest_framework import views, status, response, permissions, authtoken
 from rest_framework.response import Response
-from .serializers import UserSerializer
+from rest_framework.settings import api_settings
+from .serializers import BackgroundJobSerializer, TranscriptionBatchSerializer, UserSerializer, TranscriptionJobSerializer
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-import hashlib
-import time
+import abc
+import datetime
+import hmac
 import json
-
-//
+import logging
+import os
 
 from .utils import (
         calculate_tokens, 
         check_token_limit_status, 
         chat_complete, 
-        store_txt_file, 
-        upload_txt_file_to_openai,
-        create_assistant,
-        create_thread,
-        create_message,
-        run_thread,
-        retrieve_run,
-        delete_assistant,
-        delete_txt_file_from_openai,
-        delete_thread,
-        remove_file,
-        get_list_messages,
     )
 
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .assistants import AssistantRunError, summarize_with_assistant
+from . import metrics
+from .aws import get_client
+from .background import enqueue
+from .cache import (
+        cache_stats,
+        get_summary,
+        get_transcript_entry,
+        invalidate_transcript,
+        summarize_once,
+        summary_key,
+    )
+from .events import confirm_subscription, handle_event, unwrap_events
+from .engines import clean_options
+from .jobs import enqueue_summary, ensure_poller, job_name_for, submit_job, wake_poller
+from .listing import get_bucket_index
+from .models import BackgroundJob, TranscriptionBatch, TranscriptionJob
+from .streaming import EventStreamRenderer, summary_stream_response, wants_stream
+from .summarize import SUMMARY_MAX_TOKENS, MapReduceSummarizer, get_transcript_summary, summarize_transcript
+from .transcripts import get_compact_transcript, read_transcript, segments_between
+from .uploadhandlers import MAX_PARTS, MIN_PART_SIZE, BoundedMemoryUploadHandler, S3MultipartUploadHandler
 
 import math
+import openai
+
+logger = logging.getLogger(__name__)
+
+# Transcripts above this many characters are streamed
+TRANSCRIPT_CHUNK_SIZE = 64 * 1024
 
 class CreateUserView(views.APIView):
     permission_classes = [permissions.AllowAny]
@@ -67,11 +87,10 @@ class UploadToS3(views.APIView):
     def post(self, request):
 
         if request.method == 'POST':
+            if self.use_streaming(request):
+                return self.stream_to_s3(request)
             file = request.FILES['file']
-            s3 = boto3.client('s3',
-                            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                            region_name=settings.AWS_S3_REGION_NAME)
+            s3 = get_client('s3')
             try:
                 s3.upload_fileobj(
                     file,
@@ -79,6 +98,7 @@ class UploadToS3(views.APIView):
                     file.name,
                     ExtraArgs={'ContentType': file.content_type}
                 )
+                get_bucket_index(settings.AWS_STORAGE_BUCKET_NAME).put(file.name, file.size)
                 file_url = f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{file.name}"
                 s3_rul = f"s3://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{file.name}"
                 return JsonResponse({'file_url': file_url}, status=200)
@@ -86,173 +106,514 @@ class UploadToS3(views.APIView):
                 return JsonResponse({'error': str(e)}, status=500)
         else:
             return JsonResponse({'error': 'Invalid HTTP method'}, status=400)
-        
-class TranscribeAudioView(views.APIView):
+
+    def use_streaming(self, request):
+        stream = request.query_params.get('stream')
+        if stream is None:
+            return settings.S3_STREAMING_UPLOADS
+        return stream.lower() in ['1', 'true', 'yes']
+
+    def stream_to_s3(self, request):
+        # The handler must be installed before request.FILES is first touched
+        handler = S3MultipartUploadHandler(request._request)
+        request._request.upload_handlers = [handler]
+        try:
+            file = request.FILES['file']
+        except Exception as e:
+            handler.abort()
+            return JsonResponse({'error': str(e)}, status=500)
+        get_bucket_index(settings.AWS_STORAGE_BUCKET_NAME).put(file.name, file.size)
+        file_url = f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{file.name}"
+        return JsonResponse({'file_url': file_url}, status=200)
+
+def wants_queue(request):
+    # `?queue=true` hands the work to `manage.py run_worker` and answers 202 right away
+    return request.query_params.get('queue', '').lower() in ['1', 'true', 'yes']
+
+def openai_error(error):
+    # (status, message) for an OpenAI failure that outlasted the retries, None for any other error
+    if isinstance(error, openai.RateLimitError):
+        return status.HTTP_503_SERVICE_UNAVAILABLE, 'OpenAI rate limit reached, try again later'
+    if isinstance(error, openai.APITimeoutError):
+        return status.HTTP_504_GATEWAY_TIMEOUT, 'OpenAI did not answer in time'
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError, AssistantRunError)):
+        return status.HTTP_502_BAD_GATEWAY, str(error)
+    return None
+
+def openai_error_response(error, response_class=Response):
+    failure = openai_error(error)
+    if failure is None:
+        return None
+    error_status, message = failure
+    response = response_class({'error': message}, status=error_status)
+    if error_status == status.HTTP_503_SERVICE_UNAVAILABLE:
+        response['Retry-After'] = str(math.ceil(settings.OPENAI_RETRY_MAX_DELAY))
+    return response
+
+def exception_handler(exc, context):
+    # OpenAI failures are the upstream's, answered with a 5xx that says so rather than a bare 500
+    return openai_error_response(exc) or views.exception_handler(exc, context)
+
+def queued(request, job):
+    serializer = BackgroundJobSerializer(job, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+def transcript_response(content, content_type, etag=''):
+    # Large transcripts are sent in chunks, so the compression middleware works through them
+    # piece by piece instead of holding a second, compressed copy of the whole body
+    if len(content) > TRANSCRIPT_CHUNK_SIZE:
+        chunks = (content[start:start + TRANSCRIPT_CHUNK_SIZE] for start in range(0, len(content), TRANSCRIPT_CHUNK_SIZE))
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    return response
+
+class TranscriptionJobMixin:
+    # Answer from the persisted job record instead of holding the request open until AWS finishes
+    # Distinguishes the ETags of representations derived from the transcript, like its plain text
+    etag_suffix = ''
+
+    def transcript_etag(self, job):
+        # Derived from the transcript object's ETag, so known without reading the transcript
+        if not job.transcript_etag:
+            return None
+        if not self.etag_suffix:
+            return quote_etag(job.transcript_etag)
+        etag = job.transcript_etag.strip('"')
+        return quote_etag(f"{etag}-{self.etag_suffix}")
+
+    def not_modified(self, request, job):
+        # 304 when the client's If-None-Match still matches, None when the response must be sent
+        etag = self.transcript_etag(job)
+        if etag is None:
+            return None
+        return get_conditional_response(request, etag=etag)
+
+    def accepted(self, job):
+        ensure_poller()
+        serializer = TranscriptionJobSerializer(job, context={'request': self.request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    def enqueue(self, request, s3_url, options=None):
+        # Known jobs are answered as usual, new ones are started by a worker
+        job_name = self.generate_job_name(s3_url)
+        tracked = self.get_tracked_job(job_name)
+        if tracked is not None:
+            return tracked
+        payload = {'job_name': job_name, 'job_type': self.job_type, 's3_url': s3_url, 'options': options or {}}
+        job = enqueue('transcribe', payload)
+        return queued(request, job)
+
+    def generate_job_name(self, s3_url):
+        return job_name_for(s3_url, self.job_type)
+
+    def handle_completed_job(self, job):
+        # The transcript JSON is passed through as-is, there is no need to parse it
+        content, etag = read_transcript(job)
+        return transcript_response(content, 'application/json', etag)
+
+    def get_tracked_job(self, job_name):
+        # Served straight from the local cache, no AWS call at all
+        cached = get_transcript_entry(job_name)
+        if cached is not None:
+            return transcript_response(cached.content, 'application/json', cached.etag)
+        # Pending jobs are kept up to date by the poller, completed ones only need the transcript
+        job = TranscriptionJob.objects.filter(job_name=job_name).first()
+        if job is not None and job.is_pending:
+            return self.accepted(job)
+        if job is not None and job.status == TranscriptionJob.COMPLETED:
+            return self.handle_completed_job(job)
+        return None
+
+class TranscribeAudioView(TranscriptionJobMixin, views.APIView):
+    # Standard and medical jobs share everything but the engine, see awstranscribe.engines
     permission_classes = [permissions.IsAuthenticated]
+    job_type = TranscriptionJob.STANDARD
 
     def post(self, request):
         s3_url = request.data.get('s3_url')
         if not s3_url:
             return Response({'error': 'Missing S3 URL'}, status=status.HTTP_400_BAD_REQUEST)
-
+        try:
+            options = clean_options(request.data, self.job_type)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if wants_queue(request):
+            return self.enqueue(request, s3_url, options)
+        return self.transcribe(s3_url, options)
+
+    def transcribe(self, s3_url, options=None):
         job_name = self.generate_job_name(s3_url)
 
-        transcribe_client = boto3.client('transcribe', region_name=settings.AWS_S3_REGION_NAME)
+        tracked = self.get_tracked_job(job_name)
+        if tracked is not None:
+            return tracked
 
         try:
-            existing_job = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-            job_status = existing_job['TranscriptionJob']['TranscriptionJobStatus']
-        except transcribe_client.exceptions.BadRequestException:
-            existing_job = None
-            job_status = None
-        
-        if job_status == 'COMPLETED':
-            return self.handle_existing_job(existing_job)
-        elif job_status in ['IN_PROGRESS', 'QUEUED']:
-            return self.wait_for_transcription(transcribe_client, job_name)
-        elif job_status == 'FAILED':
+            job = submit_job(job_name, self.job_type, s3_url, options)
+        except (BotoCoreError, ClientError) as error:
+            return Response({'error': str(error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # The poller picks pending jobs up from here, the client follows the status URL
+        if job.status == TranscriptionJob.COMPLETED:
+            return self.handle_completed_job(job)
+        elif job.status == TranscriptionJob.FAILED:
             return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        elif not existing_job:
-            return self.start_new_transcription_job(transcribe_client, s3_url, job_name)
+        return self.accepted(job)
 
-    def generate_job_name(self, s3_url):
-        url_hash = hashlib.md5(s3_url.encode('utf-8')).hexdigest()
-        return f"TranscriptionJob_{url_hash}"
+class TranscribeAudioViewMedical(TranscribeAudioView):
+    job_type = TranscriptionJob.MEDICAL
 
-    def handle_existing_job(self, job):
-        transcript_file_uri = job['TranscriptionJob']['Transcript']['TranscriptFileUri']
-        sarr = transcript_file_uri.split('/')
-        transcript = self.read_s3_json(settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS, sarr[4])
-        return Response(transcript, status=status.HTTP_200_OK)
+class TranscriptionJobStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(TranscriptionJob, job_name=job_id)
+        serializer = TranscriptionJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class TranscriptionBatchView(views.APIView):
+    # Records the jobs and returns at once, the poller starts them as Transcribe quota frees up
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        s3_urls = request.data.get('s3_urls')
+        job_type = request.data.get('job_type', TranscriptionJob.STANDARD)
+        if not isinstance(s3_urls, list) or not s3_urls or not all(isinstance(url, str) and url for url in s3_urls):
+            return Response({'error': 's3_urls must be a non-empty list of S3 URLs'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(s3_urls) > settings.TRANSCRIBE_BATCH_MAX_SIZE:
+            return Response({'error': f'At most {settings.TRANSCRIBE_BATCH_MAX_SIZE} files per batch'}, status=status.HTTP_400_BAD_REQUEST)
+        if job_type not in [TranscriptionJob.STANDARD, TranscriptionJob.MEDICAL]:
+            return Response({'error': f'Unknown job_type {job_type}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            options = clean_options(request.data, job_type)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The same file twice, in this batch or any earlier request, is one job
+        urls_by_name = {job_name_for(url, job_type): url for url in s3_urls}
+        TranscriptionJob.objects.bulk_create(
+            [TranscriptionJob(job_name=name, job_type=job_type, s3_url=url, options=options, status=TranscriptionJob.WAITING)
+             for name, url in urls_by_name.items()],
+            ignore_conflicts=True,
+        )
+        batch = TranscriptionBatch.objects.create(job_type=job_type)
+        # Written without reading the batch's rows first, jobs.set() would: on SQLite a
+        # read-then-write transaction fails under concurrent writers
+        TranscriptionBatch.jobs.through.objects.bulk_create(
+            [TranscriptionBatch.jobs.through(transcriptionbatch_id=batch.pk, transcriptionjob_id=job_id)
+             for job_id in TranscriptionJob.objects.filter(job_name__in=urls_by_name).values_list('pk', flat=True)],
+            ignore_conflicts=True,
+        )
+        ensure_poller()
+        wake_poller()
+        serializer = TranscriptionBatchSerializer(batch, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+class TranscriptionBatchStatusView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, batch_id):
+        batch = get_object_or_404(TranscriptionBatch.objects.prefetch_related('jobs'), pk=batch_id)
+        serializer = TranscriptionBatchSerializer(batch, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+class TranscriptionEventsView(views.APIView):
+    # Called by EventBridge API destinations or SNS, which cannot log in: a shared secret is
+    # sent in the X-Events-Secret header or the `secret` query parameter instead
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
 
-    def wait_for_transcription(self, transcribe_client, job_name):
-        while True:
+    def post(self, request):
+        secret = request.META.get('HTTP_X_EVENTS_SECRET') or request.query_params.get('secret', '')
+        if not settings.TRANSCRIBE_EVENTS_SECRET or not hmac.compare_digest(secret, settings.TRANSCRIBE_EVENTS_SECRET):
+            return Response({'error': 'Invalid secret'}, status=status.HTTP_403_FORBIDDEN)
+        # SNS posts JSON as text/plain, so the body is parsed here rather than by DRF
+        try:
+            payload = json.loads(request.body)
+            if payload.get('Type') == 'SubscriptionConfirmation':
+                confirm_subscription(payload)
+                return Response({'updated': []}, status=status.HTTP_200_OK)
+            events = unwrap_events(payload)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return Response({'error': f'Unsupported payload: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = []
+        for event in events:
             try:
-                job = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-                job_status = job['TranscriptionJob']['TranscriptionJobStatus']
-                if job_status == 'COMPLETED':
-                    return self.handle_existing_job(job)
-                elif job_status == 'FAILED':
-                    return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                time.sleep(5)  # Sleep for a while before checking the status again
-            except transcribe_client.exceptions.BadRequestException:
-                # Handle the case where the job is not found, which should not happen here
-                return Response({'error': 'Transcription job not found'}, status=status.HTTP_404_NOT_FOUND)
-
-    def start_new_transcription_job(self, transcribe_client, s3_url, job_name):
+                job = handle_event(event)
+            except (BotoCoreError, ClientError, KeyError) as error:
+                logger.warning("Could not apply transcription event: %s", error)
+                continue
+            if job is not None:
+                updated.append(job.job_name)
+        if updated:
+            # Finished jobs free Transcribe quota for WAITING ones
+            wake_poller()
+        return Response({'updated': updated}, status=status.HTTP_200_OK)
+
+class TranscriptionJobResultView(TranscriptionJobMixin, views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(TranscriptionJob, job_name=job_id)
+        if job.status == TranscriptionJob.COMPLETED:
+            return self.not_modified(request, job) or self.handle_completed_job(job)
+        elif job.status == TranscriptionJob.FAILED:
+            return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return self.accepted(job)
+
+    def delete(self, request, job_id):
+        # Drop the cached transcript, the next request reads it from S3 again
+        if not invalidate_transcript(job_id):
+            return Response({'error': 'Transcript is not cached'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class CompactTranscriptView(TranscriptionJobMixin, views.APIView, abc.ABC):
+    # Base of the views serving a completed job's compact transcript instead of the raw JSON,
+    # each subclass renders it in compact_response()
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(TranscriptionJob, job_name=job_id)
+        if job.status == TranscriptionJob.COMPLETED:
+            not_modified = self.not_modified(request, job)
+            if not_modified is not None:
+                return not_modified
+            response = self.compact_response(request, job, get_compact_transcript(job))
+            # The first request only learns the ETag while compacting
+            etag = self.transcript_etag(job)
+            if etag:
+                response['ETag'] = etag
+            return response
+        elif job.status == TranscriptionJob.FAILED:
+            return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return self.accepted(job)
+
+    @abc.abstractmethod
+    def compact_response(self, request, job, transcript):
+        # The response for the compact transcript of a completed job
+        ...
+
+class TranscriptionJobTextView(CompactTranscriptView):
+    etag_suffix = 'text'
+
+    def compact_response(self, request, job, transcript):
+        return transcript_response(transcript.text, 'text/plain; charset=utf-8')
+
+class TranscriptionJobSegmentsView(CompactTranscriptView):
+    # `?start=` and `?end=` (seconds) limit the segments to a time range
+    etag_suffix = 'segments'
+
+    def get(self, request, job_id):
         try:
-            transcribe_client.start_transcription_job(
-                TranscriptionJobName=job_name,
-                Media={'MediaFileUri': s3_url},
-                MediaFormat='mp4',
-                LanguageCode='en-US',
-                OutputBucketName=settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS,
-            )
-            # Wait for the job to complete
-            return self.wait_for_transcription(transcribe_client, job_name)
+            self.start = self.parse_seconds(request.query_params.get('start'))
+            self.end = self.parse_seconds(request.query_params.get('end'))
+        except ValueError:
+            return Response({'error': 'start and end must be numbers of seconds'}, status=status.HTTP_400_BAD_REQUEST)
+        return super().get(request, job_id)
+
+    def compact_response(self, request, job, transcript):
+        segments = segments_between(transcript, self.start, self.end).values('start', 'end', 'speaker', 'text')
+        return Response({
+            'job_id': job.job_name,
+            'duration': transcript.duration,
+            'start': self.start,
+            'end': self.end,
+            'segments': list(segments),
+        }, status=status.HTTP_200_OK)
+
+    def parse_seconds(self, value):
+        if value in [None, '']:
+            return None
+        seconds = float(value)
+        if not math.isfinite(seconds):
+            raise ValueError(value)
+        return seconds
+
+class TranscriptionJobSummaryView(TranscriptionJobMixin, views.APIView):
+    # Summarized on the server from the transcript in S3, the client never sends the text back.
+    # With TRANSCRIPT_AUTO_SUMMARIZE a worker makes it when the job completes and this answers 202
+    # until it is there, else it is made on the first request (`?queue=true` hands it to a worker)
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(TranscriptionJob, job_name=job_id)
+        if job.status == TranscriptionJob.FAILED:
+            return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if job.status != TranscriptionJob.COMPLETED:
+            return self.accepted(job)
+        summary = get_transcript_summary(job)
+        if summary is None:
+            if wants_queue(request) or settings.TRANSCRIPT_AUTO_SUMMARIZE:
+                # The job queued on completion when there is one, never a second summary
+                return queued(request, enqueue_summary(job))
+            summary = summarize_transcript(job)
+        return Response({
+            'job_id': job.job_name,
+            'summary': summary.summary,
+            'created_at': summary.created_at,
+        }, status=status.HTTP_200_OK)
+
+class PresignedUploadView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        file_name = request.data.get('file_name')
+        content_type = request.data.get('content_type') or 'application/octet-stream'
+        try:
+            file_size = int(request.data.get('file_size'))
+        except (TypeError, ValueError):
+            file_size = 0
+        if not file_name or file_size <= 0:
+            return Response({'error': 'file_name and a positive file_size are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        s3 = get_client('s3')
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+        key = os.path.basename(file_name)
+        expires_in = settings.S3_PRESIGNED_URL_EXPIRES
+        payload = {
+            'key': key,
+            'file_url': f"https://{bucket_name}.s3.amazonaws.com/{key}",
+            'expires_in': expires_in,
+        }
+
+        try:
+            part_size = max(settings.AWS_S3_MULTIPART_PART_SIZE, MIN_PART_SIZE, math.ceil(file_size / MAX_PARTS))
+            if file_size <= part_size:
+                payload['url'] = s3.generate_presigned_url(
+                    'put_object',
+                    Params={'Bucket': bucket_name, 'Key': key, 'ContentType': content_type},
+                    ExpiresIn=expires_in,
+                )
+                return Response(payload, status=status.HTTP_200_OK)
+
+            upload = s3.create_multipart_upload(Bucket=bucket_name, Key=key, ContentType=content_type)
+            payload['upload_id'] = upload['UploadId']
+            payload['part_size'] = part_size
+            payload['parts'] = [
+                {
+                    'part_number': part_number,
+                    'url': s3.generate_presigned_url(
+                        'upload_part',
+                        Params={'Bucket': bucket_name, 'Key': key, 'UploadId': upload['UploadId'], 'PartNumber': part_number},
+                        ExpiresIn=expires_in,
+                    ),
+                }
+                for part_number in range(1, math.ceil(file_size / part_size) + 1)
+            ]
+            return Response(payload, status=status.HTTP_200_OK)
         except (BotoCoreError, ClientError) as error:
             return Response({'error': str(error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def read_s3_json(self, bucket_name, file_key):
-        # Create a client
-        s3 = boto3.client('s3')
-        # Get the object from the bucket
-        obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-        # Read the contents of the file
-        data = obj['Body'].read().decode('utf-8')
-        # Convert string to JSON
-        json_data = json.loads(data)
-        return json_data
-
-class TranscribeAudioViewMedical(views.APIView):
+class CompleteUploadView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        s3_url = request.data.get('s3_url')
-        if not s3_url:
-            return Response({'error': 'Missing S3 URL'}, status=status.HTTP_400_BAD_REQUEST)
-
-        job_name = self.generate_job_name(s3_url)
+        key = request.data.get('key')
+        upload_id = request.data.get('upload_id')
+        if not key:
+            return Response({'error': 'Missing key'}, status=status.HTTP_400_BAD_REQUEST)
+        expected_size = request.data.get('file_size')
+        if expected_size is not None:
+            try:
+                expected_size = int(expected_size)
+            except (TypeError, ValueError):
+                return Response({'error': 'file_size must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
 
-        transcribe_client = boto3.client('transcribe', region_name=settings.AWS_S3_REGION_NAME)
+        s3 = get_client('s3')
+        bucket_name = settings.AWS_STORAGE_BUCKET_NAME
 
         try:
-            existing_job = transcribe_client.get_medical_transcription_job(MedicalTranscriptionJobName = job_name)
-            job_status = existing_job['MedicalTranscriptionJob']['TranscriptionJobStatus']
-        except transcribe_client.exceptions.BadRequestException:
-            existing_job = None
-            job_status = None
-
-        if job_status == 'COMPLETED':
-            return self.handle_existing_job(existing_job)
-        elif job_status in ['IN_PROGRESS', 'QUEUED']:
-            return self.wait_for_transcription(transcribe_client, job_name)
-        elif job_status == 'FAILED':
-            return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        elif not existing_job:
-            return self.start_new_transcription_job(transcribe_client, s3_url, job_name)
+            if upload_id:
+                parts = [
+                    {'PartNumber': int(part['part_number']), 'ETag': part['etag']}
+                    for part in request.data.get('parts') or []
+                ]
+                s3.complete_multipart_upload(
+                    Bucket=bucket_name,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])},
+                )
+            obj = s3.head_object(Bucket=bucket_name, Key=key)
+        except (KeyError, TypeError, ValueError):
+            return Response({'error': 'Each part needs a part_number and an etag'}, status=status.HTTP_400_BAD_REQUEST)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ['404', 'NoSuchKey', 'NoSuchUpload']:
+                return Response({'error': 'Uploaded object not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        except BotoCoreError as error:
+            return Response({'error': str(error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def generate_job_name(self, s3_url):
-        url_hash = hashlib.md5(s3_url.encode('utf-8')).hexdigest()
-        return f"MedicalTranscriptionJob_{url_hash}"
+        if expected_size is not None and expected_size != obj['ContentLength']:
+            return Response({'error': 'Uploaded object size does not match file_size'}, status=status.HTTP_400_BAD_REQUEST)
 
-    def handle_existing_job(self, job):
-        transcript_file_uri = job['MedicalTranscriptionJob']['Transcript']['TranscriptFileUri']
-        sarr = transcript_file_uri.split('/')
-        transcript = self.read_s3_json(settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS, sarr[4] + '/' + sarr[5])
-        return Response(transcript, status=status.HTTP_200_OK)
+        get_bucket_index(bucket_name).put(key, obj['ContentLength'], obj.get('ETag', ''), obj.get('LastModified'))
+        file_url = f"https://{bucket_name}.s3.amazonaws.com/{key}"
+        payload = {'key': key, 'file_url': file_url, 'size': obj['ContentLength'], 'etag': obj.get('ETag', '')}
+        if not request.data.get('transcribe'):
+            return Response(payload, status=status.HTTP_200_OK)
 
-    def wait_for_transcription(self, transcribe_client, job_name):
-        while True:
-            try:
-                job = transcribe_client.get_medical_transcription_job(MedicalTranscriptionJobName=job_name)
-                job_status = job['MedicalTranscriptionJob']['TranscriptionJobStatus']
-                if job_status == 'COMPLETED':
-                    return self.handle_existing_job(job)
-                elif job_status == 'FAILED':
-                    return Response({'error': 'Transcription job failed'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                time.sleep(5)  # Sleep for a while before checking the status again
-            except transcribe_client.exceptions.BadRequestException:
-                # Handle the case where the job is not found, which should not happen here
-                return Response({'error': 'Transcription job not found'}, status=status.HTTP_404_NOT_FOUND)
-
-    def start_new_transcription_job(self, transcribe_client, s3_url, job_name):
+        job_type = TranscriptionJob.MEDICAL if request.data.get('medical') else TranscriptionJob.STANDARD
         try:
-            transcribe_client.start_medical_transcription_job(
-                MedicalTranscriptionJobName=job_name,
-                Media={'MediaFileUri': s3_url},
-                MediaFormat='mp4',
-                LanguageCode='en-US',
-                OutputBucketName=settings.AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS,
-                Specialty='PRIMARYCARE',
-                Type='DICTATION'
-            )
-            # Wait for the job to complete
-            return self.wait_for_transcription(transcribe_client, job_name)
+            job = submit_job(job_name_for(file_url, job_type), job_type, file_url)
         except (BotoCoreError, ClientError) as error:
+            payload['transcription'] = {'error': str(error)}
+            return Response(payload, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        payload['transcription'] = TranscriptionJobSerializer(job, context={'request': request}).data
+        if job.status == TranscriptionJob.FAILED:
+            return Response(payload, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        if job.status == TranscriptionJob.COMPLETED:
+            return Response(payload, status=status.HTTP_200_OK)
+        # The poller picks the job up from here, like jobs started through api/transcribe/
+        ensure_poller()
+        return Response(payload, status=status.HTTP_202_ACCEPTED)
+
+class AbortUploadView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        # Frees the parts of a multipart upload that will not be completed, S3 bills them until then
+        key = request.data.get('key')
+        upload_id = request.data.get('upload_id')
+        if not key or not upload_id:
+            return Response({'error': 'key and upload_id are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            get_client('s3').abort_multipart_upload(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key, UploadId=upload_id)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+                return Response({'error': 'Upload not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        except BotoCoreError as error:
             return Response({'error': str(error)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-    def read_s3_json(self, bucket_name, file_key):
-        # Create a client
-        s3 = boto3.client('s3')
-        # Get the object from the bucket
-        obj = s3.get_object(Bucket=bucket_name, Key=file_key)
-        # Read the contents of the file
-        data = obj['Body'].read().decode('utf-8')
-        # Convert string to JSON
-        json_data = json.loads(data)
-        return json_data
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 class S3FileListView(views.APIView):
     permission_classes = [permissions.IsAuthenticated]  # Or update as per your permission policy
 
     def get(self, request):
-        s3_client = boto3.client('s3', region_name=settings.AWS_S3_REGION_NAME)
         bucket_name = settings.AWS_STORAGE_BUCKET_NAME
 
         try:
-            response = s3_client.list_objects_v2(Bucket=bucket_name)
-            files = response.get('Contents', [])
+            match = self.build_filter(request.query_params)
+            limit = min(int(request.query_params.get('limit', settings.S3_LIST_PAGE_SIZE)), settings.S3_LIST_PAGE_SIZE)
+            if limit <= 0:
+                raise ValueError('limit must be positive')
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Served from the cached bucket index, see awstranscribe.listing
+            files, next_cursor = get_bucket_index(bucket_name).page(
+                prefix=request.query_params.get('prefix', ''),
+                cursor=request.query_params.get('cursor'),
+                limit=limit,
+                match=match,
+            )
 
             # Format the files as per your requirement
             formatted_files = [
@@ -266,23 +627,86 @@ class S3FileListView(views.APIView):
                 for file in files
             ]
 
-            return Response(formatted_files, status=status.HTTP_200_OK)
-
-        except s3_client.exceptions.NoSuchBucket:
-            return Response({'error': 'Bucket does not exist'}, status=status.HTTP_404_NOT_FOUND)
+            result = Response(formatted_files, status=status.HTTP_200_OK)
+            # The body stays a plain list, the next page is announced in headers
+            if next_cursor:
+                query = request.query_params.copy()
+                query['cursor'] = next_cursor
+                result['X-Next-Cursor'] = next_cursor
+                result['Link'] = f'<{request.build_absolute_uri(request.path)}?{query.urlencode()}>; rel="next"'
+            return result
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'NoSuchBucket':
+                return Response({'error': 'Bucket does not exist'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def build_filter(self, params):
+        # Optional filters: modified_after, modified_before (ISO date or datetime), min_size, max_size (bytes)
+        modified_after = self.parse_moment(params.get('modified_after'))
+        modified_before = self.parse_moment(params.get('modified_before'))
+        min_size = int(params['min_size']) if params.get('min_size') else None
+        max_size = int(params['max_size']) if params.get('max_size') else None
+        if modified_after is None and modified_before is None and min_size is None and max_size is None:
+            return None
+
+        def match(file):
+            if modified_after is not None and file['LastModified'] < modified_after:
+                return False
+            if modified_before is not None and file['LastModified'] >= modified_before:
+                return False
+            if min_size is not None and file['Size'] < min_size:
+                return False
+            if max_size is not None and file['Size'] > max_size:
+                return False
+            return True
+        return match
+
+    def parse_moment(self, value):
+        if not value:
+            return None
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'Invalid date: {value}')
+            moment = datetime.datetime.combine(day, datetime.time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, datetime.timezone.utc)
+        return moment
+
 class SummarizeTxt(views.APIView):
     permission_classes = [permissions.IsAuthenticated]  # Or update as per your permission policy
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer]
 
     def __init__(self, **kwargs: Any) -> None:
         self.text = ""
-        self.max_token = 10000
+        self.max_token = SUMMARY_MAX_TOKENS
         self.sum_size = 0
 
     def post(self, request):
         self.text = request.data.get('text')
+        if not self.text:
+            return response.Response({'error': 'Missing text'}, status=status.HTTP_400_BAD_REQUEST)
+
+        cache_key = summary_key(self.text)
+        if wants_stream(request):
+            return summary_stream_response(self.text, cache_key)
+        summary = get_summary(cache_key)
+        if summary is not None:
+            return response.Response({'summary': summary}, status=status.HTTP_200_OK)
+        if wants_queue(request):
+            return queued(request, enqueue('summarize', {'text': self.text}))
+
+        # Identical texts summarized at the same time share one summary
+        summary = summarize_once(cache_key, self.summarize)
+        return response.Response({'summary': summary}, status=status.HTTP_200_OK)
+
+    def summarize(self):
         num_token = calculate_tokens(self.text)
         isTokenLimit = check_token_limit_status(num_token=num_token, max_token=self.max_token)
         self.sum_size = math.floor(num_token * 0.15)
@@ -292,36 +716,19 @@ class SummarizeTxt(views.APIView):
 
         if isTokenLimit:
             summary = self.use_chatComplete()    
-        else:
+        elif settings.SUMMARY_ENGINE == 'assistant':
             summary = self.use_assistant()    
+        else:
+            summary = self.use_map_reduce()
+        return summary
 
-        return response.Response({'summary': summary}, status=status.HTTP_200_OK)
-    
     def use_assistant(self):
-        file_path = store_txt_file(self.text)
-        file = upload_txt_file_to_openai(file_path)
-
-        assistant = create_assistant(file_id=file.id)
-        thread = create_thread()
-        message = create_message(thread_id=thread.id, message="Summarize the lecture content inside the file into 15%. The summary must less than 1000 tokens.")
-        run = run_thread(thread_id=thread.id, assistant_id=assistant.id)
-        retrieved_run_status = "in_progress"
-
-        while(retrieved_run_status != "completed"):
-            retrieved_run = retrieve_run(thread_id=thread.id, run_id=run.id)
-            retrieved_run_status = retrieved_run.status
-            time.sleep(2)
-        
-        list_messages = get_list_messages(thread_id=thread.id)
-
-        delete_assistant(assistant_id=assistant.id)
-        delete_txt_file_from_openai(file_id=file.id)
-        delete_thread(thread_id=thread.id)
-        remove_file(file_path=file_path)
+        # The assistant is long-lived, only the file and thread are per request, see awstranscribe.assistants
+        return summarize_with_assistant(self.text.encode('utf-8'))
 
-        return list_messages.data[0].content[0].text.value
-
-        
+    def use_map_reduce(self):
+        # Long texts are summarized in chunks with chat completions, see awstranscribe.summarize
+        return MapReduceSummarizer().summarize(self.text)
 
     def use_chatComplete(self):
         message = chat_complete(self.text)
@@ -329,58 +736,63 @@ class SummarizeTxt(views.APIView):
 
 class SummarizeTxtFileUpload(views.APIView):
     permission_classes = [permissions.IsAuthenticated]  # Or update as per your permission policy
-
-    def __init__(self, **kwargs: Any) -> None:
-        self.file_path = ""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [EventStreamRenderer]
 
     def post(self, request):
+        # Kept in memory, no temporary file, and refused past SUMMARY_UPLOAD_MAX_BYTES
+        handler = BoundedMemoryUploadHandler(request._request, settings.SUMMARY_UPLOAD_MAX_BYTES)
+        request._request.upload_handlers = [handler]
         try:
-            file = request.FILES['file']
+            files = request.FILES
+            if handler.too_large:
+                return JsonResponse({'error': f'File is larger than {settings.SUMMARY_UPLOAD_MAX_BYTES} bytes'}, status=413)
+            file = files['file']
             # uploaded = store_uploaded_file(file=file)
             if not file:
                 return JsonResponse({'error': 'No file provided'}, status=400)
 
-            # Save file to the media directory
-            file_name = default_storage.save(f'documents/{file.name}', ContentFile(file.read()))
-            # self.file_path = default_storage.url(file_name)
-            self.file_path = '/uploads/' + file_name
-
-            summary = self.use_assistant()
-
+            content = file.read()
+            text = content.decode('utf-8', errors='replace')
+            cache_key = summary_key(text)
+            if wants_stream(request):
+                # Streaming goes through chat completions, the Assistants API is not used
+                return summary_stream_response(text, cache_key)
+            summary = get_summary(cache_key)
+            if summary is not None:
+                return response.Response({'summary': summary}, status=status.HTTP_200_OK)
+
+            summary = summarize_once(cache_key, lambda: self.use_assistant(file.name, content))
             return response.Response({'summary': summary}, status=status.HTTP_200_OK)
 
         except Exception as e:
-            # Log the exception if you have a logging setup
-            # logger.error(f"Error in SummarizeTxtFileUpload: {str(e)}")
-            return JsonResponse({'error': str(e)}, status=500)
+            logger.exception("Error in SummarizeTxtFileUpload")
+            return openai_error_response(e, JsonResponse) or JsonResponse({'error': str(e)}, status=500)
 
 
-    def use_assistant(self):
-        try:
-            file = upload_txt_file_to_openai(self.file_path)
-
-            assistant = create_assistant(file_id=file.id)
-            thread = create_thread()
-            message = create_message(thread_id=thread.id, message="Summarize the lecture content inside the file into 15%. The summary must less than 1000 tokens.")
-            run = run_thread(thread_id=thread.id, assistant_id=assistant.id)
-            retrieved_run_status = "in_progress"
-
-            while(retrieved_run_status != "completed"):
-                retrieved_run = retrieve_run(thread_id=thread.id, run_id=run.id)
-                retrieved_run_status = retrieved_run.status
-                time.sleep(2)
-            
-            list_messages = get_list_messages(thread_id=thread.id)
-
-            delete_assistant(assistant_id=assistant.id)
-            delete_txt_file_from_openai(file_id=file.id)
-            delete_thread(thread_id=thread.id)
-            remove_file(file_path="." + self.file_path)
-
-            return list_messages.data[0].content[0].text.value
-        
-        except Exception as e:
-            # Log the exception if you have a logging setup
-            # logger.error(f"Error in SummarizeTxtFileUpload: {str(e)}")
-            print(str(e))
-            return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+    def use_assistant(self, name, content):
+        # Uploaded to OpenAI straight from the request's bytes, file_search needs a .txt name
+        if not name.lower().endswith('.txt'):
+            name += '.txt'
+        return summarize_with_assistant(content, name)
+
+class CacheStatsView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # Hit/miss counters of the transcript and summary caches since this process started
+        return Response(cache_stats(), status=status.HTTP_200_OK)
+
+class MetricsView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # Prometheus text format, counted since this process started
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class BackgroundJobView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(BackgroundJob.objects.prefetch_related('attempt_set'), pk=job_id)
+        serializer = BackgroundJobSerializer(job, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -0,0 +1,81 @@
+"""Per-request overhead of building a boto3 client versus the shared registry.
+
+Runs against moto's in-process S3 stand-in, so no AWS account is needed:
+
+    pip install moto
+    python -m benchmarks.bench_boto_clients --requests 200
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_S3_REGION_NAME', 'us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import django
+from moto import mock_aws
+
+django.setup()
+
+from django.conf import settings
+
+from awstranscribe.aws import get_client, reset_clients
+
+BUCKET = 'bench-bucket'
+
+
+def per_request_client():
+    # What the views did before: a fresh client for every request
+    s3 = boto3.client('s3',
+                      aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                      aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                      region_name=settings.AWS_S3_REGION_NAME)
+    return s3.head_object(Bucket=BUCKET, Key='lecture.mp4')
+
+
+def shared_client():
+    return get_client('s3').head_object(Bucket=BUCKET, Key='lecture.mp4')
+
+
+def measure(func, requests):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<20} mean {statistics.mean(timings):7.2f} ms   p50 {statistics.median(timings):7.2f} ms   p99 {p99:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with mock_aws():
+        reset_clients()
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        s3.put_object(Bucket=BUCKET, Key='lecture.mp4', Body=b'0' * 1024)
+
+        # Warm up imports and the registry before timing
+        per_request_client()
+        shared_client()
+
+        report('per-request client', measure(per_request_client, args.requests))
+        report('shared client', measure(shared_client, args.requests))
+        reset_clients()
+
+
+if __name__ == '__main__':
+    main()
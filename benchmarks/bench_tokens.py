@@ -0,0 +1,83 @@
+"""Token counting cost on transcript-sized texts, before and after the cached encoder.
+
+Needs the cl100k_base BPE file, which tiktoken downloads on first use:
+
+    python -m benchmarks.bench_tokens --repeat 5
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+import django
+
+django.setup()
+
+import tiktoken
+
+from awstranscribe.utils import calculate_tokens, calculate_tokens_batch, get_encoding
+
+# About 150 spoken words per minute
+WORDS_PER_HOUR = 150 * 60
+VOCABULARY = (
+    "the of and to in is that for it as was with be by on not he this are or his from at which but "
+    "have an they you were her she there been one all we their has would when if so no what up out "
+    "lecture student energy equation function theorem example protein cell market model data "
+    "um uh okay right so basically actually, really. Yes? 1984 3.14 42%"
+).split()
+
+
+def synthetic_transcript(hours, seed=0):
+    rng = random.Random(seed)
+    words = [rng.choice(VOCABULARY) for _ in range(int(hours * WORDS_PER_HOUR))]
+    sentences = [' '.join(words[index:index + 12]).capitalize() + '.' for index in range(0, len(words), 12)]
+    return ' '.join(sentences)
+
+
+def calculate_tokens_before(text):
+    # The original implementation: encoding lookup and a full token list on every call
+    encoding = tiktoken.get_encoding('cl100k_base')
+    return len(encoding.encode(text))
+
+
+def measure(func, *args, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, statistics.median(timings), peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--hours', type=float, nargs='+', default=[0.25, 1, 3, 6])
+    args = parser.parse_args()
+
+    get_encoding()
+    texts = [synthetic_transcript(hours, seed=index) for index, hours in enumerate(args.hours)]
+
+    print(f"{'transcript':<12} {'chars':>10} {'tokens':>9} {'before ms':>10} {'after ms':>9} {'before MiB':>11} {'after MiB':>10}")
+    for hours, text in zip(args.hours, texts):
+        tokens, before_ms, before_peak = measure(calculate_tokens_before, text, repeat=args.repeat)
+        counted, after_ms, after_peak = measure(calculate_tokens, text, repeat=args.repeat)
+        assert tokens == counted, (tokens, counted)
+        print(f"{hours:>9.2f} h {len(text):>10} {tokens:>9} {before_ms:>10.1f} {after_ms:>9.1f} {before_peak:>11.1f} {after_peak:>10.1f}")
+
+    _, sequential_ms, _ = measure(lambda: [calculate_tokens(text) for text in texts], repeat=args.repeat)
+    _, batch_ms, _ = measure(calculate_tokens_batch, texts, repeat=args.repeat)
+    print(f"\nall {len(texts)} transcripts: sequential {sequential_ms:.1f} ms, batch {batch_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Peak memory and time of compacting Transcribe output, whole-document json.loads versus streaming.
+
+Synthetic transcripts in the Transcribe output format (per-word items with alternatives and
+confidences, speaker labels) are written to temporary files, then compacted the way S3 bodies are:
+
+    python -m benchmarks.bench_transcript_parsing --hours 1 4 8
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+import django
+
+django.setup()
+
+from awstranscribe.engines import TRANSCRIPT_CHUNK_SIZE
+from awstranscribe.transcripts import compact_transcript, compact_transcript_stream
+
+from .bench_tokens import VOCABULARY, WORDS_PER_HOUR
+
+
+def synthetic_transcript(hours, seed=0):
+    # Transcribe output for `hours` of speech, as a dict
+    rng = random.Random(seed)
+    items, turns, words = [], [], []
+    clock = 0.0
+    for index in range(int(hours * WORDS_PER_HOUR)):
+        start, clock = clock, clock + rng.uniform(0.2, 0.6)
+        speaker = f"spk_{index // 40 % 2}"
+        content = rng.choice(VOCABULARY).strip('.,?%')
+        words.append(content)
+        items.append({
+            'start_time': f'{start:.3f}', 'end_time': f'{clock:.3f}', 'speaker_label': speaker, 'type': 'pronunciation',
+            'alternatives': [{'confidence': f'{rng.uniform(0.6, 1):.4f}', 'content': content}],
+        })
+        turns.append({'start_time': f'{start:.3f}', 'end_time': f'{clock:.3f}', 'speaker_label': speaker})
+        if index % 12 == 11:
+            words[-1] += '.'
+            items.append({'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': '.'}]})
+    return {
+        'jobName': 'benchmark', 'accountId': '000000000000', 'status': 'COMPLETED',
+        'results': {
+            'transcripts': [{'transcript': ' '.join(words)}],
+            'speaker_labels': {'speakers': 2, 'segments': [{'speaker_label': 'spk_0', 'items': turns}]},
+            'items': items,
+        },
+    }
+
+
+def write_synthetic_transcript(path, hours, seed=0):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(synthetic_transcript(hours, seed), file)
+    return os.path.getsize(path)
+
+
+def parse_whole(path):
+    # The original path: the body read at once, decoded, then the full dict tree built
+    with open(path, 'rb') as file:
+        content = file.read().decode('utf-8')
+    return compact_transcript(json.loads(content))
+
+
+def parse_streaming(path):
+    with open(path, 'rb') as file:
+        return compact_transcript_stream(iter(lambda: file.read(TRANSCRIPT_CHUNK_SIZE), b''))
+
+
+def measure(func, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(path)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{'transcript':<12} {'MiB':>7} {'segments':>9} {'loads ms':>9} {'stream ms':>10} {'loads MiB':>10} {'stream MiB':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for index, hours in enumerate(args.hours):
+            path = os.path.join(directory, f'{index}.json')
+            size = write_synthetic_transcript(path, hours, seed=index)
+            whole, whole_ms, whole_peak = measure(parse_whole, path)
+            streamed, stream_ms, stream_peak = measure(parse_streaming, path)
+            assert whole == streamed
+            print(
+                f"{hours:>9.2f} h {size / 1024 / 1024:>7.1f} {len(streamed['segments']):>9} {whole_ms:>9.0f} "
+                f"{stream_ms:>10.0f} {whole_peak:>10.1f} {stream_peak:>11.1f}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""In-process stand-ins for S3, Transcribe and OpenAI with injected latency, for the benchmarks.
+
+The AWS fakes replace the shared clients of awstranscribe.aws, so every code path that calls
+get_client() uses them. OpenAI is faked one level lower: the real SDK clients of
+awstranscribe.openai_client talk to an httpx MockTransport, so request building, response parsing
+and the client's rate limits are measured too. Every upstream call sleeps for `latency` seconds.
+"""
+import asyncio
+import datetime
+import hashlib
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+from botocore.exceptions import ClientError
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+from awstranscribe import aws, openai_client
+from awstranscribe.metrics import acount_openai_attempt, count_openai_attempt
+
+
+class FakeBody:
+    # The parts of botocore's StreamingBody the app uses
+
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size=1024):
+        for start in range(0, len(self.data), chunk_size):
+            yield self.data[start:start + chunk_size]
+
+    def read(self):
+        return self.data
+
+    def close(self):
+        pass
+
+
+class FakeS3Client:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self.uploads = {}
+        self.lock = threading.Lock()
+        self.upload_ids = itertools.count(1)
+
+    def put(self, bucket, key, data):
+        # Stores an object without the latency, for seeding
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        with self.lock:
+            self.objects[(bucket, key)] = (data, etag, datetime.datetime.now(datetime.timezone.utc))
+        return etag
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        time.sleep(self.latency)
+        return {'ETag': self.put(Bucket, Key, bytes(Body))}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        time.sleep(self.latency)
+        self.put(Bucket, Key, Fileobj.read())
+
+    def get_object(self, Bucket, Key):
+        data, etag, last_modified = self._get(Bucket, Key, 'GetObject')
+        return {'Body': FakeBody(data), 'ETag': etag, 'ContentLength': len(data), 'LastModified': last_modified}
+
+    def head_object(self, Bucket, Key):
+        data, etag, last_modified = self._get(Bucket, Key, 'HeadObject')
+        return {'ETag': etag, 'ContentLength': len(data), 'LastModified': last_modified}
+
+    def list_objects_v2(self, Bucket, ContinuationToken=None, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket)
+            start = int(ContinuationToken or 0)
+            contents = [
+                {'Key': key, 'Size': len(self.objects[(Bucket, key)][0]), 'ETag': self.objects[(Bucket, key)][1],
+                 'LastModified': self.objects[(Bucket, key)][2]}
+                for key in keys[start:start + 1000]
+            ]
+        page = {'Contents': contents, 'IsTruncated': start + 1000 < len(keys)}
+        if page['IsTruncated']:
+            page['NextContinuationToken'] = str(start + 1000)
+        return page
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        time.sleep(self.latency)
+        upload_id = f'upload-{next(self.upload_ids)}'
+        with self.lock:
+            self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        time.sleep(self.latency)
+        data = Body.read() if hasattr(Body, 'read') else bytes(Body)
+        with self.lock:
+            self.uploads[UploadId][PartNumber] = data
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        time.sleep(self.latency)
+        with self.lock:
+            parts = self.uploads.pop(UploadId, {})
+        self.put(Bucket, Key, b''.join(parts.get(part['PartNumber'], b'') for part in MultipartUpload['Parts']))
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        time.sleep(self.latency)
+        with self.lock:
+            self.uploads.pop(UploadId, None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        # Signed locally by boto3, no request is made
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature=fake"
+
+    def _get(self, bucket, key, operation):
+        time.sleep(self.latency)
+        with self.lock:
+            obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}, 'ResponseMetadata': {'HTTPStatusCode': 404}}, operation)
+        return obj
+
+
+class FakeTranscribeClient:
+    """Jobs complete `job_seconds` after they start; the transcript is then written to the fake S3.
+
+    Standard and medical jobs are both handled, like by the one boto3 `transcribe` client.
+    """
+
+    class exceptions:
+        class BadRequestException(ClientError):
+            pass
+
+    def __init__(self, s3, transcript_bucket, transcript, latency=0.0, job_seconds=0.0):
+        self.s3 = s3
+        self.transcript_bucket = transcript_bucket
+        self.transcript = transcript
+        self.latency = latency
+        self.job_seconds = job_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        return {'TranscriptionJob': self._start(TranscriptionJobName, 'TranscriptionJob', '')}
+
+    def start_medical_transcription_job(self, MedicalTranscriptionJobName, **kwargs):
+        return {'MedicalTranscriptionJob': self._start(MedicalTranscriptionJobName, 'MedicalTranscriptionJob', 'medical/')}
+
+    def get_transcription_job(self, TranscriptionJobName):
+        return {'TranscriptionJob': self._get(TranscriptionJobName)}
+
+    def get_medical_transcription_job(self, MedicalTranscriptionJobName):
+        return {'MedicalTranscriptionJob': self._get(MedicalTranscriptionJobName)}
+
+    def list_transcription_jobs(self, Status, **kwargs):
+        return {'TranscriptionJobSummaries': self._list(Status, 'TranscriptionJob')}
+
+    def list_medical_transcription_jobs(self, Status, **kwargs):
+        return {'MedicalTranscriptionJobSummaries': self._list(Status, 'MedicalTranscriptionJob')}
+
+    def _start(self, job_name, kind, prefix):
+        time.sleep(self.latency)
+        job = {'kind': kind, 'prefix': prefix, 'started': time.monotonic(),
+               'CreationTime': datetime.datetime.now(datetime.timezone.utc)}
+        with self.lock:
+            job = self.jobs.setdefault(job_name, job)
+        return self._describe(job_name, job)
+
+    def _get(self, job_name):
+        time.sleep(self.latency)
+        with self.lock:
+            job = self.jobs.get(job_name)
+        if job is None:
+            raise self.exceptions.BadRequestException({'Error': {'Code': 'BadRequestException'}}, 'GetTranscriptionJob')
+        return self._describe(job_name, job)
+
+    def _list(self, status, kind):
+        time.sleep(self.latency)
+        with self.lock:
+            jobs = [(name, job) for name, job in self.jobs.items() if job['kind'] == kind]
+        described = [self._describe(name, job) for name, job in jobs]
+        return [details for details in described if details['TranscriptionJobStatus'] == status]
+
+    def _describe(self, job_name, job):
+        name_key = f"{job['kind']}Name"
+        details = {name_key: job_name, 'CreationTime': job['CreationTime']}
+        if time.monotonic() - job['started'] < self.job_seconds:
+            details['TranscriptionJobStatus'] = 'IN_PROGRESS'
+            return details
+        key = f"{job['prefix']}{job_name}.json"
+        if (self.transcript_bucket, key) not in self.s3.objects:
+            self.s3.put(self.transcript_bucket, key, self.transcript)
+        details['TranscriptionJobStatus'] = 'COMPLETED'
+        details['Transcript'] = {'TranscriptFileUri': f"https://s3.us-east-1.amazonaws.com/{self.transcript_bucket}/{key}"}
+        return details
+
+
+class FakeOpenAI:
+    """Answers the OpenAI REST calls the app makes. `summary` is the text of every completion."""
+
+    def __init__(self, latency=0.0, summary='A short summary of the lecture.'):
+        self.latency = latency
+        self.summary = summary
+        self.ids = itertools.count(1)
+
+    def handle(self, request):
+        time.sleep(self.latency)
+        return self.respond(request)
+
+    async def ahandle(self, request):
+        await asyncio.sleep(self.latency)
+        return self.respond(request)
+
+    def respond(self, request):
+        method, parts = request.method, request.url.path.strip('/').split('/')[1:]
+        if method == 'DELETE':
+            return httpx.Response(200, json={'id': parts[-1], 'object': parts[0].rstrip('s'), 'deleted': True})
+        if parts == ['chat', 'completions']:
+            body = json.loads(request.content)
+            return self.completion(body) if not body.get('stream') else self.completion_stream(body)
+        if parts == ['files']:
+            return httpx.Response(200, json={'id': self.new_id('file'), 'object': 'file', 'purpose': 'assistants', 'status': 'processed'})
+        if parts[0] == 'assistants':
+            return httpx.Response(200, json={'id': parts[1] if len(parts) > 1 else self.new_id('asst'), 'object': 'assistant', 'tools': []})
+        if parts == ['threads']:
+            return httpx.Response(200, json={
+                'id': self.new_id('thread'), 'object': 'thread', 'metadata': {},
+                'tool_resources': {'file_search': {'vector_store_ids': [self.new_id('vs')]}},
+            })
+        if parts[0] == 'threads' and parts[2] == 'messages':
+            message = {'id': self.new_id('msg'), 'object': 'thread.message', 'role': 'assistant',
+                       'content': [{'type': 'text', 'text': {'value': self.summary, 'annotations': []}}]}
+            if method == 'GET':
+                return httpx.Response(200, json={'object': 'list', 'data': [message], 'has_more': False})
+            return httpx.Response(200, json=message)
+        if parts[0] == 'threads' and parts[2] == 'runs':
+            run_id = parts[3] if len(parts) > 3 else self.new_id('run')
+            return httpx.Response(200, json={'id': run_id, 'object': 'thread.run', 'status': 'completed'})
+        return httpx.Response(404, json={'error': {'message': f'No fake for {method} {request.url.path}'}})
+
+    def completion(self, body):
+        return httpx.Response(200, json={
+            'id': self.new_id('chatcmpl'), 'object': 'chat.completion', 'created': int(time.time()), 'model': body['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.summary}, 'finish_reason': 'stop'}],
+            'usage': self.usage(body),
+        })
+
+    def completion_stream(self, body):
+        base = {'id': self.new_id('chatcmpl'), 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body['model']}
+        events = [
+            {**base, 'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}
+            for word in self.summary.split()
+        ]
+        events.append({**base, 'choices': [], 'usage': self.usage(body)})
+        content = ''.join(f'data: {json.dumps(event)}\n\n' for event in events) + 'data: [DONE]\n\n'
+        return httpx.Response(200, content=content.encode(), headers={'Content-Type': 'text/event-stream'})
+
+    def usage(self, body):
+        # About four characters per token is close enough here
+        prompt = sum(len(message['content']) for message in body['messages']) // 4
+        completion = len(self.summary) // 4
+        return {'prompt_tokens': prompt, 'completion_tokens': completion, 'total_tokens': prompt + completion}
+
+    def new_id(self, prefix):
+        return f'{prefix}_{next(self.ids)}'
+
+
+@contextmanager
+def installed(s3, transcribe, openai):
+    """Makes the app use the fakes until the block exits, the real clients are created again after."""
+    aws._clients.update({'s3': s3, 'transcribe': transcribe})
+    # Same event hooks as the real clients, so OpenAI metrics work the same way
+    openai_client._clients.update({
+        'client': OpenAI(api_key='benchmark', max_retries=0, http_client=DefaultHttpxClient(
+            transport=httpx.MockTransport(openai.handle), event_hooks={'request': [count_openai_attempt]})),
+        'async_client': AsyncOpenAI(api_key='benchmark', max_retries=0, http_client=DefaultAsyncHttpxClient(
+            transport=httpx.MockTransport(openai.ahandle), event_hooks={'request': [acount_openai_attempt]})),
+    })
+    try:
+        yield
+    finally:
+        aws.reset_clients()
+        openai_client.reset_clients()
@@ -0,0 +1,186 @@
+"""Concurrent load on the WSGI endpoints versus their api/async/ counterparts, against local stubs.
+
+OpenAI and AWS are replaced by stubs that sleep for --latency seconds, so the numbers show how
+many slow upstream calls each path keeps in flight, not the speed of the upstream services.
+WSGI requests are served by --wsgi-workers threads (like gunicorn's gthread workers), ASGI
+requests by one event loop:
+
+    python -m benchmarks.loadtest_asgi --requests 200 --concurrency 100 --latency 0.2
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+from rest_framework.authtoken.models import Token
+
+from awstranscribe.listing import reset_bucket_indexes
+
+ENDPOINTS = {
+    'summarize': ('/api/summarize/', '/api/async/summarize/'),
+    'transcribe': ('/api/transcribe/', '/api/async/transcribe/'),
+    's3-files': ('/api/s3-files/', '/api/async/s3-files/'),
+}
+
+
+class SlowTranscribeClient:
+    """Transcribe stub: every call takes `latency` seconds, every job is new."""
+
+    class exceptions:
+        class BadRequestException(Exception):
+            pass
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def get_transcription_job(self, TranscriptionJobName):
+        time.sleep(self.latency)
+        raise self.exceptions.BadRequestException(TranscriptionJobName)
+
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        time.sleep(self.latency)
+        return {'TranscriptionJob': {'TranscriptionJobName': TranscriptionJobName, 'TranscriptionJobStatus': 'IN_PROGRESS'}}
+
+
+class SlowS3Client:
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def list_objects_v2(self, **kwargs):
+        time.sleep(self.latency)
+        contents = [
+            {'Key': f'lecture-{index:04}.mp4', 'LastModified': datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc), 'Size': index, 'ETag': '"e"'}
+            for index in range(100)
+        ]
+        return {'Contents': contents, 'IsTruncated': False}
+
+
+def completion(content):
+    message = mock.Mock()
+    message.content = content
+    return mock.Mock(choices=[mock.Mock(message=message)])
+
+
+def stubs(latency):
+    def chat_complete(text, instructions=None):
+        time.sleep(latency)
+        return completion('summary')
+
+    async def acomplete_text(text, instructions):
+        await asyncio.sleep(latency)
+        return 'summary'
+
+    return [
+        mock.patch('awstranscribe.views.chat_complete', chat_complete),
+        mock.patch('awstranscribe.views.calculate_tokens', return_value=100),
+        mock.patch('awstranscribe.views.check_token_limit_status', return_value=True),
+        mock.patch('awstranscribe.async_views.acomplete_text', acomplete_text),
+        mock.patch('awstranscribe.async_views.calculate_tokens', return_value=100),
+        mock.patch('awstranscribe.engines.get_transcribe_client', return_value=SlowTranscribeClient(latency)),
+        mock.patch('awstranscribe.listing.get_client', return_value=SlowS3Client(latency)),
+    ]
+
+
+def request_kwargs(endpoint, index):
+    if endpoint == 'summarize':
+        return 'post', {'data': {'text': f'Lecture number {index}.'}, 'content_type': 'application/json'}
+    if endpoint == 'transcribe':
+        return 'post', {'data': {'s3_url': f'https://media.s3.amazonaws.com/lecture-{index}.mp4'}, 'content_type': 'application/json'}
+    return 'get', {}
+
+
+def run_wsgi(path, endpoint, requests, workers, headers):
+    def one(index):
+        method, kwargs = request_kwargs(endpoint, index)
+        start = time.perf_counter()
+        response = getattr(Client(), method)(path, headers=headers, **kwargs)
+        assert response.status_code < 300, (response.status_code, response.content)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        timings = list(executor.map(one, range(requests)))
+    return timings, time.perf_counter() - start
+
+
+def run_asgi(path, endpoint, requests, concurrency, headers):
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def one(index):
+            method, kwargs = request_kwargs(endpoint, index)
+            async with semaphore:
+                start = time.perf_counter()
+                response = await getattr(client, method)(path, headers=headers, **kwargs)
+                assert response.status_code < 300, (response.status_code, response.content)
+                return (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(one(index) for index in range(requests)))
+
+    start = time.perf_counter()
+    timings = asyncio.run(run())
+    return timings, time.perf_counter() - start
+
+
+def report(name, timings, elapsed):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(f"{name:<22} {len(timings) / elapsed:8.1f} req/s   p50 {statistics.median(timings):8.1f} ms   p99 {p99:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=100, help='requests in flight on the ASGI path')
+    parser.add_argument('--wsgi-workers', type=int, default=8, help='threads serving the WSGI path')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each stubbed upstream call takes')
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    args = parser.parse_args()
+
+    # A file database, the in-memory one locks up under concurrent writers
+    connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'loadtest.sqlite3')
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    token = Token.objects.create(user=User.objects.create_user('loadtest', password='loadtest'))
+    headers = {'Authorization': f'Token {token.key}'}
+
+    patches = stubs(args.latency)
+    for patch in patches:
+        patch.start()
+    overrides = override_settings(
+        SUMMARY_CACHE_ENABLED=False, TRANSCRIBE_POLLER_AUTOSTART=False, AWS_STORAGE_BUCKET_NAME='media',
+    )
+    overrides.enable()
+    try:
+        for endpoint in args.endpoints:
+            wsgi_path, asgi_path = ENDPOINTS[endpoint]
+            reset_bucket_indexes()
+            report(f"{endpoint} wsgi", *run_wsgi(wsgi_path, endpoint, args.requests, args.wsgi_workers, headers))
+            reset_bucket_indexes()
+            report(f"{endpoint} asgi", *run_asgi(asgi_path, endpoint, args.requests, args.concurrency, headers))
+    finally:
+        overrides.disable()
+        for patch in reversed(patches):
+            patch.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""Every endpoint of server/urls.py under concurrent load, plus micro-benchmarks of the hot paths.
+
+S3, Transcribe and OpenAI are the in-process fakes of benchmarks.fakes, every upstream call
+taking --latency seconds. For each endpoint the throughput, p50/p99 latency and peak Python heap
+(a separate, traced pass of --memory-requests requests) are reported; results are written as
+JSON with the commit they were measured at, and --compare prints the change against an earlier
+run:
+
+    python -m benchmarks.suite --output before.json
+    git checkout my-branch
+    python -m benchmarks.suite --output after.json --compare before.json
+
+Fake transcription jobs stay IN_PROGRESS for --job-seconds after they start (0, the default,
+completes them at once), so the poller and the status endpoints are measured without waiting on
+AWS; fake assistant runs are completed by the time they are created, so summaries only pay the
+--latency of each call.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+import django
+
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings, setup_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from awstranscribe.assistants import cleanup_executor
+from awstranscribe.background import enqueue
+from awstranscribe.engines import get_engine
+from awstranscribe.jobs import job_name_for, record_job
+from awstranscribe.listing import reset_bucket_indexes
+from awstranscribe.models import TranscriptionBatch, TranscriptionJob
+from awstranscribe.serializers import TranscriptionJobSerializer
+from awstranscribe.transcripts import compact_transcript_stream, segments_between, store_compact_transcript
+from awstranscribe.utils import calculate_tokens
+from server.urls import urlpatterns
+
+from .bench_tokens import synthetic_transcript as synthetic_text
+from .bench_transcript_parsing import synthetic_transcript
+from .fakes import FakeOpenAI, FakeS3Client, FakeTranscribeClient, installed
+
+BUCKET = 'media'
+TRANSCRIPT_BUCKET = 'transcripts'
+EVENTS_SECRET = 'benchmark'
+
+
+class Scenario:
+    """One endpoint: `request(index)` returns (method, path, client keyword arguments)."""
+
+    def __init__(self, route, request, asgi=False):
+        self.route = route
+        self.request = request
+        self.asgi = asgi
+
+
+def scenarios(seed):
+    def json_body(data):
+        return {'data': data, 'content_type': 'application/json'}
+
+    def upload(index):
+        return {'data': {'file': SimpleUploadedFile(f'upload-{index}.txt', b'x' * seed['upload_size'], 'text/plain')}}
+
+    def lecture_url(index):
+        return f"https://{BUCKET}.s3.amazonaws.com/lecture-{index}.mp4"
+
+    job = seed['job']
+    return [
+        Scenario('api/register/', lambda i: ('post', '/api/register/', json_body({'username': f'user-{i}-{time.monotonic_ns()}', 'password': 'benchmark'}))),
+        Scenario('api/login/', lambda i: ('post', '/api/login/', json_body({'username': 'benchmark', 'password': 'benchmark'}))),
+        Scenario('api/upload/', lambda i: ('post', '/api/upload/', upload(i))),
+        Scenario('api/upload/presign/', lambda i: ('post', '/api/upload/presign/', json_body({'file_name': f'lecture-{i}.mp4', 'file_size': 64 * 1024 * 1024}))),
+        Scenario('api/upload/complete/', lambda i: ('post', '/api/upload/complete/', json_body({'key': 'lecture-0.mp4'}))),
+        Scenario('api/upload/abort/', lambda i: ('post', '/api/upload/abort/', json_body({'key': f'lecture-{i}.mp4', 'upload_id': f'upload-{i}'}))),
+        Scenario('api/transcribe/', lambda i: ('post', '/api/transcribe/', json_body({'s3_url': lecture_url(i)}))),
+        Scenario('api/transcribe/batch/', lambda i: ('post', '/api/transcribe/batch/', json_body({'s3_urls': [lecture_url(f'{i}-{n}') for n in range(10)]}))),
+        Scenario('api/transcribe/batch/<int:batch_id>/', lambda i: ('get', f"/api/transcribe/batch/{seed['batch'].pk}/", {})),
+        Scenario('api/transcribe/events/', lambda i: ('post', '/api/transcribe/events/', {
+            **json_body({'source': 'aws.transcribe', 'detail': {'TranscriptionJobName': f'unknown-{i}', 'TranscriptionJobStatus': 'COMPLETED'}}),
+            'headers': {'X-Events-Secret': EVENTS_SECRET},
+        })),
+        Scenario('api/transcribe/<str:job_id>/status/', lambda i: ('get', f'/api/transcribe/{job.job_name}/status/', {})),
+        Scenario('api/transcribe/<str:job_id>/result/', lambda i: ('get', f'/api/transcribe/{job.job_name}/result/', {})),
+        Scenario('api/transcribe/<str:job_id>/text/', lambda i: ('get', f'/api/transcribe/{job.job_name}/text/', {})),
+        Scenario('api/transcribe/<str:job_id>/segments/', lambda i: ('get', f'/api/transcribe/{job.job_name}/segments/?start=60&end=300', {})),
+        Scenario('api/transcribe/<str:job_id>/summary/', lambda i: ('get', f'/api/transcribe/{job.job_name}/summary/', {})),
+        Scenario('api/transcribe-medical/', lambda i: ('post', '/api/transcribe-medical/', json_body({'s3_url': lecture_url(i)}))),
+        Scenario('api/s3-files/', lambda i: ('get', '/api/s3-files/?limit=100', {})),
+        Scenario('api/summarize/', lambda i: ('post', '/api/summarize/', json_body({'text': f"{i}. {seed['text']}"}))),
+        Scenario('api/summarize-file/', lambda i: ('post', '/api/summarize-file/', {
+            'data': {'file': SimpleUploadedFile(f'lecture-{i}.txt', f"{i}. {seed['text']}".encode(), 'text/plain')},
+        })),
+        Scenario('api/cache-stats/', lambda i: ('get', '/api/cache-stats/', {})),
+        Scenario('api/metrics/', lambda i: ('get', '/api/metrics/', {})),
+        Scenario('api/jobs/<int:job_id>/', lambda i: ('get', f"/api/jobs/{seed['background_job'].pk}/", {})),
+        Scenario('api/async/transcribe/', lambda i: ('post', '/api/async/transcribe/', json_body({'s3_url': lecture_url(f'async-{i}')})), asgi=True),
+        Scenario('api/async/transcribe/<str:job_id>/status/', lambda i: ('get', f'/api/async/transcribe/{job.job_name}/status/', {}), asgi=True),
+        Scenario('api/async/transcribe-medical/', lambda i: ('post', '/api/async/transcribe-medical/', json_body({'s3_url': lecture_url(f'async-{i}')})), asgi=True),
+        Scenario('api/async/s3-files/', lambda i: ('get', '/api/async/s3-files/?limit=100', {}), asgi=True),
+        Scenario('api/async/summarize/', lambda i: ('post', '/api/async/summarize/', json_body({'text': f"async {i}. {seed['text']}"})), asgi=True),
+    ]
+
+
+def seed_data(args, s3, transcript):
+    user = User.objects.create_user('benchmark', password='benchmark')
+    token = Token.objects.create(user=user)
+    for index in range(args.bucket_objects):
+        s3.put(BUCKET, f'lecture-{index}.mp4', b'0' * 1024)
+    # A completed job with its compact transcript; the raw one is read from the fake S3
+    s3_url = f"https://{BUCKET}.s3.amazonaws.com/completed.mp4"
+    job_name = job_name_for(s3_url, TranscriptionJob.STANDARD)
+    details = get_engine(TranscriptionJob.STANDARD).start_job(job_name, s3_url)
+    job = record_job(job_name, TranscriptionJob.STANDARD, s3_url, details)
+    store_compact_transcript(job, [transcript])
+    batch = TranscriptionBatch.objects.create(job_type=TranscriptionJob.STANDARD)
+    batch.jobs.set([job])
+    return {
+        'headers': {'Authorization': f'Token {token.key}'},
+        'job': job,
+        'batch': batch,
+        'background_job': enqueue('summarize', {'text': 'A queued lecture.'}),
+        'text': synthetic_text(args.text_minutes / 60),
+        'upload_size': args.upload_kib * 1024,
+    }
+
+
+def run_requests(scenario, headers, requests, concurrency):
+    # Returns (timings in ms of the successful requests, errors, elapsed seconds)
+    if scenario.asgi:
+        return asyncio.run(_run_asgi(scenario, headers, requests, concurrency))
+
+    def one(index):
+        method, path, kwargs = scenario.request(index)
+        kwargs['headers'] = {**headers, **kwargs.get('headers', {})}
+        start = time.perf_counter()
+        # Exceptions in views become 500s, like under a real server
+        response = getattr(Client(raise_request_exception=False), method)(path, **kwargs)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return (time.perf_counter() - start) * 1000, error_of(method, path, response)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    return split_results(results, time.perf_counter() - start)
+
+
+async def _run_asgi(scenario, headers, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    client = AsyncClient(raise_request_exception=False)
+
+    async def one(index):
+        method, path, kwargs = scenario.request(index)
+        kwargs['headers'] = {**headers, **kwargs.get('headers', {})}
+        async with semaphore:
+            start = time.perf_counter()
+            response = await getattr(client, method)(path, **kwargs)
+            return (time.perf_counter() - start) * 1000, error_of(method, path, response)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(index) for index in range(requests)))
+    return split_results(results, time.perf_counter() - start)
+
+
+def error_of(method, path, response):
+    if response.status_code < 400:
+        return None
+    content = b'' if response.streaming else response.content[:200]
+    return f"{method.upper()} {path}: {response.status_code} {content!r}"
+
+
+def split_results(results, elapsed):
+    timings = [timing for timing, error in results if error is None]
+    errors = [error for timing, error in results if error is not None]
+    return timings, errors, elapsed
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def summarize_timings(timings):
+    return {
+        'p50_ms': round(statistics.median(timings), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
+
+
+def peak_memory(func):
+    # Peak traced Python heap while func runs, in MiB
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 / 1024, 3)
+
+
+def bench_endpoint(scenario, headers, args):
+    timings, errors, elapsed = run_requests(scenario, headers, args.requests, args.concurrency)
+    if not timings:
+        return {'error': errors[0]}
+    result = {
+        'requests': len(timings) + len(errors),
+        'errors': len(errors),
+        'throughput_rps': round(len(timings) / elapsed, 2),
+        **summarize_timings(timings),
+    }
+    if errors:
+        result['first_error'] = errors[0]
+    memory_requests = min(args.memory_requests, args.requests)
+    if memory_requests:
+        result['peak_mib'] = peak_memory(lambda: run_requests(scenario, headers, memory_requests, args.concurrency))
+    return result
+
+
+def bench_micro(name, func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'repeat': repeat, **summarize_timings(timings), 'peak_mib': peak_memory(func)}
+
+
+def micro_benchmarks(args, seed, s3):
+    job = seed['job']
+    jobs = list(TranscriptionJob.objects.all()[:100])
+    transcript = job.compact_transcript
+    key = job.transcript_key
+
+    def read_and_compact():
+        return compact_transcript_stream(s3.get_object(Bucket=TRANSCRIPT_BUCKET, Key=key)['Body'].iter_chunks(64 * 1024))
+
+    benchmarks = {
+        'calculate_tokens': lambda: calculate_tokens(seed['text']),
+        # Reading Transcribe output from S3, then reducing it to segments
+        'read_transcript': lambda: get_engine(job.job_type).read_transcript(key),
+        'compact_transcript_stream': read_and_compact,
+        'serialize_jobs': lambda: JSONRenderer().render(TranscriptionJobSerializer(jobs, many=True).data),
+        'serialize_segments': lambda: JSONRenderer().render(list(segments_between(transcript).values('start', 'end', 'speaker', 'text'))),
+    }
+    results = {}
+    for name, func in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        try:
+            results[name] = bench_micro(name, func, args.repeat)
+        except Exception as error:
+            # calculate_tokens needs tiktoken's BPE file, which is downloaded on first use
+            results[name] = {'error': f'{type(error).__name__}: {error}'}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(title, results, baseline=None):
+    print(f"\n{title}")
+    print(f"{'':<44} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'MiB':>7} {'errors':>7}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<44} {result['error'][:120]}")
+            continue
+        line = (
+            f"{name:<44} {result.get('throughput_rps', ''):>9} {result['p50_ms']:>9.1f} "
+            f"{result['p99_ms']:>9.1f} {result.get('peak_mib', ''):>7} {result.get('errors', ''):>7}"
+        )
+        before = (baseline or {}).get(name)
+        if before and 'p50_ms' in before:
+            line += f"   p50 {change(before['p50_ms'], result['p50_ms'])}  p99 {change(before['p99_ms'], result['p99_ms'])}"
+        print(line)
+
+
+def change(before, after):
+    if not before:
+        return '   n/a'
+    return f"{(after - before) / before * 100:+6.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight')
+    parser.add_argument('--memory-requests', type=int, default=10, help='requests of the traced pass, 0 to skip it')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds each fake upstream call takes')
+    parser.add_argument('--job-seconds', type=float, default=0, help='seconds before a fake transcription job completes')
+    parser.add_argument('--transcript-minutes', type=float, default=60, help='length of the fake transcripts')
+    parser.add_argument('--text-minutes', type=float, default=10, help='length of the texts summarized')
+    parser.add_argument('--openai-rpm', type=int, default=0, help='OPENAI_REQUESTS_PER_MINUTE, 0 for no limit')
+    parser.add_argument('--openai-tpm', type=int, default=0, help='OPENAI_TOKENS_PER_MINUTE, 0 for no limit')
+    parser.add_argument('--upload-kib', type=int, default=256)
+    parser.add_argument('--bucket-objects', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20, help='runs of each micro-benchmark')
+    parser.add_argument('--only', nargs='+', help='endpoint routes or micro-benchmark names to run')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+    # Failed requests are counted in the results, their tracebacks would drown the table
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+    # A file database, the in-memory one locks up under concurrent writers
+    connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+    transcript = json.dumps(synthetic_transcript(args.transcript_minutes / 60)).encode()
+    s3 = FakeS3Client(args.latency)
+    transcribe = FakeTranscribeClient(s3, TRANSCRIPT_BUCKET, transcript, args.latency, args.job_seconds)
+    overrides = override_settings(
+        AWS_STORAGE_BUCKET_NAME=BUCKET, AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS=TRANSCRIPT_BUCKET,
+        TRANSCRIBE_BACKEND='aws', TRANSCRIBE_POLLER_AUTOSTART=False, TRANSCRIBE_EVENTS_SECRET=EVENTS_SECRET,
+        METRICS_LOG_REQUESTS=False, OPENAI_REQUESTS_PER_MINUTE=args.openai_rpm, OPENAI_TOKENS_PER_MINUTE=args.openai_tpm,
+        # No worker runs here, the summary endpoint makes the summary itself
+        TRANSCRIPT_AUTO_SUMMARIZE=False,
+    )
+    with installed(s3, transcribe, FakeOpenAI(args.latency)), overrides:
+        reset_bucket_indexes()
+        seed = seed_data(args, s3, transcript)
+        all_scenarios = scenarios(seed)
+        covered = {scenario.route for scenario in all_scenarios}
+        missing = [str(pattern.pattern) for pattern in urlpatterns if str(pattern.pattern) not in covered]
+        if missing:
+            print(f"No scenario for: {', '.join(missing)}")
+
+        endpoints = {}
+        for scenario in all_scenarios:
+            if args.only and scenario.route not in args.only:
+                continue
+            endpoints[scenario.route] = bench_endpoint(scenario, seed['headers'], args)
+        micro = micro_benchmarks(args, seed, s3)
+        # Assistant resources are deleted in the background, while the fakes are still there
+        cleanup_executor.shutdown(wait=True)
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'arguments': {name: value for name, value in vars(args).items() if name not in ['output', 'compare']},
+        'max_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'endpoints': endpoints,
+        'micro': micro,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    print_table('Endpoints', endpoints, baseline and baseline.get('endpoints'))
+    print_table('Micro-benchmarks', micro, baseline and baseline.get('micro'))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
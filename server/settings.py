@@ -44,6 +44,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
+    'awstranscribe',
 ]
 
 REST_FRAMEWORK = {
@@ -53,10 +54,15 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'EXCEPTION_HANDLER': 'awstranscribe.views.exception_handler',
 }
 
 MIDDLEWARE = [
+    # First, so the time spent in every other middleware is counted too
+    'awstranscribe.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # gzip, or brotli when installed; before anything else that reads or changes the response body
+    'awstranscribe.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -99,6 +105,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests use a file as well: threads sharing an in-memory database fail on each other's
+        # locks at once, where the file waits for them like it does when serving
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -153,6 +162,122 @@ AWS_S3_REGION_NAME = os.getenv('AWS_S3_REGION_NAME')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS = os.getenv('AWS_STORAGE_BUCKET_NAME_TRANSCRIPTS')
 
+# Shared boto3 clients (awstranscribe.aws), one connection pool per service and process
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '50'))
+AWS_CONNECT_TIMEOUT = float(os.getenv('AWS_CONNECT_TIMEOUT', '5'))
+AWS_READ_TIMEOUT = float(os.getenv('AWS_READ_TIMEOUT', '60'))
+AWS_MAX_ATTEMPTS = int(os.getenv('AWS_MAX_ATTEMPTS', '3'))
+
+# Streaming uploads (api/upload/?stream=true) pipe the request body into an S3 multipart upload.
+# Parts are at least 5 MiB, memory use is about (concurrency + 1) * part size.
+S3_STREAMING_UPLOADS = os.getenv('S3_STREAMING_UPLOADS', 'false').lower() == 'true'
+AWS_S3_MULTIPART_PART_SIZE = int(os.getenv('AWS_S3_MULTIPART_PART_SIZE', str(16 * 1024 * 1024)))
+AWS_S3_MULTIPART_CONCURRENCY = int(os.getenv('AWS_S3_MULTIPART_CONCURRENCY', '4'))
+
+# Lifetime of the presigned URLs issued by api/upload/presign/
+S3_PRESIGNED_URL_EXPIRES = int(os.getenv('S3_PRESIGNED_URL_EXPIRES', '3600'))
+
+# api/s3-files/ is served from an in-memory index of the bucket refreshed in the background
+S3_LIST_CACHE_TTL = float(os.getenv('S3_LIST_CACHE_TTL', '30'))
+S3_LIST_PAGE_SIZE = int(os.getenv('S3_LIST_PAGE_SIZE', '1000'))
+# Threads the ASGI views (api/async/...) run boto3 and other blocking calls on
+ASYNC_BLOCKING_WORKERS = int(os.getenv('ASYNC_BLOCKING_WORKERS', '32'))
+
 
 MEDIA_URL = '/uploads/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
+
+# Transcription service: 'aws' (Transcribe and Transcribe Medical) or 'local', an in-process
+# stand-in for tests and benchmarks that finishes jobs after TRANSCRIBE_LOCAL_DURATION seconds
+TRANSCRIBE_BACKEND = os.getenv('TRANSCRIBE_BACKEND', 'aws')
+TRANSCRIBE_LOCAL_DURATION = float(os.getenv('TRANSCRIBE_LOCAL_DURATION', '0'))
+# Defaults for jobs that do not pass language_code, media_format, specialty or type;
+# an empty TRANSCRIBE_MEDIA_FORMAT means the format is taken from the file extension
+TRANSCRIBE_LANGUAGE_CODE = os.getenv('TRANSCRIBE_LANGUAGE_CODE', 'en-US')
+TRANSCRIBE_MEDIA_FORMAT = os.getenv('TRANSCRIBE_MEDIA_FORMAT', '')
+TRANSCRIBE_MEDICAL_SPECIALTY = os.getenv('TRANSCRIBE_MEDICAL_SPECIALTY', 'PRIMARYCARE')
+TRANSCRIBE_MEDICAL_TYPE = os.getenv('TRANSCRIBE_MEDICAL_TYPE', 'DICTATION')
+
+# Transcription jobs are polled in the background instead of inside the request, backing off
+# from TRANSCRIBE_POLL_INTERVAL to TRANSCRIBE_POLL_MAX_INTERVAL while nothing changes
+TRANSCRIBE_POLL_INTERVAL = float(os.getenv('TRANSCRIBE_POLL_INTERVAL', '5'))
+TRANSCRIBE_POLL_MAX_INTERVAL = float(os.getenv('TRANSCRIBE_POLL_MAX_INTERVAL', '60'))
+# api/transcribe/batch/ jobs are started by the poller, never more than TRANSCRIBE_MAX_CONCURRENT_JOBS
+# at a time (keep it at or under the account's Transcribe concurrent job quota)
+TRANSCRIBE_MAX_CONCURRENT_JOBS = int(os.getenv('TRANSCRIBE_MAX_CONCURRENT_JOBS', '100'))
+TRANSCRIBE_SUBMIT_CONCURRENCY = int(os.getenv('TRANSCRIBE_SUBMIT_CONCURRENCY', '8'))
+TRANSCRIBE_BATCH_MAX_SIZE = int(os.getenv('TRANSCRIBE_BATCH_MAX_SIZE', '1000'))
+# Shared secret of api/transcribe/events/, the endpoint is disabled while it is empty
+TRANSCRIBE_EVENTS_SECRET = os.getenv('TRANSCRIBE_EVENTS_SECRET', '')
+TRANSCRIBE_POLLER_AUTOSTART = os.getenv('TRANSCRIBE_POLLER_AUTOSTART', 'true').lower() == 'true'
+
+# Local cache of finished transcripts, consulted before any AWS call
+TRANSCRIPT_CACHE_ENABLED = os.getenv('TRANSCRIPT_CACHE_ENABLED', 'true').lower() == 'true'
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv('TRANSCRIPT_CACHE_MAX_ENTRIES', '500'))
+TRANSCRIPT_CACHE_MAX_BYTES = int(os.getenv('TRANSCRIPT_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+TRANSCRIPT_CACHE_MAX_AGE = int(os.getenv('TRANSCRIPT_CACHE_MAX_AGE', str(7 * 24 * 60 * 60)))
+
+# Summaries of texts over the chat completion limit: 'mapreduce' (chunked chat completions) or 'assistant'
+SUMMARY_ENGINE = os.getenv('SUMMARY_ENGINE', 'mapreduce')
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '8000'))
+SUMMARY_CHUNK_OVERLAP = int(os.getenv('SUMMARY_CHUNK_OVERLAP', '200'))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '4'))
+# api/summarize-file/ keeps the upload in memory and answers 413 past this size
+SUMMARY_UPLOAD_MAX_BYTES = int(os.getenv('SUMMARY_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Summarize every transcript as soon as its job completes (by `manage.py run_worker`), so it is
+# ready when api/transcribe/<job_id>/summary/ is asked for. Turn off when no worker runs: the
+# summary is then made in the first request for it
+TRANSCRIPT_AUTO_SUMMARIZE = os.getenv('TRANSCRIPT_AUTO_SUMMARIZE', 'true').lower() == 'true'
+
+# Summaries are cached on a hash of the normalized text, the model and the prompt version
+SUMMARY_CACHE_ENABLED = os.getenv('SUMMARY_CACHE_ENABLED', 'true').lower() == 'true'
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', '5000'))
+SUMMARY_CACHE_MAX_BYTES = int(os.getenv('SUMMARY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+SUMMARY_CACHE_MAX_AGE = int(os.getenv('SUMMARY_CACHE_MAX_AGE', str(30 * 24 * 60 * 60)))
+
+# Concurrent requests for the same transcript or summary wait for one of them to do the work, see
+# awstranscribe.singleflight. Across processes a database lock is held at most SINGLE_FLIGHT_LOCK_TIMEOUT
+# seconds, waiters give up and do the work themselves after SINGLE_FLIGHT_WAIT seconds
+SINGLE_FLIGHT_LOCKS = os.getenv('SINGLE_FLIGHT_LOCKS', 'true').lower() == 'true'
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.getenv('SINGLE_FLIGHT_LOCK_TIMEOUT', '900'))
+SINGLE_FLIGHT_WAIT = float(os.getenv('SINGLE_FLIGHT_WAIT', '600'))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.5'))
+
+# OpenAI limits, see awstranscribe.openai_client. The quotas are per process (0 turns a limit off),
+# timeouts and the run timeout of assistant summaries are in seconds
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500'))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000'))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '16'))
+OPENAI_MAX_ATTEMPTS = int(os.getenv('OPENAI_MAX_ATTEMPTS', '5'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '1'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '30'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_RUN_TIMEOUT = float(os.getenv('OPENAI_RUN_TIMEOUT', '600'))
+
+# Database-backed job queue worked by `manage.py run_worker`
+BACKGROUND_WORKER_CONCURRENCY = int(os.getenv('BACKGROUND_WORKER_CONCURRENCY', '4'))
+BACKGROUND_WORKER_POLL_INTERVAL = float(os.getenv('BACKGROUND_WORKER_POLL_INTERVAL', '1'))
+BACKGROUND_JOB_MAX_ATTEMPTS = int(os.getenv('BACKGROUND_JOB_MAX_ATTEMPTS', '5'))
+BACKGROUND_JOB_RETRY_DELAY = float(os.getenv('BACKGROUND_JOB_RETRY_DELAY', '5'))
+BACKGROUND_JOB_MAX_RETRY_DELAY = float(os.getenv('BACKGROUND_JOB_MAX_RETRY_DELAY', '300'))
+BACKGROUND_JOB_TIMEOUT = int(os.getenv('BACKGROUND_JOB_TIMEOUT', '3600'))
+
+# Request metrics are served at /api/metrics/; with METRICS_LOG_REQUESTS every request is also
+# logged as one JSON line on the awstranscribe.metrics logger
+METRICS_LOG_REQUESTS = os.getenv('METRICS_LOG_REQUESTS', 'false').lower() == 'true'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'metrics': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'awstranscribe.metrics': {'handlers': ['metrics'], 'level': 'INFO', 'propagate': False},
+    },
+}
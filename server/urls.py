@@ -7,16 +7,57 @@ from awstranscribe.views import (
         S3FileListView, 
         TranscribeAudioViewMedical,
         SummarizeTxt,
-        SummarizeTxtFileUpload
+        SummarizeTxtFileUpload,
+        TranscriptionJobStatusView,
+        TranscriptionJobResultView,
+        TranscriptionJobSegmentsView,
+        TranscriptionJobSummaryView,
+        TranscriptionJobTextView,
+        PresignedUploadView,
+        CompleteUploadView,
+        AbortUploadView,
+        CacheStatsView,
+        MetricsView,
+        BackgroundJobView,
+        TranscriptionEventsView,
+        TranscriptionBatchView,
+        TranscriptionBatchStatusView,
+    )
+from awstranscribe.async_views import (
+        async_s3_file_list,
+        async_summarize,
+        async_transcribe,
+        async_transcribe_medical,
+        async_transcription_job_status,
     )
 
 urlpatterns = [
     path('api/register/', CreateUserView.as_view(), name='register'),
     path('api/login/', LoginView.as_view(), name='login'),
     path('api/upload/', UploadToS3.as_view(), name='upload_to_s3'),
+    path('api/upload/presign/', PresignedUploadView.as_view(), name='presigned_upload'),
+    path('api/upload/complete/', CompleteUploadView.as_view(), name='complete_upload'),
+    path('api/upload/abort/', AbortUploadView.as_view(), name='abort_upload'),
     path('api/transcribe/', TranscribeAudioView.as_view(), name='transcribe_audio'),
+    path('api/transcribe/batch/', TranscriptionBatchView.as_view(), name='transcription_batch_create'),
+    path('api/transcribe/batch/<int:batch_id>/', TranscriptionBatchStatusView.as_view(), name='transcription_batch'),
+    path('api/transcribe/events/', TranscriptionEventsView.as_view(), name='transcription_events'),
+    path('api/transcribe/<str:job_id>/status/', TranscriptionJobStatusView.as_view(), name='transcription_job_status'),
+    path('api/transcribe/<str:job_id>/result/', TranscriptionJobResultView.as_view(), name='transcription_job_result'),
+    path('api/transcribe/<str:job_id>/text/', TranscriptionJobTextView.as_view(), name='transcription_job_text'),
+    path('api/transcribe/<str:job_id>/segments/', TranscriptionJobSegmentsView.as_view(), name='transcription_job_segments'),
+    path('api/transcribe/<str:job_id>/summary/', TranscriptionJobSummaryView.as_view(), name='transcription_job_summary'),
     path('api/transcribe-medical/', TranscribeAudioViewMedical.as_view(), name='transcribe_audio_medical'),
     path('api/s3-files/', S3FileListView.as_view(), name='s3_file_list'),
     path('api/summarize/', SummarizeTxt.as_view(), name='summarize_text'),
     path('api/summarize-file/', SummarizeTxtFileUpload.as_view(), name='summarize_text'),
+    path('api/cache-stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+    path('api/jobs/<int:job_id>/', BackgroundJobView.as_view(), name='background_job'),
+    # Same endpoints for ASGI deployments, see awstranscribe.async_views
+    path('api/async/transcribe/', async_transcribe, name='async_transcribe_audio'),
+    path('api/async/transcribe/<str:job_id>/status/', async_transcription_job_status, name='async_transcription_job_status'),
+    path('api/async/transcribe-medical/', async_transcribe_medical, name='async_transcribe_audio_medical'),
+    path('api/async/s3-files/', async_s3_file_list, name='async_s3_file_list'),
+    path('api/async/summarize/', async_summarize, name='async_summarize_text'),
 ]
\ No newline at end of file